@@ -0,0 +1,851 @@
+import asyncio
+import functools
+import json
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from bot_core import DIRECT_DM_SECONDS, PickupBotCore
+from event_log import EventLog
+from message_templates import MessageCatalog
+from metrics import (STAGE_DIRECT_DM, STAGE_GROUP_CONFIRMATION, STAGE_GROUP_DENIAL, STAGE_GROUP_POST,
+                     STAGE_PRIVATE_DM, STAGE_WAIT, get_registry)
+from rate_limiter import PRIORITY_URGENT, PRIORITY_NORMAL, PRIORITY_HOUSEKEEPING
+from request_records import FinishedRequests, VolunteerRecord
+from request_store import (REQUEST_LEASE_SECONDS, RequestStore, STATE_POSTED, STATE_CLAIMED, STATE_FULFILLED,
+                           STATE_TIMED_OUT, STATE_CANCELLED)
+from resilience import REASON_CONNECT, REASON_NETWORK
+from telegram_transport import (TelegramTransport, API_BASE_URL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT,
+                                CallAttempts, Decoder, decode_response, get_transport)
+from update_dispatcher import RequestCancelled, get_dispatcher
+from volunteer_registry import VolunteerRegistry
+
+
+DEFAULT_POOL_SIZE = 100
+
+
+def failure_reason(error: Exception) -> Optional[str]:
+    """
+    Classify an exception raised by aiohttp, like resilience.failure_reason does for requests.
+
+    Args:
+        error: Exception of a failed call
+
+    Returns:
+        One of the REASON_* constants of resilience if the failure may be transient, None if it is fatal
+    """
+    if isinstance(error, aiohttp.ClientConnectorError):
+        return REASON_CONNECT
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return REASON_NETWORK
+    return None
+
+
+class AsyncTelegramTransport:
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 base_url: str = API_BASE_URL):
+        """
+        Initialize an asyncio transport for the Bot API.
+
+        Uses aiohttp when it is installed. Without it, calls are handed to the
+        pooled sync transport on the loop's default executor, so the workflow
+        still runs on the event loop and only the HTTP round trip takes a thread.
+
+        Args:
+            pool_size: Maximum number of open connections to the API host
+            connect_timeout: Seconds to wait for a TCP/TLS connection
+            read_timeout: Seconds to wait for a response once connected
+            base_url: Root URL of the Bot API
+        """
+        self.base_url = base_url.rstrip("/")
+        # Used for rate-limited chat traffic and when aiohttp is missing
+        self.sync_transport = get_transport() if base_url == API_BASE_URL else TelegramTransport(base_url=base_url)
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # Both transports reach the same host, so they share its circuit and retry settings
+        self.breaker = self.sync_transport.breaker
+        self.max_attempts = self.sync_transport.max_attempts
+        self.recorder = self.sync_transport.recorder
+        self._session = None
+
+    async def call(self, token: str, method: str, params: Optional[Dict[str, Any]] = None,
+                   read_timeout: Optional[float] = None, decoder: Decoder = decode_response,
+                   deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Call a Bot API method.
+
+        Args:
+            token: Telegram bot API token
+            method: Bot API method name, e.g. "sendMessage"
+            params: Query parameters of the call
+            read_timeout: Override of the read timeout, e.g. for long polling
+            decoder: Decodes the response, e.g. one that skips parts the caller ignores
+            deadline: Monotonic time by which the call must have ended; no retry is
+                started that could run past it
+
+        Returns:
+            Decoded JSON response of the API
+
+        Raises:
+            CircuitOpenError: If the circuit breaker rejects the call
+        """
+        if aiohttp is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(self.sync_transport.call, token, method, params, read_timeout=read_timeout,
+                                        decoder=decoder, deadline=deadline)
+            )
+
+        if self._session is None:
+            # The session binds to the running loop, so it is created lazily
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+        url = f"{self.base_url}/bot{token}/{method}"
+        read = read_timeout or self.read_timeout
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=read)
+        # The retry decisions and their reporting are the same as in the sync transport
+        attempts = CallAttempts(method, params, self.breaker, self.max_attempts, (self.connect_timeout, read),
+                                self.recorder, deadline)
+        while True:
+            attempts.begin()
+            status: Optional[int] = None
+            try:
+                async with self._session.get(url, params=params, timeout=timeout) as response:
+                    status = response.status
+                    result = decoder(status, await response.read())
+            except asyncio.CancelledError:
+                attempts.abandon()
+                raise
+            except Exception as e:
+                pause = attempts.failed(e, failure_reason(e), status)
+            else:
+                pause = attempts.answered(status, result)
+                if pause is None:
+                    return result
+            await asyncio.sleep(pause)
+
+    async def close(self) -> None:
+        """Close all pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+_async_transport: Optional[AsyncTelegramTransport] = None
+# Tasks nobody awaits, e.g. resumed workflows and queued deletions, referenced until they finish
+_background_tasks: Set["asyncio.Task[Any]"] = set()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the process-wide event loop running the async workflows, starting it on first use.
+
+    Returns:
+        The event loop, running in a daemon thread
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="telegram-async-loop")
+            thread.daemon = True
+            thread.start()
+        return _loop
+
+
+def get_async_transport() -> AsyncTelegramTransport:
+    """
+    Get the transport shared by async bots on the background loop.
+
+    Returns:
+        The shared async transport
+    """
+    global _async_transport
+    with _loop_lock:
+        if _async_transport is None:
+            _async_transport = AsyncTelegramTransport()
+        return _async_transport
+
+
+def _spawn(coroutine: Awaitable[Any]) -> "asyncio.Task[Any]":
+    """Run a coroutine as a task of the running loop that is kept alive until it finishes."""
+    task = asyncio.ensure_future(coroutine)
+    # The loop only keeps weak references to its tasks
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _traced(stage: str, request_id: str, awaitable: Awaitable[Any]) -> Any:
+    """Await a workflow step and record its duration as a stage."""
+    with get_registry().trace_stage(stage, request_id):
+        return await awaitable
+
+
+class AsyncTelegramPickupBot(PickupBotCore):
+    def __init__(self, token: str, chat_id: str, transport: Optional[AsyncTelegramTransport] = None,
+                 store: Optional[RequestStore] = None, edit_in_place: bool = False,
+                 fanout_chat_ids: Optional[List[str]] = None, volunteers: Optional[VolunteerRegistry] = None,
+                 direct_dm_seconds: float = DIRECT_DM_SECONDS, messages: Optional[MessageCatalog] = None,
+                 finished_requests: Optional[FinishedRequests] = None, events: Optional[EventLog] = None):
+        """
+        Initialize the asyncio variant of the Telegram bot.
+
+        Only the calls that wait differ from TelegramPickupBot: the records of
+        the requests are kept by PickupBotCore, and store and registry writes
+        run on the loop's default executor so they never block the loop.
+
+        Args:
+            token: Telegram bot API token
+            chat_id: ID of the group chat where announcements will be posted
+            transport: Async HTTP transport, defaults to the shared one
+            store: Durable store for requests and pending deletions, if any
+            edit_in_place: Edit the announcement into the confirmation or denial and delete
+                the volunteer's /start message together with the DM
+            fanout_chat_ids: Further group chats that receive every announcement at the same time
+            volunteers: Registry of volunteers who are messaged directly before the group post, if any
+            direct_dm_seconds: How long matched volunteers get before the request goes to the groups
+            messages: Compiled message templates, the catalog of PICKUP_LOCALE if None
+            finished_requests: History of finished requests, the process-wide one if None
+            events: Log of request lifecycle events, the one of PICKUP_EVENT_LOG if None
+        """
+        self.transport = transport or get_async_transport()
+        super().__init__(token, chat_id, self.transport.sync_transport, store=store, edit_in_place=edit_in_place,
+                         fanout_chat_ids=fanout_chat_ids, volunteers=volunteers,
+                         direct_dm_seconds=direct_dm_seconds, messages=messages,
+                         finished_requests=finished_requests, events=events)
+
+    async def _api(self, method: str, params: Optional[Dict[str, Any]] = None,
+                   read_timeout: Optional[float] = None, priority: Optional[int] = None,
+                   decoder: Decoder = decode_response) -> Dict[str, Any]:
+        """
+        Call a Bot API method through the async transport.
+
+        Calls with a priority are chat traffic and wait in the rate-limited
+        outbound queue of the token, shared with the sync bot since Telegram's
+        limits apply per bot; once due they are sent on this loop.
+
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            params: Parameters of the call
+            read_timeout: Override of the transport read timeout
+            priority: One of the PRIORITY_* constants of rate_limiter
+            decoder: Decodes the response of a call without a priority
+
+        Returns:
+            JSON response of the API
+        """
+        if priority is not None:
+            return await self._outbound_queue().call_async(method, params or {}, priority,
+                                                           functools.partial(self.transport.call, self.TOKEN))
+        return await self.transport.call(self.TOKEN, method, params, read_timeout=read_timeout, decoder=decoder)
+
+    async def _api_many(self, method: str, params_list: List[Dict[str, Any]], priority: int) -> List[Dict[str, Any]]:
+        """
+        Send several calls through the outbound queue at once and wait for all of them.
+
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            params_list: Parameters of each call
+            priority: One of the PRIORITY_* constants of rate_limiter
+
+        Returns:
+            JSON responses of the API, in the order of params_list
+        """
+        return list(await asyncio.gather(*(self._api(method, params, priority=priority) for params in params_list)))
+
+    def _api_later(self, method: str, params_list: List[Dict[str, Any]], priority: int,
+                   on_done: Callable[[List[Dict[str, Any]]], None]) -> None:
+        """
+        Queue several calls through the outbound queue without waiting for them.
+
+        Must be called on the running loop; on_done runs there once the last call finished.
+
+        Args:
+            method: Bot API method name, e.g. "deleteMessage"
+            params_list: Parameters of each call
+            priority: One of the PRIORITY_* constants of rate_limiter
+            on_done: Receives the JSON responses, in the order of params_list
+        """
+        async def send() -> None:
+            results = await asyncio.gather(*(self._api(method, params, priority=priority) for params in params_list),
+                                           return_exceptions=True)
+            on_done([{"ok": False, "description": str(result)} if isinstance(result, BaseException) else result
+                     for result in results])
+
+        _spawn(send())
+
+    async def _blocking(self, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking store or registry call on the loop's default executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    def schedule_message_deletion(self, chat_id: Union[str, int], message_id: int,
+                                  delay_seconds: int = 3600) -> asyncio.TimerHandle:
+        """
+        Schedule a message for deletion on the running event loop.
+
+        Args:
+            chat_id: Chat ID where the message was sent
+            message_id: ID of the message to delete
+            delay_seconds: Time in seconds after which to delete the message
+
+        Returns:
+            Timer handle that can be used to cancel the deletion
+        """
+        return self.schedule_messages_deletion(chat_id, [message_id], delay_seconds)
+
+    def schedule_messages_deletion(self, chat_id: Union[str, int], message_ids: List[int],
+                                   delay_seconds: float = 3600,
+                                   store_keys: Optional[List[int]] = None) -> asyncio.TimerHandle:
+        """
+        Schedule several messages of one chat for deletion with a single call.
+
+        Args:
+            chat_id: Chat ID where the messages were sent
+            message_ids: IDs of the messages to delete
+            delay_seconds: Time in seconds after which to delete the messages
+            store_keys: Keys of the deletions if they are already persisted, e.g. when reconciling
+
+        Returns:
+            Timer handle that can be used to cancel the deletion
+        """
+        loop = asyncio.get_running_loop()
+        keys = list(store_keys or [])
+        if store_keys is None and self.store is not None:
+            delete_at = time.time() + delay_seconds
+
+            async def persist() -> None:
+                keys.extend(await self._blocking(
+                    lambda: [self.store.add_deletion(chat_id, message_id, delete_at) for message_id in message_ids]
+                ))
+
+            _spawn(persist())
+
+        async def delete_after_delay() -> None:
+            await self.delete_messages(chat_id, message_ids)
+            if self.store is not None and keys:
+                await self._blocking(self.store.remove_deletions, keys)
+
+        print(f"Scheduled messages {message_ids} for deletion in {delay_seconds} seconds")
+        return loop.call_later(delay_seconds, lambda: _spawn(delete_after_delay()))
+
+    async def send_message_emergency_group(self, location: str, remarks: str, date: str, pick_up_time: str,
+                                           request_id: Optional[str] = None) -> Tuple[Optional[int], str]:
+        """
+        Send a message to the emergency group, and any fan-out groups, with pickup details.
+
+        All groups are posted to concurrently with the same request ID, so the
+        first /start from any group claims the request.
+
+        Args:
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+            request_id: ID of a request that was already offered to volunteers directly, a new one if None
+
+        Returns:
+            Tuple of (Message ID in the primary group, Request ID) if posting to any group succeeded, (None, "") otherwise
+        """
+        request_id = request_id or str(uuid.uuid4())[:8]
+        params_list = self._announcement_params(request_id, location=location, remarks=remarks, date=date,
+                                                pick_up_time=pick_up_time)
+        results = await self._api_many("sendMessage", params_list, priority=PRIORITY_URGENT)
+        return self._announced(request_id, results, location=location, remarks=remarks, date=date,
+                               pick_up_time=pick_up_time)
+
+    async def invite_volunteers(self, request_id: str, location: str, remarks: str, date: str,
+                                pick_up_time: str) -> Dict[str, int]:
+        """
+        Offer a request directly to the best-matched registered volunteers, concurrently.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+
+        Returns:
+            Dictionary mapping each invited volunteer's chat ID to the ID of the invitation message
+        """
+        matches = self._matched_volunteers(location, pick_up_time)
+        if not matches:
+            return {}
+
+        params_list = self._invitation_params(request_id, matches, location=location, remarks=remarks, date=date,
+                                              pick_up_time=pick_up_time)
+        results = await self._api_many("sendMessage", params_list, priority=PRIORITY_URGENT)
+        return self._invited(request_id, matches, results)
+
+    async def retract_invitations(self, invitations: Dict[str, int]) -> None:
+        """
+        Delete the invitation messages of a finished request, in parallel.
+
+        Args:
+            invitations: Dictionary returned by invite_volunteers
+        """
+        await asyncio.gather(*(self.delete_message(chat_id, message_id) for chat_id, message_id in invitations.items()))
+
+    async def process_updates(self, request_id: str, minutes: float = 1) -> Optional[Dict[str, VolunteerRecord]]:
+        """
+        Wait for a volunteer to claim a specific request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            minutes: Number of minutes to check for updates
+
+        Returns:
+            Dictionary of new users if any, None otherwise
+
+        Raises:
+            RequestCancelled: If cancel_request() withdrew the request during the wait
+        """
+        # One dispatcher per token and process, shared with the sync bot and the webhook receiver
+        dispatcher = get_dispatcher(self.TOKEN, self.get_bot_updates)
+        try:
+            user_info = await dispatcher.wait_for_claim_async(request_id, timeout=minutes * 60)
+        finally:
+            dispatcher.unregister(request_id)
+
+        if user_info:
+            return {str(user_info["id"]): VolunteerRecord.from_user_info(user_info)}
+
+        print(f"No user found in {minutes} minutes for request {request_id}")
+        return None
+
+    async def send_private_message(self, user_id: Union[str, int], first_name: str, contact_number: str,
+                                   location: str, remarks: str, date: str, pick_up_time: str, request_id: str,
+                                   user_message_id: Optional[int] = None) -> bool:
+        """
+        Send the donor's contact details to the volunteer.
+
+        Args:
+            user_id: User's Telegram ID
+            first_name: User's first name
+            contact_number: Contact number to share with the user
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of pickup
+            pick_up_time: Time of pickup
+            request_id: Unique request ID
+            user_message_id: ID of the user's original message to delete
+
+        Returns:
+            True if successful, False otherwise
+        """
+        params = self._private_message_params(user_id, first_name, contact_number, location=location,
+                                              remarks=remarks, date=date, pick_up_time=pick_up_time,
+                                              request_id=request_id)
+        result = await self._api("sendMessage", params, priority=PRIORITY_URGENT)
+        return self._private_message_sent(result, user_id, first_name, request_id, user_message_id)
+
+    async def delete_message(self, chat_id: Union[str, int], message_id: int) -> bool:
+        """
+        Delete a specific message.
+
+        Args:
+            chat_id: Chat ID where the message was sent
+            message_id: ID of the message to delete
+
+        Returns:
+            True if successful, False otherwise
+        """
+        result = await self._api("deleteMessage", {"chat_id": chat_id, "message_id": message_id},
+                                 priority=PRIORITY_HOUSEKEEPING)
+        return self._message_deleted(result, chat_id, message_id)
+
+    async def delete_messages(self, chat_id: Union[str, int], message_ids: List[int]) -> bool:
+        """
+        Delete several messages of one chat with as few calls as possible.
+
+        Args:
+            chat_id: Chat ID where the messages were sent
+            message_ids: IDs of the messages to delete
+
+        Returns:
+            True if all messages were deleted, False otherwise
+        """
+        if len(message_ids) == 1:
+            return await self.delete_message(chat_id, message_ids[0])
+
+        # deleteMessages accepts at most 100 IDs per call
+        params_list = [{"chat_id": chat_id, "message_ids": json.dumps(message_ids[i:i + 100])}
+                       for i in range(0, len(message_ids), 100)]
+        results = await self._api_many("deleteMessages", params_list, priority=PRIORITY_HOUSEKEEPING)
+        return self._messages_deleted(results, chat_id, message_ids)
+
+    async def delete_original_message(self, request_id: str, chat_ids: Optional[List[str]] = None) -> bool:
+        """
+        Delete the original message from every group it was posted to, in parallel.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            chat_ids: Only delete the messages in these groups, all groups if None
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if request_id not in self.active_requests:
+            print(f"No message ID available to delete for request {request_id}")
+            return False
+
+        targets = self._original_targets(request_id, chat_ids)
+        results = await self._api_many("deleteMessage", [{"chat_id": chat_id, "message_id": message_id}
+                                                         for chat_id, message_id in targets],
+                                       priority=PRIORITY_HOUSEKEEPING)
+        return self._original_deleted(request_id, targets, results)
+
+    async def edit_original_message(self, request_id: str, text: str) -> Dict[str, bool]:
+        """
+        Replace the text of the original group messages and remove their button, in parallel.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            text: New message text
+
+        Returns:
+            Dictionary mapping each group's chat ID to whether its message was edited
+        """
+        if request_id not in self.active_requests:
+            print(f"No message ID available to edit for request {request_id}")
+            return {}
+
+        results = await self._api_many("editMessageText", self._edit_params(request_id, text),
+                                       priority=PRIORITY_NORMAL)
+        return self._edited(request_id, results)
+
+    async def _post_outcome(self, request_id: str, text: str, priority: int) -> bool:
+        """
+        Tell every group how a request ended, editing the announcements in edit-in-place mode.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            text: Confirmation or denial text
+            priority: One of the PRIORITY_* constants of rate_limiter
+
+        Returns:
+            True if every group was told, False otherwise
+        """
+        if self._announced_directly(request_id):
+            return True
+
+        chat_ids = self.chat_ids
+        if self.edit_in_place:
+            edited = await self.edit_original_message(request_id, text)
+            chat_ids = [chat_id for chat_id in chat_ids if not edited.get(chat_id)]
+            if not chat_ids:
+                return True
+            # The announcement is gone or cannot be edited, post the outcome instead
+            await self.delete_original_message(request_id, chat_ids)
+
+        results = await self._api_many("sendMessage", self._outcome_params(chat_ids, text), priority=priority)
+        return all(result["ok"] for result in results)
+
+    async def send_confirmation_to_group(self, user_info: Dict[str, Any], date: str, pick_up_time: str) -> bool:
+        """
+        Send a confirmation message to the groups about who signed in.
+
+        Args:
+            user_info: Dictionary containing user information
+            date: Date of pickup
+            pick_up_time: Time of pickup
+
+        Returns:
+            True if successful, False otherwise
+        """
+        request_id = user_info.get("request_id", "")
+        message = self.messages.confirmation(user_info, date=date, pick_up_time=pick_up_time)
+        posted = await self._post_outcome(request_id, message, PRIORITY_NORMAL)
+        return self._outcome_posted(request_id, "confirmation", posted)
+
+    async def send_denial_to_group(self, request_id: str) -> bool:
+        """
+        Send a denial message to the groups that nobody signed in.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            True if successful, False otherwise
+        """
+        posted = await self._post_outcome(request_id, self.messages.denial(request_id), PRIORITY_HOUSEKEEPING)
+        return self._outcome_posted(request_id, "denial", posted)
+
+    async def run_pickup_workflow(self, location: str, date: str, pick_up_time: str, contact_number: str,
+                                  remarks: str, wait_minutes: float = 1,
+                                  on_status: Optional[Callable[[str, str], None]] = None) -> bool:
+        """
+        Run the complete pickup workflow.
+
+        Args:
+            location: Pickup location
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+            contact_number: Contact number for the pickup
+            remarks: Additional remarks of the donor
+            wait_minutes: Number of minutes to wait for responses
+            on_status: Callback receiving (request ID, state) whenever the request is posted or claimed
+
+        Returns:
+            True if a user picked up, False otherwise
+
+        Raises:
+            asyncio.CancelledError: If the task was cancelled; the group messages are retracted first
+            RequestCancelled: If cancel_request() withdrew the request before it was claimed
+        """
+        metrics = get_registry()
+        started = time.perf_counter()
+        request_id = str(uuid.uuid4())[:8]
+        new_users = None
+
+        invitations: Dict[str, int] = {}
+        try:
+            # Offer the request to the best-matched volunteers first
+            if self.volunteers is not None and self.direct_dm_seconds > 0:
+                with metrics.trace_stage(STAGE_DIRECT_DM, request_id):
+                    invitations = await self.invite_volunteers(request_id, location=location, remarks=remarks,
+                                                               date=date, pick_up_time=pick_up_time)
+                    if invitations:
+                        if on_status is not None:
+                            on_status(request_id, STATE_POSTED)
+                        new_users = await self.process_updates(request_id=request_id,
+                                                               minutes=min(self.direct_dm_seconds / 60, wait_minutes))
+
+            return await self._post_and_complete(request_id, location=location, date=date, pick_up_time=pick_up_time,
+                                                 contact_number=contact_number, remarks=remarks,
+                                                 wait_minutes=wait_minutes, started=started, new_users=new_users,
+                                                 announced=bool(invitations), on_status=on_status)
+        except (asyncio.CancelledError, RequestCancelled):
+            # The task was cancelled, e.g. by the donor; clean up before giving in
+            await self._retract_request(request_id)
+            metrics.observe_workflow(time.perf_counter() - started, STATE_CANCELLED)
+            raise
+        finally:
+            if invitations:
+                await self.retract_invitations(invitations)
+
+    async def _post_and_complete(self, request_id: str, location: str, date: str, pick_up_time: str,
+                                 contact_number: str, remarks: str, wait_minutes: float, started: float,
+                                 new_users: Optional[Dict[str, VolunteerRecord]], announced: bool,
+                                 on_status: Optional[Callable[[str, str], None]]) -> bool:
+        """
+        Post an unclaimed request to the groups, wait for a volunteer and finish the request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            location: Pickup location
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+            contact_number: Contact number for the pickup
+            remarks: Additional remarks of the donor
+            wait_minutes: Number of minutes the donor was promised in total
+            started: perf_counter() value at the start of the workflow
+            new_users: Volunteer who claimed the request from a direct message, if any
+            announced: True if on_status was already told that the request is out
+            on_status: Callback receiving (request ID, state) whenever the request is posted or claimed
+
+        Returns:
+            True if a user picked up, False otherwise
+        """
+        metrics = get_registry()
+        # The direct messages count against the time the donor was promised
+        remaining_minutes = max(wait_minutes - (time.perf_counter() - started) / 60, 0)
+
+        if not new_users:
+            with metrics.trace_stage(STAGE_GROUP_POST, request_id):
+                message_id, request_id = await self.send_message_emergency_group(
+                    location=location, remarks=remarks, date=date, pick_up_time=pick_up_time, request_id=request_id
+                )
+            if not request_id:
+                print("Failed to create pickup request")
+                return False
+        else:
+            message_id = None
+            self._track_request(request_id, {}, location=location, date=date, remarks=remarks,
+                                pick_up_time=pick_up_time)
+        # The donor waits from the submission on, and so does wait_minutes
+        self.active_requests[request_id].created_at = time.time() - (time.perf_counter() - started)
+
+        if self.store is not None:
+            await self._blocking(self.store.save_request, **self._request_row(
+                request_id, message_id, location=location, remarks=remarks, date=date, pick_up_time=pick_up_time,
+                contact_number=contact_number, remaining_minutes=remaining_minutes
+            ))
+        self._note_posted(request_id, announced=announced, on_status=on_status)
+
+        return await self._complete_pickup_workflow(request_id, location=location, date=date,
+                                                    pick_up_time=pick_up_time, contact_number=contact_number,
+                                                    remarks=remarks, wait_minutes=remaining_minutes, started=started,
+                                                    new_users=new_users, on_status=on_status)
+
+    async def _complete_pickup_workflow(self, request_id: str, location: str, date: str, pick_up_time: str,
+                                        contact_number: str, remarks: str, wait_minutes: float, started: float,
+                                        new_users: Optional[Dict[str, VolunteerRecord]] = None,
+                                        on_status: Optional[Callable[[str, str], None]] = None) -> bool:
+        """
+        Wait for a volunteer and finish a posted pickup request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            location: Pickup location
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+            contact_number: Contact number for the pickup
+            remarks: Additional remarks of the donor
+            wait_minutes: Number of minutes left to wait for responses
+            started: perf_counter() value at the start of the workflow
+            new_users: Volunteer who already claimed the request, if any
+            on_status: Callback receiving (request ID, state) when the request is claimed
+
+        Returns:
+            True if a user picked up, False otherwise
+        """
+        metrics = get_registry()
+        if location == "":
+            location = "Not specified"
+        if remarks == "":
+            remarks = "Not specified"
+
+        try:
+            if not new_users:
+                with metrics.trace_stage(STAGE_WAIT, request_id):
+                    new_users = await self.process_updates(request_id=request_id, minutes=wait_minutes)
+            wait_ended = time.time()
+
+            if new_users:
+                for user_id, volunteer in new_users.items():
+                    user_info = self._note_claim(request_id, volunteer)
+                    if self.store is not None:
+                        await self._blocking(self.store.mark_claimed, request_id, user_info)
+                    if on_status is not None:
+                        on_status(request_id, STATE_CLAIMED)
+
+                    async def notify_volunteer() -> None:
+                        sent = await self.send_private_message(
+                            user_id=user_id,
+                            first_name=volunteer.first_name,
+                            contact_number=contact_number,
+                            user_message_id=volunteer.message_id,
+                            location=location,
+                            remarks=remarks,
+                            date=date,
+                            pick_up_time=pick_up_time,
+                            request_id=request_id
+                        )
+                        self._note_private_message(request_id, volunteer, sent)
+                        # Counted after the DM, which the volunteer is waiting for
+                        if self.volunteers is not None:
+                            await self._blocking(self.volunteers.record_claim, volunteer.user_id)
+
+                    # The volunteer is waiting for the contact, the group posts can go in parallel
+                    await asyncio.gather(
+                        _traced(STAGE_PRIVATE_DM, request_id, notify_volunteer()),
+                        _traced(STAGE_GROUP_CONFIRMATION, request_id,
+                                self.send_confirmation_to_group(user_info, date=date, pick_up_time=pick_up_time))
+                    )
+                self._queue_original_deletion(request_id)
+                if self.store is not None:
+                    await self._blocking(self.store.mark_finished, request_id, STATE_FULFILLED)
+                self._finish_request(request_id, STATE_FULFILLED)
+                metrics.observe_workflow(time.perf_counter() - started, STATE_FULFILLED)
+                return True
+            else:
+                await _traced(STAGE_GROUP_DENIAL, request_id, self.send_denial_to_group(request_id))
+                self._queue_original_deletion(request_id)
+                if self.store is not None:
+                    await self._blocking(self.store.mark_finished, request_id, STATE_TIMED_OUT)
+                self._note_timed_out(request_id, wait_ended)
+                metrics.observe_workflow(time.perf_counter() - started, STATE_TIMED_OUT)
+                return False
+        except (asyncio.CancelledError, RequestCancelled):
+            # Retracted while the request is still tracked, the pop below hides it from later cleanup
+            await self._retract_request(request_id)
+            raise
+        finally:
+            self.active_requests.pop(request_id, None)
+
+    async def _retract_request(self, request_id: str) -> None:
+        """
+        Delete the group messages of a cancelled request and close it.
+
+        Args:
+            request_id: The unique ID of the pickup request
+        """
+        if request_id not in self.active_requests:
+            # Cancelled before it was posted, only the invitations have to go
+            return
+        if self._announcements(request_id):
+            await self.delete_original_message(request_id)
+        if self.store is not None:
+            await self._blocking(self.store.mark_finished, request_id, STATE_CANCELLED)
+        self._note_cancelled(request_id)
+
+    def reconcile(self) -> None:
+        """
+        Recover persisted work after a restart, like TelegramPickupBot.reconcile.
+
+        Runs on the shared background loop and blocks until the deletions are
+        handed to it; resumed requests keep running there.
+        """
+        if self.store is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._reconcile(), get_background_loop()).result()
+
+    async def _reconcile(self) -> None:
+        """Carry out expired deletions, schedule pending ones and resume open requests."""
+        now = time.time()
+        expired, pending = self._split_deletions(await self._blocking(self.store.pending_deletions), now)
+        for deletion in pending:
+            self.schedule_messages_deletion(deletion["chat_id"], [deletion["message_id"]],
+                                            deletion["delete_at"] - now, store_keys=[deletion["deletion_id"]])
+        for chat_id, deletions in expired.items():
+            await self.delete_messages(chat_id, [deletion["message_id"] for deletion in deletions])
+            await self._blocking(self.store.remove_deletions, [deletion["deletion_id"] for deletion in deletions])
+
+        await self.resume_requests()
+        await self._blocking(self.store.purge_finished)
+
+    async def resume_requests(self) -> None:
+        """
+        Resume the open requests whose lease ran out as tasks on the running loop.
+
+        While other processes hold leases of open requests, this runs again
+        once those leases could have run out, like TelegramPickupBot.resume_requests.
+        """
+        now = time.time()
+        for request in await self._blocking(self.store.take_over_requests):
+            bot, workflow_kwargs, volunteer = self._resumed_bot(request, now)
+            new_users = {str(volunteer.user_id): volunteer} if volunteer is not None else None
+            _spawn(bot._complete_pickup_workflow(started=time.perf_counter(), new_users=new_users, **workflow_kwargs))
+
+        if await self._blocking(self.store.leased_elsewhere):
+            asyncio.get_running_loop().call_later(REQUEST_LEASE_SECONDS, lambda: _spawn(self.resume_requests()))
+
+    def run_pickup_workflow_blocking(self, **workflow_kwargs: Any) -> bool:
+        """
+        Run the workflow on the shared background loop and wait for its result.
+
+        This is the sync entry point for callers like the job executor: the
+        calling thread blocks, but all waiting and polling happens on one loop.
+
+        Args:
+            **workflow_kwargs: Arguments of run_pickup_workflow
+
+        Returns:
+            True if a user picked up, False otherwise
+        """
+        future = asyncio.run_coroutine_threadsafe(self.run_pickup_workflow(**workflow_kwargs), get_background_loop())
+        return future.result()
@@ -0,0 +1,164 @@
+"""
+Memory benchmark of the request records kept by the bot.
+
+Builds many in-flight requests the way the app creates them, with
+locations, dates and time slots read back as fresh strings like a form
+submission produces, and measures the bytes held per request in three
+layouts:
+
+- dict: the free-form dict with a datetime that active_requests held before
+- record: RequestRecord with interned labels
+- record_claimed: RequestRecord with its VolunteerRecord attached
+
+Each layout is measured twice: with the object walk of
+request_records.footprint, and as the growth of the traced heap once
+the requests are built and the form values dropped.
+
+    python benchmarks/bench_request_memory.py --requests 10000 --output memory.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from request_records import FinishedRequests, RequestRecord, VolunteerRecord, footprint
+from volunteer_registry import TIME_SLOTS
+
+
+LOCATIONS = ("Otaniemi Campus, A-Block", "Kamppi Shopping Centre", "Tapiola Metro", "Leppävaara Station",
+             "Pasila Library", "Kallio Church", "Itäkeskus Fridge", "Espoo Centre")
+DATES = ("Today", "Saturday, 18 October", "Sunday, 19 October", "Monday, 20 October")
+REMARKS = ("", "Two crates of bread", "Ring the bell at the back door", "Bring bags")
+GROUP_CHAT_ID = "-1001234567890"
+
+
+def fresh(text: str) -> str:
+    """Copy a string into a new object, as a form submission produces."""
+    return text.encode().decode()
+
+
+def request_fields(count: int, seed: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Build the fields of count requests.
+
+    Every string is a new object, as it is when Streamlit hands over form
+    values, so any sharing between requests is done by the layout.
+    """
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        fields = {
+            "location": fresh(rng.choice(LOCATIONS)),
+            "date": fresh(rng.choice(DATES)),
+            "remarks": fresh(rng.choice(REMARKS)),
+            "pick_up_time": fresh(rng.choice(TIME_SLOTS)),
+        }
+        requests.append((f"{rng.getrandbits(32):08x}", fields))
+    return requests
+
+
+def claim(rng: random.Random) -> Dict[str, Any]:
+    """User info of a volunteer's /start claim."""
+    user_id = rng.randint(10 ** 8, 10 ** 9)
+    return {"id": user_id, "first_name": fresh(rng.choice(("Anna", "Mikko", "Sofia", "Juha"))),
+            "username": f"vol{user_id}", "message_id": rng.randint(1, 10 ** 6),
+            "claimed_at": time.time(), "detected_at": time.time()}
+
+
+def build_dicts(requests: List[Tuple[str, Dict[str, Any]]], seed: int) -> List[Dict[str, Any]]:
+    """Build requests the way active_requests held them before."""
+    built = []
+    for index, (request_id, fields) in enumerate(requests):
+        built.append({
+            "message_id": 1000 + index,
+            "announcements": {GROUP_CHAT_ID: 1000 + index},
+            "location": fields["location"],
+            "date": fields["date"],
+            "remarks": fields["remarks"],
+            "pick_up_time": fields["pick_up_time"],
+            "created_at": datetime.now(),
+            "fulfilled": False
+        })
+    return built
+
+
+def build_records(requests: List[Tuple[str, Dict[str, Any]]], seed: int) -> List[RequestRecord]:
+    """Build requests as RequestRecords."""
+    return [RequestRecord(request_id, 1000 + index, {GROUP_CHAT_ID: 1000 + index}, **fields)
+            for index, (request_id, fields) in enumerate(requests)]
+
+
+def build_claimed_records(requests: List[Tuple[str, Dict[str, Any]]], seed: int) -> List[RequestRecord]:
+    """Build requests as RequestRecords claimed by a volunteer."""
+    rng = random.Random(seed)
+    records = build_records(requests, seed)
+    for record in records:
+        record.claim(VolunteerRecord.from_user_info(claim(rng)))
+    return records
+
+
+def measure(build: Callable[[List[Tuple[str, Dict[str, Any]]], int], List[Any]], count: int,
+            seed: int) -> Dict[str, Any]:
+    """
+    Build count requests in one layout and measure them.
+
+    Returns:
+        Bytes per request by object walk and by traced allocations
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    requests = request_fields(count, seed)
+    built = build(requests, seed)
+    # Form values a layout does not keep are freed with the submissions
+    del requests
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    walked = footprint(built)
+    return {
+        "bytes_per_request": walked["bytes_per_record"],
+        "traced_bytes_per_request": round(traced / count, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the memory held per in-flight pickup request.")
+    parser.add_argument("--requests", type=int, default=10000, help="Number of in-flight requests")
+    parser.add_argument("--history", type=int, default=500, help="Bound of the finished request history")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for name, build in (("dict", build_dicts), ("record", build_records), ("record_claimed", build_claimed_records)):
+        results[name] = measure(build, args.requests, args.seed)
+
+    # Finishing every request must not grow the history beyond its bound
+    history = FinishedRequests(max_size=args.history)
+    for record in build_claimed_records(request_fields(args.requests, args.seed), args.seed):
+        record.finish("fulfilled")
+        history.add(record)
+
+    report = {
+        "requests": args.requests,
+        "python": sys.version.split()[0],
+        "results": results,
+        "saving": round(1 - results["record"]["bytes_per_request"] / results["dict"]["bytes_per_request"], 3),
+        "history": dict(history.footprint(), bound=args.history)
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Microbenchmark of getUpdates response decoding.
+
+Compares decoding every batch in full with json.loads against
+decode_updates, which reduces batches without a "/start " claim to their
+last update ID, on recorded or synthetic getUpdates bodies. A middle
+column decodes in full with orjson, if installed, to separate the gain of
+the library from that of the prefilter. All paths must find the same
+claims.
+
+    python benchmarks/bench_update_decoding.py --input updates.jsonl --repeat 20
+    python benchmarks/bench_update_decoding.py --batches 2000 --claim-share 0.02
+
+An input file holds one raw getUpdates response body per line.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegram_transport
+from update_dispatcher import decode_updates, parse_start_update
+
+
+GROUP_CHAT = {"id": -1001234567890, "title": "Foodsavers", "type": "supergroup"}
+CHATTER = ("Anyone near Otaniemi today?", "Thanks for the pickup!", "Bread left at the station, come quick",
+           "Is the Kamppi fridge full?", "I can take the evening slot", "Photo of today's haul")
+
+
+def synthetic_batches(count: int, batch_size: int, claim_share: float, seed: int) -> List[bytes]:
+    """
+    Build getUpdates bodies of group chatter with an occasional private /start claim.
+
+    Args:
+        count: Number of batches
+        batch_size: Updates per batch
+        claim_share: Probability that an update is a claim
+        seed: Seed of the random generator
+
+    Returns:
+        Raw response bodies, encoded the way Telegram does with escaped slashes
+    """
+    rng = random.Random(seed)
+    update_id = 100000
+    bodies = []
+    for _ in range(count):
+        updates = []
+        for _ in range(batch_size):
+            update_id += 1
+            user = {"id": rng.randint(10 ** 8, 10 ** 9), "is_bot": False, "first_name": "Volunteer", "username": "vol"}
+            if rng.random() < claim_share:
+                chat = {"id": user["id"], "first_name": "Volunteer", "username": "vol", "type": "private"}
+                text = f"/start {rng.getrandbits(32):08x}"
+                entities = [{"offset": 0, "length": 6, "type": "bot_command"}]
+            else:
+                chat = GROUP_CHAT
+                text = rng.choice(CHATTER)
+                entities = []
+            message = {"message_id": update_id, "from": user, "chat": chat, "date": 1760000000 + update_id, "text": text}
+            if entities:
+                message["entities"] = entities
+            updates.append({"update_id": update_id, "message": message})
+        body = json.dumps({"ok": True, "result": updates}, separators=(",", ":"), ensure_ascii=False)
+        bodies.append(body.replace("/", "\\/").encode())
+    return bodies
+
+
+def stdlib_decode(status: int, body: bytes) -> Dict[str, Any]:
+    """Decode a response the way getUpdates did before, with the standard library."""
+    return json.loads(body)
+
+
+def library_decode(status: int, body: bytes) -> Dict[str, Any]:
+    """Decode a response in full with the fastest installed JSON library."""
+    return telegram_transport.json_loads(body)
+
+
+def run(decoder: Callable[[int, bytes], Dict[str, Any]], bodies: List[bytes], repeat: int) -> Tuple[float, int]:
+    """
+    Decode every body and extract its claims, repeat times.
+
+    Returns:
+        Tuple of (seconds, claims found per pass)
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        claims = 0
+        for body in bodies:
+            for update in decoder(200, body)["result"]:
+                if parse_start_update(update) is not None:
+                    claims += 1
+    return time.perf_counter() - started, claims
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark getUpdates response decoding.")
+    parser.add_argument("--input", help="File with one recorded getUpdates response body per line")
+    parser.add_argument("--batches", type=int, default=1000, help="Number of synthetic batches")
+    parser.add_argument("--batch-size", type=int, default=20, help="Updates per synthetic batch")
+    parser.add_argument("--claim-share", type=float, default=0.01, help="Share of synthetic updates that are claims")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over all batches per decoder")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, "rb") as f:
+            bodies = [line.rstrip(b"\n") for line in f if line.strip()]
+    else:
+        bodies = synthetic_batches(args.batches, args.batch_size, args.claim_share, args.seed)
+
+    total_bytes = sum(len(body) for body in bodies)
+    results = {}
+    for name, decoder in (("json_full", stdlib_decode), ("library_full", library_decode),
+                          ("decode_updates", decode_updates)):
+        seconds, claims = run(decoder, bodies, args.repeat)
+        results[name] = {
+            "seconds": round(seconds, 4),
+            "batches_per_second": round(len(bodies) * args.repeat / seconds),
+            "mb_per_second": round(total_bytes * args.repeat / seconds / 1e6, 1),
+            "claims": claims
+        }
+
+    if len({result["claims"] for result in results.values()}) != 1:
+        print("Claims differ between the decoders", file=sys.stderr)
+        sys.exit(1)
+
+    skipped = sum(1 for body in bodies
+                  if all("message" not in update for update in decode_updates(200, body)["result"]))
+    print(json.dumps({
+        "batches": len(bodies),
+        "bytes": total_bytes,
+        "json_library": "orjson" if telegram_transport.orjson is not None else "json",
+        "prefiltered_batches": skipped,
+        "results": results,
+        "speedup": round(results["json_full"]["seconds"] / results["decode_updates"]["seconds"], 2)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Load test of the end-to-end pickup workflow against the fake Bot API.
+
+Runs many concurrent donors through TelegramPickupBot.run_pickup_workflow
+(or the async bot) while simulated volunteers claim requests after a
+configurable delay, then reports latency percentiles, Telegram calls per
+request, peak threads and peak RSS.
+
+    python benchmarks/bench_workflow.py --donors 200 --claim-dist exponential:8 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limiter
+from async_bot import AsyncTelegramPickupBot, AsyncTelegramTransport, get_background_loop
+from config import TelegramPickupBot
+from fake_telegram_server import FakeTelegramServer
+from telegram_transport import TelegramTransport
+
+
+REQUEST_ID_PATTERN = re.compile(r"\(ID: ([\w-]+)\)")
+
+
+class RecordingFakeServer(FakeTelegramServer):
+    """Fake Bot API that remembers when claims happened and when the DMs went out."""
+
+    def __init__(self):
+        super().__init__()
+        self.claimed_at: Dict[str, float] = {}
+        self.dm_sent_at: Dict[str, float] = {}
+
+    def click_start(self, request_id: str, user_id: Optional[int] = None, first_name: str = "Volunteer",
+                    username: str = "", delay: float = 0.0) -> None:
+        def record_and_click():
+            self.claimed_at.setdefault(request_id, time.perf_counter())
+            super(RecordingFakeServer, self).click_start(request_id, user_id, first_name, username)
+
+        timer = threading.Timer(delay, record_and_click)
+        timer.daemon = True
+        timer.start()
+
+    def _api_sendMessage(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        status, payload = super()._api_sendMessage(params)
+        if not str(params.get("chat_id", "")).startswith("-") and "tel:" in params.get("text", ""):
+            match = REQUEST_ID_PATTERN.search(params["text"])
+            if match:
+                self.dm_sent_at.setdefault(match.group(1), time.perf_counter())
+        return status, payload
+
+
+def parse_claim_distribution(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a claim-delay distribution.
+
+    Args:
+        spec: "fixed:<s>", "uniform:<low>-<high>" or "exponential:<mean>", all in seconds
+
+    Returns:
+        Function drawing one claim delay from a random generator
+    """
+    kind, _, value = spec.partition(":")
+    if kind == "fixed":
+        delay = float(value)
+        return lambda rng: delay
+    if kind == "uniform":
+        low, high = (float(v) for v in value.split("-"))
+        return lambda rng: rng.uniform(low, high)
+    if kind == "exponential":
+        mean = float(value)
+        return lambda rng: rng.expovariate(1 / mean)
+    raise ValueError(f"Unknown claim distribution: {spec}")
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """Return p50, p95, p99 and max of the samples in milliseconds."""
+    if not samples:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+class PeakSampler:
+    """Samples the thread count in the background and keeps the maximum."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_threads = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_benchmark(donors: int, wait_seconds: float, claim_probability: float, claim_delay: Callable[[random.Random], float],
+                  groups: int, ramp_seconds: float, latency: float, use_async: bool, seed: int,
+                  edit_in_place: bool = False, fanout: int = 1) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    server = RecordingFakeServer()
+    server.latency = latency
+    server.auto_claim = lambda request_id: claim_delay(rng) if rng.random() < claim_probability else None
+    server.start()
+
+    token = f"bench-{seed}-{time.time_ns()}"
+    if use_async:
+        transport = AsyncTelegramTransport(base_url=server.base_url)
+    else:
+        transport = TelegramTransport(base_url=server.base_url, pool_size=32)
+
+    submitted_at: Dict[int, float] = {}
+    posted_at: Dict[int, float] = {}
+    request_ids: Dict[int, str] = {}
+    outcomes: List[bool] = []
+    errors: List[str] = []
+
+    def donor_bot(index: int) -> Any:
+        chat_id = f"-100{index % groups}"
+        fanout_chat_ids = [f"-200{index % groups}{k}" for k in range(1, fanout)]
+        bot_class = AsyncTelegramPickupBot if use_async else TelegramPickupBot
+        return bot_class(token=token, chat_id=chat_id, transport=transport, edit_in_place=edit_in_place,
+                         fanout_chat_ids=fanout_chat_ids)
+
+    def workflow_kwargs(index: int) -> Dict[str, Any]:
+        def on_status(request_id: str, status: str) -> None:
+            request_ids[index] = request_id
+            if status == "posted":
+                posted_at[index] = time.perf_counter()
+
+        return dict(location="Bench Hall", date="Today", pick_up_time="16:00 - 18:00",
+                    contact_number="+358 40 0000000", remarks="", wait_minutes=wait_seconds / 60,
+                    on_status=on_status)
+
+    def donor(index: int) -> None:
+        time.sleep(ramp_seconds * index / max(donors, 1))
+        bot, kwargs = donor_bot(index), workflow_kwargs(index)
+        submitted_at[index] = time.perf_counter()
+        try:
+            outcomes.append(bot.run_pickup_workflow(**kwargs))
+        except Exception as e:
+            errors.append(str(e))
+
+    async def async_donor(index: int) -> None:
+        await asyncio.sleep(ramp_seconds * index / max(donors, 1))
+        bot, kwargs = donor_bot(index), workflow_kwargs(index)
+        submitted_at[index] = time.perf_counter()
+        try:
+            outcomes.append(await bot.run_pickup_workflow(**kwargs))
+        except Exception as e:
+            errors.append(str(e))
+
+    async def async_donors() -> None:
+        await asyncio.gather(*(async_donor(i) for i in range(donors)))
+
+    started = time.perf_counter()
+    with PeakSampler() as sampler:
+        if use_async:
+            # All donors are coroutines on the bot's own loop, so peak_threads counts only the bot's threads
+            asyncio.run_coroutine_threadsafe(async_donors(), get_background_loop()).result()
+        else:
+            threads = [threading.Thread(target=donor, args=(i,), daemon=True) for i in range(donors)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    elapsed = time.perf_counter() - started
+    # Without aiohttp the async transport sends through its sync one as well
+    connections = (transport.sync_transport if use_async else transport).connection_stats()
+    connections["reuse_ratio"] = round(connections["reuse_ratio"], 3)
+    server.stop()
+
+    submit_to_post = [posted_at[i] - submitted_at[i] for i in posted_at]
+    claim_to_dm = [server.dm_sent_at[rid] - server.claimed_at[rid]
+                   for rid in request_ids.values() if rid in server.dm_sent_at and rid in server.claimed_at]
+    total_calls = sum(server.calls.values())
+
+    return {
+        "config": {"donors": donors, "wait_seconds": wait_seconds, "claim_probability": claim_probability,
+                   "groups": groups, "ramp_seconds": ramp_seconds, "api_latency_s": latency,
+                   "async": use_async, "edit_in_place": edit_in_place, "fanout": fanout, "seed": seed},
+        "elapsed_s": round(elapsed, 3),
+        "fulfilled": sum(1 for outcome in outcomes if outcome),
+        "timed_out": sum(1 for outcome in outcomes if not outcome),
+        "errors": len(errors),
+        "submit_to_post": percentiles(submit_to_post),
+        "claim_to_dm": percentiles(claim_to_dm),
+        "telegram_calls": dict(server.calls),
+        "telegram_calls_per_request": round(total_calls / max(donors, 1), 2),
+        "connections": connections,
+        "peak_threads": sampler.peak_threads,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the pickup workflow against a local fake Bot API.")
+    parser.add_argument("--donors", type=int, default=50, help="Number of concurrent pickup requests")
+    parser.add_argument("--wait-seconds", type=float, default=20, help="wait_minutes of each request, in seconds")
+    parser.add_argument("--claim-probability", type=float, default=0.8, help="Share of requests a volunteer claims")
+    parser.add_argument("--claim-dist", default="exponential:5",
+                        help="Claim delay: fixed:<s>, uniform:<low>-<high> or exponential:<mean>")
+    parser.add_argument("--groups", type=int, default=1, help="Number of group chats the donors are spread over")
+    parser.add_argument("--ramp-seconds", type=float, default=0, help="Spread the donor start over this many seconds")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Artificial latency of each API call in seconds")
+    parser.add_argument("--unthrottled", action="store_true",
+                        help="Lift the per-chat rate limits to measure the bot's own overhead")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the asyncio bot")
+    parser.add_argument("--edit-in-place", action="store_true",
+                        help="Edit the announcement instead of deleting it and posting a new message")
+    parser.add_argument("--fanout", type=int, default=1,
+                        help="Number of groups each request is posted to; every group's post may be claimed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.unthrottled:
+        rate_limiter.GROUP_RATE = rate_limiter.PRIVATE_RATE = rate_limiter.GLOBAL_RATE = 1e6
+        rate_limiter.GROUP_BURST = rate_limiter.PRIVATE_BURST = rate_limiter.GLOBAL_BURST = 1e6
+
+    results = run_benchmark(donors=args.donors, wait_seconds=args.wait_seconds,
+                            claim_probability=args.claim_probability,
+                            claim_delay=parse_claim_distribution(args.claim_dist), groups=args.groups,
+                            ramp_seconds=args.ramp_seconds, latency=args.api_latency,
+                            use_async=args.use_async, seed=args.seed,
+                            edit_in_place=args.edit_in_place, fanout=args.fanout)
+    results["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
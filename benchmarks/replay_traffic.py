@@ -0,0 +1,283 @@
+"""
+Replay a recorded Telegram traffic log against the fake Bot API.
+
+Reads one session of a log written with PICKUP_TRAFFIC_LOG and plays it
+back in real time or faster:
+
+- Every request announced in a recorded group post starts a new
+  pickup workflow at the same point in time. Where, when and the
+  remarks are taken from the recorded post.
+- Every recorded update is pushed to the fake API when it was received.
+- Recorded /start claims are rewritten to the request IDs of the replayed
+  workflows, so claims arrive as many seconds after the post as they did
+  in production.
+
+The report compares the calls of the replay with the recording and gives
+the claim-to-DM latency.
+
+    python benchmarks/replay_traffic.py traffic.log --speed 10 --output replay.json
+"""
+import argparse
+import html
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_bot import AsyncTelegramPickupBot, AsyncTelegramTransport
+from bench_workflow import RecordingFakeServer, percentiles
+from config import TelegramPickupBot
+from telegram_transport import TelegramTransport
+from traffic_log import read_session
+
+
+START_LINK_PATTERN = re.compile(r"[?&]start=([\w-]+)")
+ANNOUNCEMENT_FIELDS = {name: re.compile(rf"<b>{label}:</b> <i>(.*?)</i>")
+                       for name, label in (("location", "Where"), ("date", "When"), ("pick_up_time", "Time"),
+                                           ("remarks", "Note"))}
+
+# Stands in for the redacted number of the donor
+REPLAY_CONTACT_NUMBER = "+358 40 0000000"
+
+EVENT_REQUEST = 0
+EVENT_UPDATE = 1
+
+
+def recorded_requests(entries: List[Dict[str, Any]]) -> List[Tuple[float, str, List[str], Dict[str, str]]]:
+    """
+    Find the requests announced in the recording.
+
+    Args:
+        entries: Entries of the session
+
+    Returns:
+        One tuple of (time, recorded request ID, group chat IDs, workflow arguments) per request, in order
+    """
+    requests: Dict[str, Tuple[float, str, List[str], Dict[str, str]]] = {}
+    for entry in entries:
+        params = entry["p"]
+        if entry["m"] != "sendMessage" or not str(params.get("chat_id", "")).startswith("-"):
+            continue
+        match = START_LINK_PATTERN.search(str(params.get("reply_markup", "")))
+        if match is None:
+            continue
+        request_id = match.group(1)
+        if request_id in requests:
+            # Further groups of a fan-out post
+            requests[request_id][2].append(str(params["chat_id"]))
+            continue
+        text = params.get("text", "")
+        fields = {}
+        for name, pattern in ANNOUNCEMENT_FIELDS.items():
+            field = pattern.search(text)
+            fields[name] = html.unescape(field.group(1)) if field else ""
+        # The post is sent when the workflow is already running, the round trip is the best guess of the start
+        started = max(entry["t"] - entry.get("ms", 0) / 1000, 0.0)
+        requests[request_id] = (started, request_id, [str(params["chat_id"])], fields)
+    return sorted(requests.values())
+
+
+def recorded_updates(entries: List[Dict[str, Any]]) -> List[Tuple[float, Dict[str, Any]]]:
+    """
+    Collect the updates of the recording, each once.
+
+    Args:
+        entries: Entries of the session
+
+    Returns:
+        One tuple of (time received, update) per update, in order
+    """
+    seen = set()
+    updates = []
+    for entry in entries:
+        for update in entry.get("u", ()):
+            # Batches without a claim were recorded as their last update ID only
+            if update["update_id"] in seen or len(update) == 1:
+                continue
+            seen.add(update["update_id"])
+            updates.append((entry["t"], update))
+    return updates
+
+
+def recorded_claim(update: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Return (recorded request ID, private chat) if the update is a /start claim."""
+    message = update.get("message") or {}
+    chat = message.get("chat") or {}
+    parts = message.get("text", "").split()
+    if chat.get("type") != "private" or len(parts) < 2 or parts[0] != "/start":
+        return None
+    return parts[1], chat
+
+
+class Replay:
+    def __init__(self, entries: List[Dict[str, Any]], speed: float, wait_minutes: float, use_async: bool,
+                 edit_in_place: bool):
+        """
+        Prepare the replay of a session.
+
+        Args:
+            entries: Entries of the session
+            speed: Speed-up factor, 1 replays in real time
+            wait_minutes: How long each workflow waits for a claim, in recorded time
+            use_async: Replay with the asyncio bot
+            edit_in_place: Run the bots in edit-in-place mode
+        """
+        self.speed = speed
+        self.wait_minutes = wait_minutes
+        self.use_async = use_async
+        self.edit_in_place = edit_in_place
+        self.requests = recorded_requests(entries)
+        self.updates = recorded_updates(entries)
+        self.recorded_calls: Dict[str, int] = {}
+        for entry in entries:
+            self.recorded_calls[entry["m"]] = self.recorded_calls.get(entry["m"], 0) + 1
+
+        self.server = RecordingFakeServer()
+        self._lock = threading.Lock()
+        # Recorded request ID -> request ID of the replayed workflow
+        self._request_ids: Dict[str, str] = {}
+        # Claims that arrived before their workflow posted, by recorded request ID
+        self._early_claims: Dict[str, List[Dict[str, Any]]] = {}
+        self.outcomes: List[bool] = []
+        self.errors: List[str] = []
+        self.claims_replayed = 0
+        self.claims_unmatched = 0
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Play the session back and wait for all workflows to end.
+
+        Returns:
+            The report
+        """
+        self.server.start()
+        token = f"replay-{time.time_ns()}"
+        if self.use_async:
+            transport = AsyncTelegramTransport(base_url=self.server.base_url)
+        else:
+            transport = TelegramTransport(base_url=self.server.base_url, pool_size=32)
+
+        events = [(at, EVENT_REQUEST, index) for index, (at, _, _, _) in enumerate(self.requests)]
+        events += [(at, EVENT_UPDATE, index) for index, (at, _) in enumerate(self.updates)]
+        events.sort()
+
+        threads: List[threading.Thread] = []
+        started = time.perf_counter()
+        for at, kind, index in events:
+            delay = started + at / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if kind == EVENT_REQUEST:
+                thread = threading.Thread(target=self._run_workflow, args=(token, transport, self.requests[index]),
+                                          daemon=True)
+                thread.start()
+                threads.append(thread)
+            else:
+                self._push_update(self.updates[index][1])
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        self.server.stop()
+
+        claim_to_dm = [self.server.dm_sent_at[rid] - self.server.claimed_at[rid]
+                       for rid in self._request_ids.values()
+                       if rid in self.server.dm_sent_at and rid in self.server.claimed_at]
+        return {
+            "config": {"speed": self.speed, "wait_minutes": self.wait_minutes, "async": self.use_async,
+                       "edit_in_place": self.edit_in_place},
+            "elapsed_s": round(elapsed, 3),
+            "recorded_span_s": round(events[-1][0], 3) if events else 0.0,
+            "requests": len(self.requests),
+            "updates": len(self.updates),
+            "claims_replayed": self.claims_replayed,
+            "claims_unmatched": self.claims_unmatched,
+            "fulfilled": sum(1 for outcome in self.outcomes if outcome),
+            "timed_out": sum(1 for outcome in self.outcomes if not outcome),
+            "errors": len(self.errors),
+            "claim_to_dm": percentiles(claim_to_dm),
+            "recorded_calls": self.recorded_calls,
+            "replayed_calls": dict(self.server.calls)
+        }
+
+    def _run_workflow(self, token: str, transport: Any, request: Tuple[float, str, List[str], Dict[str, str]]) -> None:
+        """Run the workflow of one recorded request."""
+        _, recorded_id, chat_ids, fields = request
+        bot_class = AsyncTelegramPickupBot if self.use_async else TelegramPickupBot
+        bot = bot_class(token=token, chat_id=chat_ids[0], transport=transport, edit_in_place=self.edit_in_place,
+                        fanout_chat_ids=chat_ids[1:])
+
+        def on_status(request_id: str, status: str) -> None:
+            with self._lock:
+                if recorded_id in self._request_ids:
+                    return
+                self._request_ids[recorded_id] = request_id
+                early_claims = self._early_claims.pop(recorded_id, [])
+            for chat in early_claims:
+                self._click(request_id, chat)
+
+        kwargs = dict(location=fields["location"], date=fields["date"] or "Today",
+                      pick_up_time=fields["pick_up_time"], remarks=fields["remarks"],
+                      contact_number=REPLAY_CONTACT_NUMBER, wait_minutes=self.wait_minutes / self.speed,
+                      on_status=on_status)
+        try:
+            if self.use_async:
+                self.outcomes.append(bot.run_pickup_workflow_blocking(**kwargs))
+            else:
+                self.outcomes.append(bot.run_pickup_workflow(**kwargs))
+        except Exception as e:
+            self.errors.append(str(e))
+
+    def _push_update(self, update: Dict[str, Any]) -> None:
+        """Hand a recorded update to the fake API, pointing claims at the replayed requests."""
+        claim = recorded_claim(update)
+        if claim is None:
+            self.server.push_update({kind: value for kind, value in update.items() if kind != "update_id"})
+            return
+        recorded_id, chat = claim
+        with self._lock:
+            request_id = self._request_ids.get(recorded_id)
+            if request_id is None:
+                if not any(recorded_id == request[1] for request in self.requests):
+                    self.claims_unmatched += 1
+                    return
+                self._early_claims.setdefault(recorded_id, []).append(chat)
+                return
+        self._click(request_id, chat)
+
+    def _click(self, request_id: str, chat: Dict[str, Any]) -> None:
+        """Send a recorded volunteer's /start for a replayed request."""
+        with self._lock:
+            self.claims_replayed += 1
+        self.server.click_start(request_id, chat.get("id"), chat.get("first_name", "Volunteer"),
+                                chat.get("username", ""))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded traffic log against a local fake Bot API.")
+    parser.add_argument("log", help="Traffic log written with PICKUP_TRAFFIC_LOG")
+    parser.add_argument("--session", type=int, default=0, help="Session of the log to replay, 0 is the first")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up factor, 1 replays in real time")
+    parser.add_argument("--wait-minutes", type=float, default=15,
+                        help="How long each workflow waits for a claim, in recorded time")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the asyncio bot")
+    parser.add_argument("--edit-in-place", action="store_true", help="Run the bots in edit-in-place mode")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    header, entries = read_session(args.log, args.session)
+    report = Replay(entries, args.speed, args.wait_minutes, args.use_async, args.edit_in_place).run()
+    report["session_started"] = header["started"]
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,577 @@
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from event_log import (EVENT_CANCELLED, EVENT_CLAIMED, EVENT_DELETED, EVENT_DM_SENT, EVENT_POSTED, EVENT_TIMED_OUT,
+                       EventLog, get_event_log)
+from message_templates import MessageCatalog, get_catalog
+from metrics import STAGE_CLAIM_DETECTION, STAGE_DELETE_ORIGINAL, get_registry
+from rate_limiter import PRIORITY_HOUSEKEEPING, OutboundQueue, get_outbound_queue
+from request_records import (FinishedRequests, RequestRecord, VolunteerRecord, footprint, get_finished_requests,
+                             resumed_request)
+from request_store import STATE_CANCELLED, STATE_FULFILLED, STATE_POSTED, STATE_TIMED_OUT, RequestStore
+from telegram_transport import TelegramTransport
+from update_dispatcher import ALLOWED_UPDATES_PARAM, LONG_POLL_TIMEOUT, decode_updates, get_dispatcher
+from volunteer_registry import VolunteerRegistry
+
+
+# How long the best-matched volunteers get to claim a request before it is posted to the group
+DIRECT_DM_SECONDS = 120
+
+# Maximum number of volunteers messaged directly per request
+DIRECT_DM_LIMIT = 10
+
+# How long the DM with the contact number stays in the volunteer's chat
+PRIVATE_MESSAGE_SECONDS = 900
+
+
+class PickupBotCore:
+    """
+    State and record keeping shared by TelegramPickupBot and AsyncTelegramPickupBot.
+
+    Nothing here waits for the Bot API: the subclasses send the calls, blocking
+    or as coroutines, and hand the responses to the helpers below, which build
+    the parameters, interpret the results and keep the records, the store
+    rows, the event log and the metrics of a request in step.
+    """
+
+    def __init__(self, token: str, chat_id: str, sync_transport: TelegramTransport,
+                 store: Optional[RequestStore] = None, edit_in_place: bool = False,
+                 fanout_chat_ids: Optional[List[str]] = None, volunteers: Optional[VolunteerRegistry] = None,
+                 direct_dm_seconds: float = DIRECT_DM_SECONDS, messages: Optional[MessageCatalog] = None,
+                 finished_requests: Optional[FinishedRequests] = None, events: Optional[EventLog] = None):
+        """
+        Initialize the state of a bot.
+
+        Args:
+            token: Telegram bot API token
+            chat_id: ID of the group chat where announcements will be posted
+            sync_transport: Blocking transport for getUpdates, setWebhook and the outbound queue
+            store: Durable store for requests and pending deletions, if any
+            edit_in_place: Edit the announcement into the confirmation or denial instead of
+                deleting it and posting a new message, and delete the volunteer's /start
+                message together with the DM
+            fanout_chat_ids: Further group chats that receive every announcement at the same time
+            volunteers: Registry of volunteers who are messaged directly before the group post, if any
+            direct_dm_seconds: How long matched volunteers get before the request goes to the groups
+            messages: Compiled message templates, the catalog of PICKUP_LOCALE if None
+            finished_requests: History of finished requests, the process-wide one if None
+            events: Log of request lifecycle events, the one of PICKUP_EVENT_LOG if None
+        """
+        self.TOKEN = token
+        self.volunteers = volunteers
+        self.direct_dm_seconds = direct_dm_seconds
+        self.messages = messages or get_catalog()
+        self.edit_in_place = edit_in_place
+        # The first group is the primary one, duplicates would post twice
+        self.chat_ids: List[str] = list(dict.fromkeys([chat_id] + list(fanout_chat_ids or [])))
+        self.chat_id = chat_id
+        self.sync_transport = sync_transport
+        self.store = store
+        self.active_requests: Dict[str, RequestRecord] = {}
+        self.finished_requests = finished_requests or get_finished_requests()
+        self.events = events or get_event_log()
+
+    def _outbound_queue(self) -> OutboundQueue:
+        """Return the rate-limited queue of the token, shared by every bot of this process."""
+        return get_outbound_queue(self.TOKEN, self.sync_transport)
+
+    def _api_later(self, method: str, params_list: List[Dict[str, Any]], priority: int,
+                   on_done: Callable[[List[Dict[str, Any]]], None]) -> None:
+        """
+        Queue several calls through the outbound queue without waiting for them.
+
+        Used for housekeeping that must not hold up the messages a user is
+        waiting for; on_done runs on a send worker once the last call finished.
+
+        Args:
+            method: Bot API method name, e.g. "deleteMessage"
+            params_list: Parameters of each call
+            priority: One of the PRIORITY_* constants of rate_limiter
+            on_done: Receives the JSON responses, in the order of params_list
+        """
+        self._outbound_queue().submit_many(method, params_list, priority, on_done)
+
+    def _track_request(self, request_id: str, announcements: Dict[str, int], location: str, date: str,
+                       remarks: str, pick_up_time: str) -> None:
+        """Remember a request and its group messages in active_requests."""
+        self.active_requests[request_id] = RequestRecord(request_id, announcements.get(self.chat_id), announcements,
+                                                         location=location, date=date, remarks=remarks,
+                                                         pick_up_time=pick_up_time)
+
+    def _finish_request(self, request_id: str, state: str) -> None:
+        """Move a request from active_requests to the bounded history of finished requests."""
+        record = self.active_requests.pop(request_id, None)
+        if record is not None:
+            record.finish(state)
+            self.finished_requests.add(record)
+
+    def _log_event(self, event: str, request_id: str, waited_until: Optional[float] = None, **fields: Any) -> None:
+        """
+        Write a lifecycle event of a request to the event log, if there is one.
+
+        Args:
+            event: One of the EVENT_* constants of event_log
+            request_id: The unique ID of the pickup request
+            waited_until: Unix time the wait for a volunteer ended, to log the wait since the post
+            fields: Further keys of the event
+        """
+        if self.events is None:
+            return
+        # Deletions are logged once done, after the request may have finished
+        record = self.active_requests.get(request_id) or self.finished_requests.get(request_id)
+        if record is not None:
+            fields.update(slot=record.pick_up_time, date=record.date, loc=record.location)
+            if waited_until is not None:
+                fields["wait"] = round(max(waited_until - record.created_at, 0.0), 3)
+        self.events.record(event, request_id, **fields)
+
+    def get_request(self, request_id: str) -> Optional[RequestRecord]:
+        """
+        Look up a request the bot is working on or has recently finished.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            The record, None if the request is unknown or was evicted from the history
+        """
+        return self.active_requests.get(request_id) or self.finished_requests.get(request_id)
+
+    def memory_footprint(self) -> Dict[str, Dict[str, int]]:
+        """
+        Estimate the memory held by the records of active and finished requests.
+
+        Returns:
+            Dictionary with the footprint of "active" and "finished" records, see request_records.footprint
+        """
+        return {"active": footprint(list(self.active_requests.values())),
+                "finished": self.finished_requests.footprint()}
+
+    def _announcements(self, request_id: str) -> Dict[str, int]:
+        """Return the group messages of a request by chat ID."""
+        return self.active_requests[request_id].announcements
+
+    def get_bot_updates(self, offset: Optional[int] = None, timeout: int = LONG_POLL_TIMEOUT,
+                        deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Get updates (new messages) from the bot.
+
+        Called on the poll thread of the dispatcher, so it goes through the sync transport.
+
+        Args:
+            offset: Update ID offset
+            timeout: Long-poll timeout in seconds
+            deadline: Monotonic time after which failed polls are not retried, e.g. the end of the poller lease
+
+        Returns:
+            JSON response with updates
+        """
+        # Telegram holds back update types the bot does not handle
+        params = {"timeout": timeout, "allowed_updates": ALLOWED_UPDATES_PARAM}
+        if offset:
+            params["offset"] = offset
+
+        # The HTTP read timeout has to outlast the long poll
+        return self.sync_transport.call(self.TOKEN, "getUpdates", params, read_timeout=params["timeout"] + 10,
+                                        decoder=decode_updates, deadline=deadline)
+
+    def set_bot_webhook(self, url: str, secret_token: str) -> bool:
+        """
+        Register a webhook so Telegram pushes updates instead of serving getUpdates.
+
+        Called once at startup from a plain thread, so it goes through the sync transport.
+
+        Args:
+            url: HTTPS URL of the webhook receiver
+            secret_token: Secret Telegram sends along with every update
+
+        Returns:
+            True if successful, False otherwise
+        """
+        params = {
+            "url": url,
+            "secret_token": secret_token,
+            "drop_pending_updates": "false",
+            "allowed_updates": ALLOWED_UPDATES_PARAM
+        }
+        result = self.sync_transport.call(self.TOKEN, "setWebhook", params)
+
+        if result["ok"]:
+            print(f"Webhook set to {url}")
+            return True
+        print(f"Failed to set webhook: {result}")
+        return False
+
+    def cancel_request(self, request_id: str) -> bool:
+        """
+        Withdraw a request whose workflow is running, e.g. because the donor cancelled it.
+
+        The workflow stops waiting at once, retracts the group messages and
+        raises RequestCancelled. This can be called from any thread.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            True if the request was cancelled, False if a volunteer had already claimed it
+        """
+        return get_dispatcher(self.TOKEN, self.get_bot_updates).cancel(request_id)
+
+    def _announcement_params(self, request_id: str, location: str, remarks: str, date: str,
+                             pick_up_time: str) -> List[Dict[str, Any]]:
+        """Build the sendMessage parameters of the announcement in every group."""
+        message, reply_markup = self.messages.group_announcement(request_id, location=location, remarks=remarks,
+                                                                 date=date, pick_up_time=pick_up_time)
+        return [{
+            "chat_id": chat_id,
+            "text": message,
+            "reply_markup": reply_markup,
+            "parse_mode": "HTML"
+        } for chat_id in self.chat_ids]
+
+    def _announced(self, request_id: str, results: List[Dict[str, Any]], location: str, remarks: str, date: str,
+                   pick_up_time: str) -> Tuple[Optional[int], str]:
+        """
+        Track a request with the group messages that were posted.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            results: Responses of the announcements, in the order of chat_ids
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+
+        Returns:
+            Tuple of (Message ID in the primary group, Request ID) if posting to any group succeeded, (None, "") otherwise
+        """
+        announcements: Dict[str, int] = {}
+        for chat_id, result in zip(self.chat_ids, results):
+            if result["ok"]:
+                announcements[chat_id] = result["result"]["message_id"]
+            else:
+                print(f"Error posting to chat {chat_id}: {result}")
+        if not announcements:
+            return None, ""
+
+        self._track_request(request_id, announcements, location=location, date=date, remarks=remarks,
+                            pick_up_time=pick_up_time)
+        return announcements.get(self.chat_id), request_id
+
+    def _matched_volunteers(self, location: str, pick_up_time: str) -> List[Dict[str, Any]]:
+        """Return the registered volunteers a request is offered to directly, best match first."""
+        if self.volunteers is None:
+            return []
+        return self.volunteers.find(location, pick_up_time, limit=DIRECT_DM_LIMIT)
+
+    def _invitation_params(self, request_id: str, matches: List[Dict[str, Any]], location: str, remarks: str,
+                           date: str, pick_up_time: str) -> List[Dict[str, Any]]:
+        """Build the sendMessage parameters of the invitation of every matched volunteer."""
+        params_list = []
+        for volunteer in matches:
+            message, reply_markup = self.messages.invitation(volunteer["first_name"], request_id, location=location,
+                                                             remarks=remarks, date=date, pick_up_time=pick_up_time)
+            params_list.append({
+                "chat_id": volunteer["id"],
+                "text": message,
+                "reply_markup": reply_markup,
+                "parse_mode": "HTML"
+            })
+        return params_list
+
+    def _invited(self, request_id: str, matches: List[Dict[str, Any]],
+                 results: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Return the invitation messages that were sent, by the volunteer's chat ID."""
+        invitations = {}
+        for volunteer, result in zip(matches, results):
+            if result["ok"]:
+                invitations[str(volunteer["id"])] = result["result"]["message_id"]
+            else:
+                # Usually the volunteer never started the bot or blocked it
+                print(f"Failed to invite volunteer {volunteer['id']} to request {request_id}: {result}")
+        print(f"Invited {len(invitations)} volunteers directly to request {request_id}")
+        return invitations
+
+    def _private_message_params(self, user_id: Union[str, int], first_name: str, contact_number: str,
+                                location: str, remarks: str, date: str, pick_up_time: str,
+                                request_id: str) -> Dict[str, Any]:
+        """Build the sendMessage parameters of the DM with the donor's contact details."""
+        message = self.messages.private_message(first_name=first_name, contact_number=contact_number,
+                                                location=location, remarks=remarks, date=date,
+                                                pick_up_time=pick_up_time, request_id=request_id)
+        return {
+            "chat_id": user_id,
+            "text": message,
+            "parse_mode": "HTML"
+        }
+
+    def _private_message_sent(self, result: Dict[str, Any], user_id: Union[str, int], first_name: str,
+                              request_id: str, user_message_id: Optional[int]) -> bool:
+        """
+        Schedule the cleanup of a volunteer's chat once the DM was answered.
+
+        Args:
+            result: Response of the DM
+            user_id: User's Telegram ID
+            first_name: User's first name
+            request_id: Unique request ID
+            user_message_id: ID of the user's /start message, if any
+
+        Returns:
+            True if the DM was sent, False otherwise
+        """
+        # The /start message is removed after the DM, without waiting for it, or
+        # together with the DM in edit-in-place mode
+        if user_message_id and not self.edit_in_place:
+            self.delete_message_later(user_id, user_message_id)
+
+        if not result["ok"]:
+            print(f"Failed to send private message to {first_name} for request {request_id}")
+            return False
+
+        print(f"Private message sent to {first_name} for request {request_id}")
+        message_ids = [result["result"]["message_id"]]
+        if user_message_id and self.edit_in_place:
+            message_ids.append(user_message_id)
+        self.schedule_messages_deletion(user_id, message_ids, PRIVATE_MESSAGE_SECONDS)
+        if request_id in self.active_requests:
+            self.active_requests[request_id].state = STATE_FULFILLED
+        return True
+
+    def schedule_messages_deletion(self, chat_id: Union[str, int], message_ids: List[int],
+                                   delay_seconds: float = 3600) -> Any:
+        """Schedule several messages of one chat for deletion; implemented by the subclasses."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _message_deleted(result: Dict[str, Any], chat_id: Union[str, int], message_id: int) -> bool:
+        """Report the deletion of a single message."""
+        if result["ok"]:
+            print(f"Deleted message {message_id} in chat {chat_id}")
+            return True
+        print(f"Failed to delete message {message_id} in chat {chat_id}")
+        return False
+
+    @staticmethod
+    def _messages_deleted(results: List[Dict[str, Any]], chat_id: Union[str, int], message_ids: List[int]) -> bool:
+        """Report the deleteMessages calls of several messages of one chat."""
+        if all(result["ok"] for result in results):
+            print(f"Deleted messages {message_ids} in chat {chat_id}")
+            return True
+        print(f"Failed to delete messages {message_ids} in chat {chat_id}")
+        return False
+
+    def delete_message_later(self, chat_id: Union[str, int], message_id: int) -> None:
+        """
+        Queue the deletion of a message without waiting for it.
+
+        Args:
+            chat_id: Chat ID where the message was sent
+            message_id: ID of the message to delete
+        """
+        self._api_later("deleteMessage", [{"chat_id": chat_id, "message_id": message_id}], PRIORITY_HOUSEKEEPING,
+                        lambda results: self._message_deleted(results[0], chat_id, message_id))
+
+    def _original_targets(self, request_id: str, chat_ids: Optional[List[str]] = None) -> List[Tuple[str, int]]:
+        """Return the (chat ID, message ID) of the group messages of a request, only those in chat_ids if given."""
+        return [(chat_id, message_id) for chat_id, message_id in self._announcements(request_id).items()
+                if chat_ids is None or chat_id in chat_ids]
+
+    @staticmethod
+    def _original_deleted(request_id: str, targets: List[Tuple[str, int]], results: List[Dict[str, Any]]) -> bool:
+        """Report the deletion of the group messages of a request; True if all of them are gone."""
+        success = True
+        for (chat_id, message_id), result in zip(targets, results):
+            if result["ok"]:
+                print(f"Original message (ID: {message_id}) for request {request_id} deleted successfully")
+            else:
+                print(f"Failed to delete original message for request {request_id} in chat {chat_id}")
+                success = False
+        return success
+
+    def _edit_params(self, request_id: str, text: str) -> List[Dict[str, Any]]:
+        """Build the editMessageText parameters that turn the group messages into text."""
+        # Without reply_markup the edit also drops the inline keyboard
+        return [{
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "text": text,
+            "parse_mode": "HTML"
+        } for chat_id, message_id in self._announcements(request_id).items()]
+
+    def _edited(self, request_id: str, results: List[Dict[str, Any]]) -> Dict[str, bool]:
+        """Return whether the group message of each chat was edited, in the order of _edit_params."""
+        edited = {}
+        for (chat_id, message_id), result in zip(self._announcements(request_id).items(), results):
+            edited[chat_id] = bool(result["ok"])
+            if result["ok"]:
+                print(f"Original message (ID: {message_id}) for request {request_id} edited successfully")
+            else:
+                print(f"Failed to edit original message for request {request_id} in chat {chat_id}: {result}")
+        return edited
+
+    def _outcome_params(self, chat_ids: List[str], text: str) -> List[Dict[str, Any]]:
+        """Build the sendMessage parameters of the outcome of a request in the given groups."""
+        return [{
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML"
+        } for chat_id in chat_ids]
+
+    def _announced_directly(self, request_id: str) -> bool:
+        """Return True if a request was claimed from a direct message before it was posted to the groups."""
+        return request_id in self.active_requests and not self._announcements(request_id)
+
+    @staticmethod
+    def _outcome_posted(request_id: str, outcome: str, ok: bool) -> bool:
+        """Report whether the groups were told the outcome of a request."""
+        if ok:
+            print(f"{outcome.capitalize()} message sent to group for request {request_id}")
+        else:
+            print(f"Failed to send {outcome} message to group for request {request_id}")
+        return ok
+
+    def _request_row(self, request_id: str, message_id: Optional[int], location: str, remarks: str, date: str,
+                     pick_up_time: str, contact_number: str, remaining_minutes: float) -> Dict[str, Any]:
+        """Build the arguments of RequestStore.save_request for a posted request."""
+        return dict(
+            request_id=request_id,
+            chat_id=self.chat_id,
+            message_id=message_id,
+            location=location,
+            remarks=remarks,
+            date=date,
+            pick_up_time=pick_up_time,
+            contact_number=contact_number,
+            wait_deadline=time.time() + remaining_minutes * 60,
+            announcements=self._announcements(request_id) if len(self.chat_ids) > 1 else None
+        )
+
+    def _note_posted(self, request_id: str, announced: bool,
+                     on_status: Optional[Callable[[str, str], None]]) -> None:
+        """
+        Report a request that is out, to the groups or to the volunteers messaged directly.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            announced: True if on_status was already told when the invitations went out
+            on_status: Callback receiving (request ID, state), if any
+        """
+        if on_status is not None and not announced:
+            on_status(request_id, STATE_POSTED)
+        self._log_event(EVENT_POSTED, request_id, groups=len(self._announcements(request_id)), direct=announced)
+
+    def _note_claim(self, request_id: str, volunteer: VolunteerRecord) -> Dict[str, Any]:
+        """
+        Record the volunteer who claimed a request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            volunteer: The claiming volunteer
+
+        Returns:
+            The volunteer as the user info dictionary of the store and the message templates
+        """
+        if request_id in self.active_requests:
+            record = self.active_requests[request_id]
+            self._log_event(EVENT_CLAIMED, request_id, waited_until=volunteer.claimed_at or time.time(),
+                            via="group" if record.announcements else "direct")
+            record.claim(volunteer)
+        if volunteer.detected_at is not None and volunteer.claimed_at is not None:
+            get_registry().observe_stage(STAGE_CLAIM_DETECTION,
+                                         max(volunteer.detected_at - volunteer.claimed_at, 0.0), request_id)
+        return volunteer.as_user_info(request_id)
+
+    def _note_private_message(self, request_id: str, volunteer: VolunteerRecord, sent: bool) -> None:
+        """
+        Record the DM a volunteer was waiting for and how long it took since the claim.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            volunteer: The claiming volunteer
+            sent: True if the DM was sent
+        """
+        if not sent:
+            return
+        self._log_event(EVENT_DM_SENT, request_id)
+        if volunteer.claimed_at is not None:
+            latency = time.time() - volunteer.claimed_at
+            get_registry().observe_claim_to_dm(latency)
+            print(f"Volunteer for request {request_id} notified {latency:.1f} seconds after claiming")
+
+    def _note_timed_out(self, request_id: str, wait_ended: float) -> None:
+        """Close a request nobody claimed."""
+        self._log_event(EVENT_TIMED_OUT, request_id, waited_until=wait_ended)
+        self._finish_request(request_id, STATE_TIMED_OUT)
+
+    def _note_cancelled(self, request_id: str) -> None:
+        """Close a request the donor withdrew."""
+        self._log_event(EVENT_CANCELLED, request_id, waited_until=time.time())
+        self._finish_request(request_id, STATE_CANCELLED)
+        print(f"Request {request_id} withdrawn")
+
+    def _queue_original_deletion(self, request_id: str) -> None:
+        """
+        Queue the deletion of the group messages of a finished request, unless they were edited into the outcome.
+
+        The deletions wait behind the DM and the group posts in the outbound
+        queue and are logged once done, so the workflow does not wait for them.
+
+        Args:
+            request_id: The unique ID of the pickup request
+        """
+        if self.edit_in_place or request_id not in self.active_requests or not self._announcements(request_id):
+            return
+        targets = self._original_targets(request_id)
+        queued_at = time.perf_counter()
+
+        def deleted(results: List[Dict[str, Any]]) -> None:
+            ok = self._original_deleted(request_id, targets, results)
+            get_registry().observe_stage(STAGE_DELETE_ORIGINAL, time.perf_counter() - queued_at, request_id)
+            self._log_event(EVENT_DELETED, request_id, ok=ok)
+
+        self._api_later("deleteMessage", [{"chat_id": chat_id, "message_id": message_id}
+                                          for chat_id, message_id in targets], PRIORITY_HOUSEKEEPING, deleted)
+
+    @staticmethod
+    def _split_deletions(deletions: List[Dict[str, Any]],
+                         now: float) -> Tuple[Dict[str, List[Dict[str, Any]]], List[Dict[str, Any]]]:
+        """
+        Sort persisted deletions into those that are due and those still pending.
+
+        Args:
+            deletions: Rows of RequestStore.pending_deletions
+            now: Current Unix time
+
+        Returns:
+            Tuple of (due deletions by chat ID, pending deletions)
+        """
+        expired: Dict[str, List[Dict[str, Any]]] = {}
+        pending = []
+        for deletion in deletions:
+            if deletion["delete_at"] <= now:
+                expired.setdefault(deletion["chat_id"], []).append(deletion)
+            else:
+                pending.append(deletion)
+        return expired, pending
+
+    def _resumed_bot(self, request: Dict[str, Any], now: float) -> Tuple["PickupBotCore", Dict[str, Any],
+                                                                           Optional[VolunteerRecord]]:
+        """
+        Rebuild a bot of the same kind for a request taken over from the store.
+
+        Args:
+            request: Row of RequestStore.take_over_requests
+            now: Current Unix time
+
+        Returns:
+            Tuple of (bot tracking the request, arguments of _complete_pickup_workflow, volunteer who already claimed it)
+        """
+        record, workflow_kwargs, volunteer = resumed_request(request, now)
+        bot = type(self)(self.TOKEN, request["chat_id"], transport=self.transport, store=self.store,
+                         edit_in_place=self.edit_in_place, fanout_chat_ids=list(record.announcements),
+                         volunteers=self.volunteers, messages=self.messages,
+                         finished_requests=self.finished_requests, events=self.events)
+        bot.active_requests[record.request_id] = record
+        print(f"Resuming request {record.request_id} with {workflow_kwargs['wait_minutes']:.1f} minutes left")
+        return bot, workflow_kwargs, volunteer
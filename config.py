@@ -1,26 +1,99 @@
-import requests
 import json
 import time
 import os
+import threading
 from datetime import datetime, timedelta
-import pytz
-from typing import Dict, Optional, Any, Union, Tuple
+from typing import Callable, Dict, List, Optional, Any, Union, Tuple
 import uuid
 
-class TelegramPickupBot:
-    def __init__(self, token: str, chat_id: str):
+from bot_core import DIRECT_DM_SECONDS, PickupBotCore
+from deletion_scheduler import get_scheduler
+from event_log import EventLog
+from message_templates import MessageCatalog
+from metrics import (STAGE_DIRECT_DM, STAGE_GROUP_CONFIRMATION, STAGE_GROUP_DENIAL, STAGE_GROUP_POST,
+                     STAGE_PRIVATE_DM, STAGE_WAIT, get_registry)
+from rate_limiter import PRIORITY_URGENT, PRIORITY_NORMAL, PRIORITY_HOUSEKEEPING
+from request_records import FinishedRequests, VolunteerRecord
+from request_store import REQUEST_LEASE_SECONDS, RequestStore, STATE_POSTED, STATE_CLAIMED, STATE_FULFILLED, STATE_TIMED_OUT, STATE_CANCELLED
+from telegram_transport import Decoder, TelegramTransport, decode_response, get_transport
+from update_dispatcher import RequestCancelled, get_dispatcher
+from volunteer_registry import DEFAULT_REGISTRY_PATH, VolunteerRegistry
+
+
+class TelegramPickupBot(PickupBotCore):
+    def __init__(self, token: str, chat_id: str, transport: Optional[TelegramTransport] = None,
+                 store: Optional[RequestStore] = None, edit_in_place: bool = False,
+                 fanout_chat_ids: Optional[List[str]] = None, volunteers: Optional[VolunteerRegistry] = None,
+                 direct_dm_seconds: float = DIRECT_DM_SECONDS, messages: Optional[MessageCatalog] = None,
+                 finished_requests: Optional[FinishedRequests] = None, events: Optional[EventLog] = None):
         """
         Initialize the Telegram bot.
         
+        The requests, their records and everything else that does not wait for
+        the Bot API live in PickupBotCore, which the asyncio bot shares.
+        
         Args:
             token: Telegram bot API token
             chat_id: ID of the group chat where announcements will be posted
+            transport: HTTP transport for API calls, defaults to the process-wide pooled one
+            store: Durable store for requests and pending deletions, if any
+            edit_in_place: Edit the announcement into the confirmation or denial instead of
+                deleting it and posting a new message, and delete the volunteer's /start
+                message together with the DM
+            fanout_chat_ids: Further group chats that receive every announcement at the same time
+            volunteers: Registry of volunteers who are messaged directly before the group post, if any
+            direct_dm_seconds: How long matched volunteers get before the request goes to the groups
+            messages: Compiled message templates, the catalog of PICKUP_LOCALE if None
+            finished_requests: History of finished requests, the process-wide one if None
+            events: Log of request lifecycle events, the one of PICKUP_EVENT_LOG if None
         """
-        self.TOKEN = token
-        self.chat_id = chat_id
+        self.transport = transport or get_transport()
+        super().__init__(token, chat_id, self.transport, store=store, edit_in_place=edit_in_place,
+                         fanout_chat_ids=fanout_chat_ids, volunteers=volunteers,
+                         direct_dm_seconds=direct_dm_seconds, messages=messages,
+                         finished_requests=finished_requests, events=events)
         self.message_id: Optional[int] = None
-        self.new_users: Dict[str, Dict[str, Any]] = {}
-        self.active_requests: Dict[str, Dict[str, Any]] = {}
+        self.new_users: Dict[str, VolunteerRecord] = {}
+    
+    def _api(self, method: str, params: Optional[Dict[str, Any]] = None, read_timeout: Optional[float] = None,
+             priority: Optional[int] = None, decoder: Decoder = decode_response) -> Dict[str, Any]:
+        """
+        Call a Bot API method through the shared transport.
+        
+        Calls with a priority are chat traffic and go through the rate-limited
+        outbound queue of the bot; calls without one are sent directly.
+        
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            params: Parameters of the call
+            read_timeout: Override of the transport read timeout
+            priority: One of the PRIORITY_* constants of rate_limiter
+            decoder: Decodes the response of a call without a priority
+            
+        Returns:
+            JSON response of the API
+        """
+        if priority is not None:
+            return self._outbound_queue().call(method, params or {}, priority)
+        return self.transport.call(self.TOKEN, method, params, read_timeout=read_timeout, decoder=decoder)
+    
+    def _api_many(self, method: str, params_list: List[Dict[str, Any]], priority: int) -> List[Dict[str, Any]]:
+        """
+        Send several calls through the outbound queue at once and wait for all of them.
+        
+        Calls to different chats count against different rate limits, so they
+        go out in parallel instead of one round trip after the other.
+        
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            params_list: Parameters of each call
+            priority: One of the PRIORITY_* constants of rate_limiter
+            
+        Returns:
+            JSON responses of the API, in the order of params_list
+        """
+        futures = self._outbound_queue().submit_many(method, params_list, priority)
+        return [future.result() for future in futures]
     
     def reset_bot_completely(self) -> None:
         """Reset the bot by clearing local data and pending updates."""
@@ -33,17 +106,18 @@ class TelegramPickupBot:
         self.new_users = {}
         print("Local user data cleared")
         
-        if os.path.exists("user_data.json"):
-            os.remove("user_data.json")
+        if self.volunteers is not None:
+            self.volunteers.clear()
+            print("Volunteer registry cleared")
+        elif os.path.exists(DEFAULT_REGISTRY_PATH):
+            os.remove(DEFAULT_REGISTRY_PATH)
             print("User data file removed")
         
         return True
     
     def reset_bot_webhook(self) -> bool:
         """Remove the webhook to ensure no old updates are processed."""
-        url = f"https://api.telegram.org/bot{self.TOKEN}/deleteWebhook?drop_pending_updates=true"
-        response = requests.get(url)
-        result = response.json()
+        result = self._api("deleteWebhook", {"drop_pending_updates": "true"})
         
         if result["ok"]:
             print("Webhook deleted and pending updates cleared")
@@ -52,7 +126,7 @@ class TelegramPickupBot:
             print(f"Failed to reset webhook: {result}")
             return False
         
-    def schedule_message_deletion(self, chat_id: Union[str, int], message_id: int, delay_seconds: int = 3600) -> None:
+    def schedule_message_deletion(self, chat_id: Union[str, int], message_id: int, delay_seconds: int = 3600) -> int:
         """
         Schedule a message for deletion after specified delay.
         
@@ -60,187 +134,180 @@ class TelegramPickupBot:
             chat_id: Chat ID where the message was sent
             message_id: ID of the message to delete
             delay_seconds: Time in seconds after which to delete the message (default: 15 min)
+            
+        Returns:
+            Job ID of the deletion, usable to cancel or reschedule it
         """
-        import threading
-        
-        def delete_after_delay():
-            time.sleep(delay_seconds)
-            url = f"https://api.telegram.org/bot{self.TOKEN}/deleteMessage"
-            params = {
-                "chat_id": chat_id,
-                "message_id": message_id
-            }
-            response = requests.get(url, params=params)
-            if response.json()["ok"]:
-                print(f"Auto-deleted message {message_id} in chat {chat_id}")
-            else:
-                print(f"Failed to auto-delete message {message_id} in chat {chat_id}")
-        
-        thread = threading.Thread(target=delete_after_delay)
-        thread.daemon = True
-        thread.start()
+        scheduler = get_scheduler(self.TOKEN, self.delete_messages, self.store)
+        store_key = None
+        if self.store is not None:
+            store_key = self.store.add_deletion(chat_id, message_id, time.time() + delay_seconds)
+        job_id = scheduler.schedule(chat_id, message_id, delay_seconds, store_key=store_key)
         print(f"Scheduled message {message_id} for deletion in {delay_seconds} seconds")
+        return job_id
+    
+    def cancel_message_deletion(self, job_id: int) -> bool:
+        """
+        Cancel a deletion scheduled with schedule_message_deletion.
+        
+        Args:
+            job_id: Job ID of the deletion
+            
+        Returns:
+            True if the deletion was still pending, False otherwise
+        """
+        return get_scheduler(self.TOKEN, self.delete_messages, self.store).cancel(job_id)
     
-    def send_message_emergency_group(self, location: str, remarks:str,  date: str, pick_up_time: str) -> Tuple[Optional[int], str]:
+    def reschedule_message_deletion(self, job_id: int, delay_seconds: int) -> bool:
         """
-        Send a message to the emergency group with pickup details.
+        Move a scheduled deletion to a new delay from now.
         
+        Args:
+            job_id: Job ID of the deletion
+            delay_seconds: New delay in seconds
+            
+        Returns:
+            True if the deletion was still pending, False otherwise
+        """
+        return get_scheduler(self.TOKEN, self.delete_messages, self.store).reschedule(job_id, delay_seconds)
+    
+    def schedule_messages_deletion(self, chat_id: Union[str, int], message_ids: List[int],
+                                   delay_seconds: float = 3600) -> List[int]:
+        """
+        Schedule several messages of one chat for deletion after the same delay.
+    
+        Deletions due at the same time are carried out by the scheduler with one call.
+    
+        Args:
+            chat_id: Chat ID where the messages were sent
+            message_ids: IDs of the messages to delete
+            delay_seconds: Time in seconds after which to delete the messages
+    
+        Returns:
+            Job IDs of the deletions, in the order of message_ids
+        """
+        return [self.schedule_message_deletion(chat_id, message_id, delay_seconds) for message_id in message_ids]
+    
+    def send_message_emergency_group(self, location: str, remarks:str,  date: str, pick_up_time: str,
+                                     request_id: Optional[str] = None) -> Tuple[Optional[int], str]:
+        """
+        Send a message to the emergency group, and any fan-out groups, with pickup details.
+    
+        All groups are posted to concurrently. Every announcement carries the
+        same request ID, so the first /start from any group claims the request.
+    
         Args:
             location: Pickup location
             date: Date of the pickup
             pick_up_time: Time of the pickup
-            
+            request_id: ID of a request that was already offered to volunteers directly, a new one if None
+    
         Returns:
-            Tuple of (Message ID, Request ID) if successful, (None, None) otherwise
+            Tuple of (Message ID in the primary group, Request ID) if posting to any group succeeded, (None, "") otherwise
         """
         # Generate a unique request ID
-        request_id = str(uuid.uuid4())[:8]
-        
-        keyboard = {
-            "inline_keyboard": [
-                [
-                    {
-                        "text": "CONFIRM PICK-UP! Click and START.",
-                        "url": f"https://t.me/skat_cards_distribution_bot?start={request_id}"
-                    }
-                ]
-            ]
-        }
-        
-        # Convert the keyboard to JSON string
-        reply_markup = json.dumps(keyboard)
-        
-        # Calculate response deadline (1 hour from now)
-        future_time = datetime.now(pytz.timezone("Europe/Helsinki")) + timedelta(seconds=3600)
-        response_time = future_time.strftime('%H:%M')
-        print(f'remakrs: {remarks}')
-        if remarks == "":
-            remarks_ = ""
-        else:
-            remarks_ = f"<b>Note:</b> <i>{remarks}</i> \n"
-
-
-        # Message text
-        message = (
-            f"Hey Foodsavers, we have a request for an Event Pick Up (ID: {request_id}).\n\n"
-            f"<b>Where:</b> <i>{location}</i> \n"
-            f"<b>When:</b> <i>{date}</i> \n"
-            f"{remarks_}"
-            f"<b>Time:</b> <i>{pick_up_time}</i> \n\n"
-            
-            f"You have time until {response_time} to respond. \n"
-            f"If you can pick up:"
-        )
-        
-        url = f"https://api.telegram.org/bot{self.TOKEN}/sendMessage"
-        params = {
-            "chat_id": self.chat_id, 
-            "text": message, 
-            "reply_markup": reply_markup, 
-            "parse_mode": "HTML"
-        }
-        response = requests.get(url, params=params)
-        
-        # Get the message ID from the response for later deletion
-        result = response.json()
-        if result["ok"]:
-            self.message_id = result["result"]["message_id"]
-            
-            # Store request info in active_requests
-            self.active_requests[request_id] = {
-                "message_id": self.message_id,
-                "location": location,
-                "date": date,
-                "remarks": remarks,
-                "pick_up_time": pick_up_time,
-                "created_at": datetime.now(),
-                "fulfilled": False
-            }
-            
-            return self.message_id, request_id
-        else:
-            print(f"Error: {result}")
-            return None, ""
+        request_id = request_id or str(uuid.uuid4())[:8]
+    
+        params_list = self._announcement_params(request_id, location=location, remarks=remarks, date=date,
+                                                pick_up_time=pick_up_time)
+        results = self._api_many("sendMessage", params_list, priority=PRIORITY_URGENT)
     
-    def get_bot_updates(self, offset: Optional[int] = None) -> Dict[str, Any]:
+        message_id, request_id = self._announced(request_id, results, location=location, remarks=remarks, date=date,
+                                                 pick_up_time=pick_up_time)
+        if request_id:
+            self.message_id = message_id
+        return message_id, request_id
+    
+    def invite_volunteers(self, request_id: str, location: str, remarks: str, date: str,
+                          pick_up_time: str) -> Dict[str, int]:
         """
-        Get updates (new messages) from the bot.
-        
+        Offer a request directly to the best-matched registered volunteers, concurrently.
+    
         Args:
-            offset: Update ID offset
-            
+            request_id: The unique ID of the pickup request
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+    
         Returns:
-            JSON response with updates
+            Dictionary mapping each invited volunteer's chat ID to the ID of the invitation message
         """
-        url = f"https://api.telegram.org/bot{self.TOKEN}/getUpdates"
-        params = {"timeout": 30}
-        if offset:
-            params["offset"] = offset
-        
-        response = requests.get(url, params=params)
-        return response.json()
+        matches = self._matched_volunteers(location, pick_up_time)
+        if not matches:
+            return {}
     
-    def process_updates(self, request_id: str, minutes: int = 1) -> Optional[Dict[str, Dict[str, Any]]]:
+        params_list = self._invitation_params(request_id, matches, location=location, remarks=remarks, date=date,
+                                              pick_up_time=pick_up_time)
+        results = self._api_many("sendMessage", params_list, priority=PRIORITY_URGENT)
+        return self._invited(request_id, matches, results)
+    
+    def retract_invitations(self, invitations: Dict[str, int]) -> None:
+        """
+        Delete the invitation messages of a finished request, in parallel.
+    
+        Args:
+            invitations: Dictionary returned by invite_volunteers
+        """
+        params_list = [{
+            "chat_id": chat_id,
+            "message_id": message_id
+        } for chat_id, message_id in invitations.items()]
+        self._api_many("deleteMessage", params_list, priority=PRIORITY_HOUSEKEEPING)
+    
+    def process_updates(self, request_id: str, minutes: int = 1) -> Optional[Dict[str, VolunteerRecord]]:
         """
         Process updates to detect new private messages for a specific request.
-        
+    
         Args:
             request_id: The unique ID of the pickup request
             minutes: Number of minutes to check for updates
-            
+    
         Returns:
             Dictionary of new users if any, None otherwise
+    
+        Raises:
+            RequestCancelled: If the request was cancelled during the wait
         """
-        # Start with no offset
-        offset = None
-        
+        dispatcher = get_dispatcher(self.TOKEN, self.get_bot_updates)
+    
         # Get the current time
         start_time = datetime.now()
         end_time = start_time + timedelta(minutes=minutes)
-        
+    
         print(f"Checking for new users for request {request_id} from {start_time} to {end_time}")
-        
-        while datetime.now() < end_time:
-            updates = self.get_bot_updates(offset)
-            if updates["ok"]:
-                for update in updates["result"]:
-                    # Update the offset to acknowledge this update
-                    offset = update["update_id"] + 1
-                    
-                    # Check if this is a private message (not from a group)
-                    if "message" in update and "chat" in update["message"]:
-                        chat = update["message"]["chat"]
-                        message = update["message"]
-                        
-                        # Check if this is a private chat
-                        if chat["type"] == "private":
-                            # Check if this message contains the request_id
-                            # Look for "/start request_id" pattern
-                            if "text" in message and message["text"].startswith("/start"):
-                                message_parts = message["text"].split()
-                                if len(message_parts) > 1 and message_parts[1] == request_id:
-                                    user_id = chat["id"]
-                                    user_info = {
-                                        "id": user_id,
-                                        "first_name": chat.get("first_name", "User"),
-                                        "username": chat.get("username", ""),
-                                        "message_id": message.get("message_id"),
-                                        "request_id": request_id
-                                    }
-                                    
-                                    print(f"New user detected for request {request_id}: {user_info['first_name']}")
-                                    return {str(user_id): user_info}
-            
-            # Sleep briefly to avoid excessive API calls
-            time.sleep(2)
-        
+    
+        try:
+            user_info = dispatcher.wait_for_claim(request_id, timeout=(end_time - start_time).total_seconds())
+        finally:
+            dispatcher.unregister(request_id)
+    
+        if user_info:
+            return {str(user_info["id"]): VolunteerRecord.from_user_info(user_info)}
+    
         print(f"No user found in {minutes} minutes for request {request_id}")
         return None
     
+    def _retract_request(self, request_id: str) -> None:
+        """
+        Delete the group messages of a cancelled request and close it.
+    
+        Args:
+            request_id: The unique ID of the pickup request
+        """
+        if request_id not in self.active_requests:
+            # Cancelled before it was posted, only the invitations have to go
+            return
+        if self._announcements(request_id):
+            self.delete_original_message(request_id)
+        if self.store is not None:
+            self.store.mark_finished(request_id, STATE_CANCELLED)
+        self._note_cancelled(request_id)
+    
     def send_private_message(self, user_id: Union[str, int], first_name: str, contact_number: str, location: str, remarks:str, date: str, pick_up_time: str, request_id: str, user_message_id: Optional[int] = None) -> bool:
         """
         Send a private message to a user.
-        
+    
         Args:
             user_id: User's Telegram ID
             first_name: User's first name
@@ -250,187 +317,160 @@ class TelegramPickupBot:
             pick_up_time: Time of pickup
             request_id: Unique request ID
             user_message_id: ID of the user's original message to delete
-            
+    
         Returns:
             True if successful, False otherwise
         """
-        
-
-        if remarks == "Not specified":
-            remarks_ = ""
-        else:
-            remarks_ = f"<b>Note:</b> <i>{remarks}</i> \n"
-        # Delete the user's /start message if provided
-        if user_message_id:
-            self.delete_message(user_id, user_message_id)
-            print(f"Deleted user's start message (ID: {user_message_id})")
-
-        clean_number = contact_number.replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
-        message = (
-            f"Hello <b>{first_name}</b>!\n" 
-            f"Thank you for signing in. You're now registered.\n" 
-            f"Request for an Event Pick Up (ID: {request_id}):\n\n"
-            f"<b>Where:</b> <i>{location}</i> \n"
-            f"<b>When:</b> <i>{date}</i> \n"
-            f"{remarks_}"
-            f"<b>Time:</b> <i>{pick_up_time}</i> \n\n"
-            f"Please reach out to the Event host as soon as possible to:\n"
-            f"<b>1.</b> Confirm Pick up.\n"
-            f"<b>2.</b> Ask for pick-up time and amount.\n"
-            f"\n"
-            f"Call Event Host: "
-            f"<a href=\"tel:{clean_number}\">{contact_number}</a>"
-            f"\n"
-            f"\n"
-            f"Call now, message will be deleted in 15 minutes."
-        )
-
-        url = f"https://api.telegram.org/bot{self.TOKEN}/sendMessage"
-        params = {
-            "chat_id": user_id,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-
-        response = requests.get(url, params=params)
-        result = response.json()
-
-        if result["ok"]:
-            print(f"Private message sent to {first_name} for request {request_id}")
-            # Get the message ID from the response
-            sent_message_id = result["result"]["message_id"]
-            # Schedule message deletion after 15 minutes (900 seconds)
-            self.schedule_message_deletion(user_id, sent_message_id, 900)
-            
-           # Mark request as fulfilled
-            if request_id in self.active_requests:
-                self.active_requests[request_id]["fulfilled"] = True
-                
-            return True
-        else:
-            print(f"Failed to send private message to {first_name} for request {request_id}")
-            return False
-        
+        params = self._private_message_params(user_id, first_name, contact_number, location=location,
+                                              remarks=remarks, date=date, pick_up_time=pick_up_time,
+                                              request_id=request_id)
+        result = self._api("sendMessage", params, priority=PRIORITY_URGENT)
+        return self._private_message_sent(result, user_id, first_name, request_id, user_message_id)
+    
     def delete_message(self, chat_id: Union[str, int], message_id: int) -> bool:
         """
         Delete a specific message.
-        
+    
         Args:
             chat_id: Chat ID where the message was sent
             message_id: ID of the message to delete
-            
+    
         Returns:
             True if successful, False otherwise
         """
-        url = f"https://api.telegram.org/bot{self.TOKEN}/deleteMessage"
         params = {
             "chat_id": chat_id,
             "message_id": message_id
         }
-        
-        response = requests.get(url, params=params)
-        result = response.json()
-        
-        if result["ok"]:
-            print(f"Deleted message {message_id} in chat {chat_id}")
-            return True
-        else:
-            print(f"Failed to delete message {message_id} in chat {chat_id}")
-            return False
-        
-    def delete_original_message(self, request_id: str) -> bool:
+    
+        result = self._api("deleteMessage", params, priority=PRIORITY_HOUSEKEEPING)
+        return self._message_deleted(result, chat_id, message_id)
+    
+    def delete_messages(self, chat_id: Union[str, int], message_ids: List[int]) -> bool:
         """
-        Delete the original message from the group.
-        
+        Delete several messages of one chat with as few calls as possible.
+    
+        Args:
+            chat_id: Chat ID where the messages were sent
+            message_ids: IDs of the messages to delete
+    
+        Returns:
+            True if all messages were deleted, False otherwise
+        """
+        if len(message_ids) == 1:
+            return self.delete_message(chat_id, message_ids[0])
+    
+        # deleteMessages accepts at most 100 IDs per call
+        params_list = [{
+            "chat_id": chat_id,
+            "message_ids": json.dumps(message_ids[i:i + 100])
+        } for i in range(0, len(message_ids), 100)]
+        results = self._api_many("deleteMessages", params_list, priority=PRIORITY_HOUSEKEEPING)
+        return self._messages_deleted(results, chat_id, message_ids)
+    
+    def delete_original_message(self, request_id: str, chat_ids: Optional[List[str]] = None) -> bool:
+        """
+        Delete the original message from every group it was posted to, in parallel.
+    
         Args:
             request_id: The unique ID of the pickup request
-            
+            chat_ids: Only delete the messages in these groups, all groups if None
+    
         Returns:
             True if successful, False otherwise
         """
         if request_id not in self.active_requests:
             print(f"No message ID available to delete for request {request_id}")
             return False
-            
-        message_id = self.active_requests[request_id]["message_id"]
-        
-        url = f"https://api.telegram.org/bot{self.TOKEN}/deleteMessage"
-        params = {
-            "chat_id": self.chat_id,
+    
+        targets = self._original_targets(request_id, chat_ids)
+        params_list = [{
+            "chat_id": chat_id,
             "message_id": message_id
-        }
-        
-        response = requests.get(url, params=params)
-        if response.json()["ok"]:
-            print(f"Original message (ID: {message_id}) for request {request_id} deleted successfully")
+        } for chat_id, message_id in targets]
+        results = self._api_many("deleteMessage", params_list, priority=PRIORITY_HOUSEKEEPING)
+        return self._original_deleted(request_id, targets, results)
+    
+    def edit_original_message(self, request_id: str, text: str) -> Dict[str, bool]:
+        """
+        Replace the text of the original group messages and remove their button, in parallel.
+    
+        Args:
+            request_id: The unique ID of the pickup request
+            text: New message text
+    
+        Returns:
+            Dictionary mapping each group's chat ID to whether its message was edited
+        """
+        if request_id not in self.active_requests:
+            print(f"No message ID available to edit for request {request_id}")
+            return {}
+    
+        results = self._api_many("editMessageText", self._edit_params(request_id, text), priority=PRIORITY_NORMAL)
+        return self._edited(request_id, results)
+    
+    def _post_outcome(self, request_id: str, text: str, priority: int) -> bool:
+        """
+        Tell every group how a request ended.
+    
+        In edit-in-place mode the announcements are edited into the outcome; groups
+        whose announcement cannot be edited get a new message instead.
+    
+        Args:
+            request_id: The unique ID of the pickup request
+            text: Confirmation or denial text
+            priority: One of the PRIORITY_* constants of rate_limiter
+    
+        Returns:
+            True if every group was told, False otherwise
+        """
+        if self._announced_directly(request_id):
             return True
-        else:
-            print(f"Failed to delete original message for request {request_id}")
-            return False
+    
+        chat_ids = self.chat_ids
+        if self.edit_in_place:
+            edited = self.edit_original_message(request_id, text)
+            chat_ids = [chat_id for chat_id in chat_ids if not edited.get(chat_id)]
+            if not chat_ids:
+                return True
+            # The announcement is gone or cannot be edited, post the outcome instead
+            self.delete_original_message(request_id, chat_ids)
+    
+        results = self._api_many("sendMessage", self._outcome_params(chat_ids, text), priority=priority)
+        return all(result["ok"] for result in results)
     
     def send_confirmation_to_group(self, user_info: Dict[str, Any], date: str, pick_up_time: str) -> bool:
         """
-        Send a confirmation message to the group about who signed in.
-        
+        Send a confirmation message to the groups about who signed in.
+    
         Args:
             user_info: Dictionary containing user information
             date: Date of pickup
             pick_up_time: Time of pickup
-            
+    
         Returns:
             True if successful, False otherwise
         """
-        name = user_info["first_name"]
-        username = user_info.get("username", "")
         request_id = user_info.get("request_id", "")
-        
-        if username:
-            message = f"<b>{name}</b> (@{username}) is signing in for Pick-Up (ID: {request_id}) at {date}, {pick_up_time}."
-        else:
-            message = f"<b>{name}</b> is signing in for Pick-Up (ID: {request_id}) at {date}, {pick_up_time}."
-        
-        url = f"https://api.telegram.org/bot{self.TOKEN}/sendMessage"
-        params = {
-            "chat_id": self.chat_id,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-        
-        response = requests.get(url, params=params)
-        if response.json()["ok"]:
-            print(f"Confirmation message sent to group for request {request_id}")
-            return True
-        else:
-            print(f"Failed to send confirmation message to group for request {request_id}")
-            return False
+        message = self.messages.confirmation(user_info, date=date, pick_up_time=pick_up_time)
+        return self._outcome_posted(request_id, "confirmation", self._post_outcome(request_id, message, PRIORITY_NORMAL))
     
     def send_denial_to_group(self, request_id: str) -> bool:
         """
-        Send a denial message to the group that nobody signed in.
-        
+        Send a denial message to the groups that nobody signed in.
+    
         Args:
             request_id: The unique ID of the pickup request
-            
+    
         Returns:
             True if successful, False otherwise
         """
-        url = f"https://api.telegram.org/bot{self.TOKEN}/sendMessage"
-        params = {
-            "chat_id": self.chat_id,
-            "text": f"Unfortunately, no one has time for Pick-Up (ID: {request_id}).",
-            "parse_mode": "HTML"
-        }
-        
-        response = requests.get(url, params=params)
-        if response.json()["ok"]:
-            print(f"Denial message sent to group for request {request_id}")
-            return True
-        else:
-            print(f"Failed to send denial message to group for request {request_id}")
-            return False
+        posted = self._post_outcome(request_id, self.messages.denial(request_id), PRIORITY_HOUSEKEEPING)
+        return self._outcome_posted(request_id, "denial", posted)
     
     def run_pickup_workflow(self, location: str, date: str, pick_up_time: str, 
-                        contact_number: str, remarks:str, wait_minutes: int = 1) -> bool:
+                        contact_number: str, remarks:str, wait_minutes: int = 1,
+                        on_status: Optional[Callable[[str, str], None]] = None) -> bool:
         """
         Run the complete pickup workflow.
         
@@ -440,26 +480,108 @@ class TelegramPickupBot:
             pick_up_time: Time of the pickup
             contact_number: Contact number for the pickup
             wait_minutes: Number of minutes to wait for responses
+            on_status: Callback receiving (request ID, state) whenever the request is posted or claimed
             
         Returns:
             True if a user picked up, False otherwise
+            
+        Raises:
+            RequestCancelled: If cancel_request() withdrew the request before it was claimed
         """
         
         # No need to reset the bot completely as that would affect other active requests
         # self.reset_bot_completely()
         
-        # Send the message with the button and get the request ID
-        message_id, request_id = self.send_message_emergency_group(location=location, remarks = remarks,  date=date, pick_up_time=pick_up_time)
-        
-        if not request_id:
-            print("Failed to create pickup request")
-            return False
-        
-        # Check for responses specific to this request
-        new_users = self.process_updates(request_id=request_id, minutes=wait_minutes)
+        started = time.perf_counter()
+        submitted_at = time.time()
+        metrics = get_registry()
+        request_id = str(uuid.uuid4())[:8]
+        claimed_by = None
+        
+        invitations: Dict[str, int] = {}
+        try:
+            # Offer the request to the best-matched volunteers first
+            if self.volunteers is not None and self.direct_dm_seconds > 0:
+                with metrics.trace_stage(STAGE_DIRECT_DM, request_id):
+                    invitations = self.invite_volunteers(request_id, location=location, remarks=remarks, date=date,
+                                                         pick_up_time=pick_up_time)
+                    if invitations:
+                        if on_status is not None:
+                            on_status(request_id, STATE_POSTED)
+                        new_users = self.process_updates(request_id=request_id,
+                                                         minutes=min(self.direct_dm_seconds / 60, wait_minutes))
+                        if new_users:
+                            claimed_by = next(iter(new_users.values()))
+            
+            # The direct messages count against the time the donor was promised
+            remaining_minutes = max(wait_minutes - (time.perf_counter() - started) / 60, 0)
+            
+            if claimed_by is None:
+                # Send the message with the button
+                with metrics.trace_stage(STAGE_GROUP_POST, request_id):
+                    message_id, request_id = self.send_message_emergency_group(location=location, remarks = remarks,  date=date, pick_up_time=pick_up_time, request_id=request_id)
+                
+                if not request_id:
+                    print("Failed to create pickup request")
+                    return False
+            else:
+                message_id = None
+                self._track_request(request_id, {}, location=location, date=date, remarks=remarks,
+                                    pick_up_time=pick_up_time)
+            # The donor waits from the submission on, and so does wait_minutes
+            self.active_requests[request_id].created_at = submitted_at
+            
+            if self.store is not None:
+                self.store.save_request(**self._request_row(
+                    request_id, message_id, location=location, remarks=remarks, date=date, pick_up_time=pick_up_time,
+                    contact_number=contact_number, remaining_minutes=remaining_minutes
+                ))
+            self._note_posted(request_id, announced=bool(invitations), on_status=on_status)
+            
+            fulfilled = self._complete_pickup_workflow(request_id, location=location, date=date, pick_up_time=pick_up_time,
+                                                       contact_number=contact_number, remarks=remarks,
+                                                       wait_minutes=remaining_minutes, claimed_by=claimed_by,
+                                                       on_status=on_status)
+        except RequestCancelled:
+            self._retract_request(request_id)
+            metrics.observe_workflow(time.perf_counter() - started, STATE_CANCELLED)
+            raise
+        finally:
+            if invitations:
+                self.retract_invitations(invitations)
+        
+        metrics.observe_workflow(time.perf_counter() - started, STATE_FULFILLED if fulfilled else STATE_TIMED_OUT)
+        return fulfilled
+    
+    def _complete_pickup_workflow(self, request_id: str, location: str, date: str, pick_up_time: str,
+                                  contact_number: str, remarks: str, wait_minutes: float,
+                                  claimed_by: Optional[VolunteerRecord] = None,
+                                  on_status: Optional[Callable[[str, str], None]] = None) -> bool:
+        """
+        Wait for a volunteer and finish a posted pickup request.
         
-        # Delete the original message in any case
-        self.delete_original_message(request_id)
+        Args:
+            request_id: The unique ID of the pickup request
+            location: Pickup location
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+            contact_number: Contact number for the pickup
+            remarks: Additional remarks of the donor
+            wait_minutes: Number of minutes left to wait for responses
+            claimed_by: Volunteer who already claimed the request
+            on_status: Callback receiving (request ID, state) when the request is claimed
+            
+        Returns:
+            True if a user picked up, False otherwise
+        """
+        metrics = get_registry()
+        if claimed_by is not None:
+            new_users = {str(claimed_by.user_id): claimed_by}
+        else:
+            # Check for responses specific to this request
+            with metrics.trace_stage(STAGE_WAIT, request_id):
+                new_users = self.process_updates(request_id=request_id, minutes=wait_minutes)
+        wait_ended = time.time()
         
         if location == "":
             location = "Not specified"
@@ -467,33 +589,100 @@ class TelegramPickupBot:
             remarks = "Not specified"
         # Handle user responses
         if new_users:
-            for user_id, user_info in new_users.items():
-                self.send_private_message(
-                    user_id=user_id, 
-                    first_name=user_info["first_name"], 
-                    contact_number=contact_number,
-                    user_message_id=user_info.get("message_id"),
-                    location=location,
-                    remarks= remarks,
-                    date=date,
-                    pick_up_time=pick_up_time,
-                    request_id=request_id
-                )
-                self.send_confirmation_to_group(user_info, date=date, pick_up_time=pick_up_time)
+            for user_id, volunteer in new_users.items():
+                user_info = self._note_claim(request_id, volunteer)
+                if self.store is not None:
+                    self.store.mark_claimed(request_id, user_info)
+                if on_status is not None:
+                    on_status(request_id, STATE_CLAIMED)
+                with metrics.trace_stage(STAGE_PRIVATE_DM, request_id):
+                    sent = self.send_private_message(
+                        user_id=user_id, 
+                        first_name=volunteer.first_name, 
+                        contact_number=contact_number,
+                        user_message_id=volunteer.message_id,
+                        location=location,
+                        remarks= remarks,
+                        date=date,
+                        pick_up_time=pick_up_time,
+                        request_id=request_id
+                    )
+                self._note_private_message(request_id, volunteer, sent)
+                # Counted after the DM, which the volunteer is waiting for
+                if self.volunteers is not None:
+                    self.volunteers.record_claim(volunteer.user_id)
+                with metrics.trace_stage(STAGE_GROUP_CONFIRMATION, request_id):
+                    self.send_confirmation_to_group(user_info, date=date, pick_up_time=pick_up_time)
+            
+            self._queue_original_deletion(request_id)
+            if self.store is not None:
+                self.store.mark_finished(request_id, STATE_FULFILLED)
             
-            # Clean up - remove request from active requests after it's handled
-            if request_id in self.active_requests:
-                del self.active_requests[request_id]
+            # Clean up - move the request to the bounded history after it's handled
+            self._finish_request(request_id, STATE_FULFILLED)
                 
             return True
         else:
-            self.send_denial_to_group(request_id)
+            with metrics.trace_stage(STAGE_GROUP_DENIAL, request_id):
+                self.send_denial_to_group(request_id)
             
-            # Clean up - remove request from active requests after it's handled
-            if request_id in self.active_requests:
-                del self.active_requests[request_id]
+            self._queue_original_deletion(request_id)
+            if self.store is not None:
+                self.store.mark_finished(request_id, STATE_TIMED_OUT)
+            
+            # Clean up - move the request to the bounded history after it's handled
+            self._note_timed_out(request_id, wait_ended)
                 
             return False
-
-
-
+    
+    def reconcile(self) -> None:
+        """
+        Recover persisted work after a restart.
+        
+        Expired deletions are carried out in bulk, pending ones are handed to the
+        scheduler again, and pickup requests whose wait is still running are resumed
+        in background threads. Requests whose wait ran out while the process was
+        down are closed like a timed out request.
+        
+        With several replicas sharing the store, only requests whose lease ran
+        out are resumed; requests another replica is running are left to it.
+        """
+        if self.store is None:
+            return
+        
+        scheduler = get_scheduler(self.TOKEN, self.delete_messages, self.store)
+        now = time.time()
+        
+        expired, pending = self._split_deletions(self.store.pending_deletions(), now)
+        for deletion in pending:
+            scheduler.schedule(deletion["chat_id"], deletion["message_id"], deletion["delete_at"] - now,
+                               store_key=deletion["deletion_id"])
+        for chat_id, deletions in expired.items():
+            self.delete_messages(chat_id, [deletion["message_id"] for deletion in deletions])
+            self.store.remove_deletions([deletion["deletion_id"] for deletion in deletions])
+        
+        self.resume_requests()
+        self.store.purge_finished()
+    
+    def resume_requests(self) -> None:
+        """
+        Resume the open requests whose lease ran out, e.g. because the process running them stopped.
+        
+        While other processes hold leases of open requests, this runs again
+        once those leases could have run out, so the requests of a replica
+        that stops later are taken over as well.
+        """
+        now = time.time()
+        for request in self.store.take_over_requests():
+            bot, workflow_kwargs, volunteer = self._resumed_bot(request, now)
+            thread = threading.Thread(target=bot._complete_pickup_workflow,
+                                      kwargs=dict(workflow_kwargs, claimed_by=volunteer))
+            thread.daemon = True
+            thread.start()
+        
+        if self.store.leased_elsewhere():
+            timer = threading.Timer(REQUEST_LEASE_SECONDS, self.resume_requests)
+            timer.daemon = True
+            timer.start()
+        
+        self.store.purge_finished()
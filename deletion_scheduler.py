@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from request_store import RequestStore
+
+
+# Deletions due within this many seconds of each other are sent as one batch
+BATCH_WINDOW_SECONDS = 1.0
+
+
+class _Job:
+    """A message waiting for its deletion deadline."""
+
+    __slots__ = ("chat_id", "message_id", "deadline", "store_key")
+
+    def __init__(self, chat_id: Union[str, int], message_id: int, deadline: float, store_key: Optional[int]):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.deadline = deadline
+        self.store_key = store_key
+
+
+class DeletionScheduler:
+    def __init__(self, delete_messages: Callable[[Union[str, int], List[int]], bool],
+                 batch_window: float = BATCH_WINDOW_SECONDS, store: Optional[RequestStore] = None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            delete_messages: Function deleting a list of messages in one chat
+            batch_window: Seconds within which due deletions are batched together
+            store: Durable store holding the pending deletions, if any
+        """
+        self._delete_messages = delete_messages
+        self.store = store
+        self._batch_window = batch_window
+        self._condition = threading.Condition()
+        self._heap: List[Tuple[float, int, int]] = []
+        self._jobs: Dict[int, _Job] = {}
+        self._job_ids = itertools.count(1)
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, chat_id: Union[str, int], message_id: int, delay_seconds: float,
+                 store_key: Optional[int] = None) -> int:
+        """
+        Schedule a message for deletion.
+
+        Args:
+            chat_id: Chat ID where the message was sent
+            message_id: ID of the message to delete
+            delay_seconds: Time in seconds after which to delete the message
+            store_key: ID of the deletion in the durable store, if it was persisted
+
+        Returns:
+            Job ID that can be used to cancel or reschedule the deletion
+        """
+        deadline = time.monotonic() + delay_seconds
+        with self._condition:
+            job_id = next(self._job_ids)
+            self._jobs[job_id] = _Job(chat_id, message_id, deadline, store_key)
+            heapq.heappush(self._heap, (deadline, next(self._sequence), job_id))
+            self._ensure_running()
+            self._condition.notify()
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Cancel a scheduled deletion.
+
+        Args:
+            job_id: ID returned by schedule()
+
+        Returns:
+            True if the job was pending, False otherwise
+        """
+        with self._condition:
+            # The heap entry stays behind and is skipped once it comes due
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            return False
+        if self.store is not None and job.store_key is not None:
+            self.store.remove_deletions([job.store_key])
+        return True
+
+    def reschedule(self, job_id: int, delay_seconds: float) -> bool:
+        """
+        Move a scheduled deletion to a new deadline.
+
+        Args:
+            job_id: ID returned by schedule()
+            delay_seconds: New delay in seconds from now
+
+        Returns:
+            True if the job was pending, False otherwise
+        """
+        deadline = time.monotonic() + delay_seconds
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.deadline = deadline
+            heapq.heappush(self._heap, (deadline, next(self._sequence), job_id))
+            self._condition.notify()
+        if self.store is not None and job.store_key is not None:
+            self.store.update_deletion(job.store_key, time.time() + delay_seconds)
+        return True
+
+    def pending(self) -> int:
+        """Return the number of deletions still waiting for their deadline."""
+        with self._condition:
+            return len(self._jobs)
+
+    def _ensure_running(self) -> None:
+        """Start the scheduler thread if needed. Must be called with the lock held."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="telegram-deletion-scheduler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _pop_due(self) -> Dict[Union[str, int], List[_Job]]:
+        """Wait for the next due jobs and remove them from the heap, grouped by chat."""
+        with self._condition:
+            while True:
+                while self._heap:
+                    deadline, _, job_id = self._heap[0]
+                    job = self._jobs.get(job_id)
+                    # Drop entries of cancelled jobs and superseded deadlines
+                    if job is None or job.deadline != deadline:
+                        heapq.heappop(self._heap)
+                        continue
+                    break
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                now = time.monotonic()
+                if self._heap[0][0] > now:
+                    self._condition.wait(self._heap[0][0] - now)
+                    continue
+
+                due: Dict[Union[str, int], List[_Job]] = {}
+                horizon = now + self._batch_window
+                while self._heap and self._heap[0][0] <= horizon:
+                    deadline, _, job_id = heapq.heappop(self._heap)
+                    job = self._jobs.get(job_id)
+                    if job is None or job.deadline != deadline:
+                        continue
+                    del self._jobs[job_id]
+                    due.setdefault(job.chat_id, []).append(job)
+                return due
+
+    def _run(self) -> None:
+        """Delete messages as their deadlines pass."""
+        while True:
+            due = self._pop_due()
+            for chat_id, jobs in due.items():
+                message_ids = [job.message_id for job in jobs]
+                try:
+                    if self._delete_messages(chat_id, message_ids):
+                        print(f"Auto-deleted {len(message_ids)} message(s) in chat {chat_id}")
+                    else:
+                        print(f"Failed to auto-delete messages {message_ids} in chat {chat_id}")
+                except Exception as e:
+                    print(f"Failed to auto-delete messages {message_ids} in chat {chat_id}: {e}")
+                # Failed deletions are not retried: the message is usually gone already
+                if self.store is not None:
+                    self.store.remove_deletions([job.store_key for job in jobs if job.store_key is not None])
+
+
+# Keyed by token and store, so a bot never persists its deletions in the store of another
+_schedulers: Dict[Tuple[str, Optional[RequestStore]], DeletionScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(token: str, delete_messages: Callable[[Union[str, int], List[int]], bool],
+                  store: Optional[RequestStore] = None) -> DeletionScheduler:
+    """
+    Get the process-wide deletion scheduler for a bot token and store, creating it on first use.
+
+    Args:
+        token: Telegram bot API token
+        delete_messages: Function deleting a list of messages in one chat
+        store: Durable store for pending deletions, None if they are kept in memory only
+
+    Returns:
+        The scheduler handling the deletions of this token and store
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get((token, store))
+        if scheduler is None:
+            scheduler = DeletionScheduler(delete_messages, store=store)
+            _schedulers[(token, store)] = scheduler
+        return scheduler
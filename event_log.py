@@ -0,0 +1,361 @@
+import argparse
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from message_templates import DEFAULT_TIMEZONE, get_timezone
+from volunteer_registry import TIME_SLOTS
+
+
+# Lifecycle events of a pickup request
+EVENT_POSTED = "posted"
+EVENT_CLAIMED = "claimed"
+EVENT_DM_SENT = "dm_sent"
+EVENT_TIMED_OUT = "timed_out"
+EVENT_DELETED = "deleted"
+EVENT_CANCELLED = "cancelled"
+
+# An event log is a JSON line per event with these keys:
+#   t     Unix time of the event
+#   ev    one of the EVENT_* constants
+#   rid   request ID
+#   slot  time slot of the pickup, one of TIME_SLOTS for requests from the app
+#   date  date of the pickup as shown to the donor
+#   loc   pickup location
+#   wait  seconds from the post to the claim or the timeout
+#   via   "direct" if the claim answered a direct message, "group" otherwise
+
+# The log is rotated when it grows beyond this size; rotated files get the suffixes .1, .2, ...
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+# Rotated files kept besides the current one
+DEFAULT_BACKUP_COUNT = 5
+
+# Events are written in blocks of this size, or after FLUSH_SECONDS at the latest
+WRITE_BUFFER_SIZE = 64 * 1024
+FLUSH_SECONDS = 5.0
+
+# Upper bounds of the claim latency buckets in seconds; the report keeps one
+# fixed set of counters per slot and weekday, however long the logs are
+LATENCY_BUCKETS = (15, 30, 60, 120, 180, 300, 450, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200)
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Pickup times that are not one of the page-2 slots, e.g. from older clients
+OTHER_SLOT = "Other"
+
+
+class EventLog:
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, backup_count: int = DEFAULT_BACKUP_COUNT,
+                 flush_seconds: float = FLUSH_SECONDS):
+        """
+        Open a lifecycle event log for appending.
+
+        Events are buffered and written in blocks by a background thread, so
+        recording never waits for the disk; at most flush_seconds of events
+        are lost if the process dies.
+
+        Args:
+            path: Path of the current log file
+            max_bytes: Size at which the log is rotated
+            backup_count: Rotated files kept, the oldest is deleted beyond it
+            flush_seconds: Longest time an event stays in the buffer
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+        self._size = self._file.tell()
+        self._closed = threading.Event()
+        threading.Thread(target=self._flush_loop, name="event-log-flush", daemon=True).start()
+
+    def record(self, event: str, request_id: str, **fields: Any) -> None:
+        """
+        Append one event to the log.
+
+        Recording must never break a workflow, so failures are only printed.
+
+        Args:
+            event: One of the EVENT_* constants
+            request_id: The unique ID of the pickup request
+            fields: Further keys of the event, see the format above
+        """
+        entry = {"t": round(time.time(), 3), "ev": event, "rid": request_id}
+        entry.update(fields)
+        try:
+            line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n"
+            with self._lock:
+                size = len(line.encode("utf-8"))
+                if self._size and self._size + size > self.max_bytes:
+                    self._rotate()
+                self._file.write(line)
+                self._size += size
+        except Exception as e:
+            print(f"Failed to record {event} event of request {request_id}: {e}")
+
+    def _rotate(self) -> None:
+        """Move the current file to .1, shifting older files up; the caller holds the lock."""
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+        self._size = 0
+
+    def _flush_loop(self) -> None:
+        """Write buffered events every flush_seconds until the log is closed."""
+        while not self._closed.wait(self.flush_seconds):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered events to the file."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self) -> None:
+        """Write buffered events and close the file."""
+        self._closed.set()
+        with self._lock:
+            self._file.close()
+
+
+def log_files(path: str) -> List[str]:
+    """
+    List the files of a rotated log, oldest first.
+
+    Args:
+        path: Path of the current log file
+
+    Returns:
+        Paths of the rotated files from the highest suffix down, then the current file if it exists
+    """
+    rotated = []
+    for name in glob.glob(glob.escape(path) + ".*"):
+        suffix = name[len(path) + 1:]
+        if suffix.isdigit():
+            rotated.append((int(suffix), name))
+    files = [name for _, name in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_events(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the events of log files one at a time.
+
+    Lines that are not valid JSON, like a line cut off by a crash, are skipped.
+
+    Args:
+        paths: Log files in the order to read them
+
+    Yields:
+        One event per line
+    """
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+class LatencyHistogram:
+    """Claim latencies counted into LATENCY_BUCKETS, with percentiles estimated from the buckets."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        # One counter per bucket and one for latencies beyond the last bucket
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Count one latency.
+
+        Args:
+            seconds: Time from the post to the claim
+        """
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, share: float) -> Optional[float]:
+        """
+        Estimate a percentile by linear interpolation inside its bucket.
+
+        Args:
+            share: Percentile as a share, e.g. 0.95
+
+        Returns:
+            The latency in seconds, None if nothing was counted
+        """
+        if not self.count:
+            return None
+        rank = share * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = LATENCY_BUCKETS[index - 1] if index > 0 else 0.0
+                upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class _SlotStats:
+    """Counters of one row of the capacity report."""
+
+    __slots__ = ("posted", "claimed", "timed_out", "cancelled", "latency")
+
+    def __init__(self):
+        self.posted = 0
+        self.claimed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.latency = LatencyHistogram()
+
+    def row(self) -> Dict[str, Any]:
+        """Summarize the counters."""
+        finished = self.claimed + self.timed_out
+        row: Dict[str, Any] = {
+            "posted": self.posted,
+            "claimed": self.claimed,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "claim_rate": round(self.claimed / finished, 3) if finished else None,
+        }
+        for name, share in (("p50_s", 0.5), ("p90_s", 0.9), ("p95_s", 0.95)):
+            value = self.latency.percentile(share)
+            row[name] = round(value, 1) if value is not None else None
+        row["mean_s"] = round(self.latency.total / self.latency.count, 1) if self.latency.count else None
+        row["max_s"] = round(self.latency.max, 1) if self.latency.count else None
+        return row
+
+
+def capacity_report(events: Iterator[Dict[str, Any]], timezone: str = DEFAULT_TIMEZONE) -> Dict[str, Any]:
+    """
+    Summarize how fast requests are claimed, per page-2 time slot and per weekday.
+
+    The events are consumed in one pass and only fixed counters are kept,
+    so the memory used does not grow with the length of the logs.
+
+    Args:
+        events: Events in any order, e.g. from read_events
+        timezone: Timezone the weekday of an event is taken in
+
+    Returns:
+        The report with one row per slot and per weekday, and one for all requests
+    """
+    tz = get_timezone(timezone)
+    slots = {slot: _SlotStats() for slot in TIME_SLOTS + (OTHER_SLOT,)}
+    weekdays = {weekday: _SlotStats() for weekday in WEEKDAYS}
+    overall = _SlotStats()
+    first: Optional[float] = None
+    last: Optional[float] = None
+    count = 0
+
+    for event in events:
+        kind = event.get("ev")
+        if kind not in (EVENT_POSTED, EVENT_CLAIMED, EVENT_TIMED_OUT, EVENT_CANCELLED):
+            continue
+        count += 1
+        at = event.get("t", 0.0)
+        first = at if first is None else min(first, at)
+        last = at if last is None else max(last, at)
+        slot = event.get("slot")
+        rows: Tuple[_SlotStats, ...] = (slots.get(slot, slots[OTHER_SLOT]),
+                                        weekdays[WEEKDAYS[datetime.fromtimestamp(at, tz).weekday()]], overall)
+        for stats in rows:
+            if kind == EVENT_POSTED:
+                stats.posted += 1
+            elif kind == EVENT_CLAIMED:
+                stats.claimed += 1
+                if "wait" in event:
+                    stats.latency.observe(max(event["wait"], 0.0))
+            elif kind == EVENT_TIMED_OUT:
+                stats.timed_out += 1
+            else:
+                stats.cancelled += 1
+
+    return {
+        "events": count,
+        "from": datetime.fromtimestamp(first, tz).isoformat() if first is not None else None,
+        "to": datetime.fromtimestamp(last, tz).isoformat() if last is not None else None,
+        "timezone": timezone,
+        "slots": {slot: stats.row() for slot, stats in slots.items() if stats.posted or slot != OTHER_SLOT},
+        "weekdays": {weekday: stats.row() for weekday, stats in weekdays.items()},
+        "all": overall.row()
+    }
+
+
+_event_log: Optional[EventLog] = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log() -> Optional[EventLog]:
+    """
+    Get the process-wide event log if event logging is switched on.
+
+    Logging is opt-in: PICKUP_EVENT_LOG names the log file.
+
+    Returns:
+        The shared event log, None if PICKUP_EVENT_LOG is not set
+    """
+    global _event_log
+    path = os.environ.get("PICKUP_EVENT_LOG")
+    if not path:
+        return None
+    with _event_log_lock:
+        if _event_log is None:
+            _event_log = EventLog(path)
+            # Buffered events would be lost at a regular exit otherwise
+            atexit.register(_event_log.close)
+        return _event_log
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Report on the lifecycle events of pickup requests.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report = commands.add_parser("report", help="Claim latency percentiles per time slot and weekday")
+    report.add_argument("log", nargs="?", default=os.environ.get("PICKUP_EVENT_LOG", "pickup_events.log"),
+                        help="Current log file, rotated files next to it are read too; defaults to PICKUP_EVENT_LOG")
+    report.add_argument("--timezone", default=DEFAULT_TIMEZONE, help="Timezone of the weekdays")
+    report.add_argument("--output", help="Write the report as JSON to this file")
+
+    args = parser.parse_args()
+    files = log_files(args.log)
+    if not files:
+        parser.error(f"No event log at {args.log}")
+    text = json.dumps(dict(capacity_report(read_events(files), args.timezone), files=files), indent=2,
+                      ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
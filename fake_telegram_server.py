@@ -0,0 +1,340 @@
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+
+# Matches the deep link of the "CONFIRM PICK-UP" button in a group post
+START_LINK_PATTERN = re.compile(r"[?&]start=([\w-]+)")
+
+# Volunteers simulated by auto_claim get user IDs counting up from here
+FIRST_VOLUNTEER_ID = 100000
+
+
+class _FakeApiHandler(BaseHTTPRequestHandler):
+    """Serves /bot<token>/<method> like the Bot API does."""
+
+    server: "FakeTelegramServer"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        self._handle(url.path, dict(parse_qsl(url.query)))
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if body:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params.update(json.loads(body))
+            else:
+                params.update(parse_qsl(body.decode()))
+        self._handle(url.path, params)
+
+    def _handle(self, path: str, params: Dict[str, Any]) -> None:
+        parts = path.strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        status, payload = self.server.handle_call(parts[1], params)
+        if payload is None:
+            self._reply_html(status)
+            return
+        self._reply(status, payload)
+
+    def _reply_html(self, status: int) -> None:
+        body = f"<html><body><h1>{status}</h1></body></html>".encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    """
+    In-process stand-in for the Telegram Bot API.
+
+    Implements sendMessage, deleteMessage, deleteMessages, editMessageText,
+    editMessageReplyMarkup and getUpdates with long-poll semantics, plus
+    no-op webhook methods. Rate limiting (429 with retry_after), gateway
+    errors, response latency and volunteer /start clicks can be injected to drive tests and
+    benchmarks without network access.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        Initialize the fake server.
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+        """
+        super().__init__((host, port), _FakeApiHandler)
+        self._condition = threading.Condition()
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._volunteer_ids = itertools.count(FIRST_VOLUNTEER_ID)
+        self._messages: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self._rate_limits: List[Tuple[Optional[str], int]] = []
+        self._server_errors: List[Tuple[Optional[str], int]] = []
+        self.calls: Counter = Counter()
+        self.latency = 0.0
+        self.auto_claim: Optional[Callable[[str], Optional[float]]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """Root URL to configure as the Bot API base URL."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-telegram-api")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+    def inject_rate_limit(self, retry_after: int = 1, count: int = 1, method: Optional[str] = None) -> None:
+        """
+        Answer the next calls with HTTP 429.
+
+        Args:
+            retry_after: Value of parameters.retry_after in the error
+            count: Number of calls to reject
+            method: Only reject calls of this method, any method if None
+        """
+        with self._condition:
+            self._rate_limits.extend([(method, retry_after)] * count)
+
+    def inject_server_error(self, status: int = 502, count: int = 1, method: Optional[str] = None) -> None:
+        """
+        Answer the next calls with an HTML error page, like a failing gateway.
+
+        Args:
+            status: HTTP status of the error
+            count: Number of calls to fail
+            method: Only fail calls of this method, any method if None
+        """
+        with self._condition:
+            self._server_errors.extend([(method, status)] * count)
+
+    def click_start(self, request_id: str, user_id: Optional[int] = None, first_name: str = "Volunteer",
+                    username: str = "", delay: float = 0.0) -> None:
+        """
+        Simulate a volunteer sending "/start <request_id>" to the bot.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            user_id: Telegram ID of the volunteer, a fresh one if None
+            first_name: First name of the volunteer
+            username: Username of the volunteer
+            delay: Seconds to wait before the click
+        """
+        if user_id is None:
+            user_id = next(self._volunteer_ids)
+
+        def click() -> None:
+            message = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": first_name, "username": username},
+                "from": {"id": user_id, "is_bot": False, "first_name": first_name, "username": username},
+                "text": f"/start {request_id}"
+            }
+            # The bot deletes the /start message, so it has to exist
+            with self._condition:
+                self._messages[(str(user_id), message["message_id"])] = message
+            self.push_update({"message": message})
+
+        if delay > 0:
+            timer = threading.Timer(delay, click)
+            timer.daemon = True
+            timer.start()
+        else:
+            click()
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """
+        Queue an update for getUpdates.
+
+        Args:
+            update: Update object without update_id
+
+        Returns:
+            The assigned update ID
+        """
+        with self._condition:
+            update = dict(update, update_id=next(self._update_ids))
+            self._updates.append(update)
+            self._condition.notify_all()
+        return update["update_id"]
+
+    def message(self, chat_id: Any, message_id: int) -> Optional[Dict[str, Any]]:
+        """Return a message that has not been deleted, None otherwise."""
+        with self._condition:
+            return self._messages.get((str(chat_id), int(message_id)))
+
+    def live_messages(self) -> int:
+        """Return the number of sent messages that have not been deleted."""
+        with self._condition:
+            return len(self._messages)
+
+    def handle_call(self, method: str, params: Dict[str, Any]) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """
+        Execute one Bot API call.
+
+        Args:
+            method: Bot API method name
+            params: Decoded parameters of the call
+
+        Returns:
+            Tuple of (HTTP status, JSON payload), the payload is None for an HTML error page
+        """
+        with self._condition:
+            self.calls[method] += 1
+            for i, (failing_method, status) in enumerate(self._server_errors):
+                if failing_method is None or failing_method == method:
+                    del self._server_errors[i]
+                    return status, None
+            for i, (limited_method, retry_after) in enumerate(self._rate_limits):
+                if limited_method is None or limited_method == method:
+                    del self._rate_limits[i]
+                    return 429, {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": f"Too Many Requests: retry after {retry_after}",
+                        "parameters": {"retry_after": retry_after}
+                    }
+
+        if method == "getUpdates":
+            return 200, self._get_updates(params)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+        return handler(params)
+
+    def _get_updates(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Return pending updates, waiting up to the long-poll timeout for new ones."""
+        offset = int(params.get("offset") or 0)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        allowed = params.get("allowed_updates")
+        if isinstance(allowed, str):
+            allowed = json.loads(allowed)
+        with self._condition:
+            # Like Telegram, an offset confirms all earlier updates
+            if offset:
+                self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while True:
+                # Telegram drops the update types a consumer did not ask for
+                if allowed:
+                    self._updates = [update for update in self._updates if any(kind in update for kind in allowed)]
+                if self._updates:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return {"ok": True, "result": list(self._updates)}
+
+    def _api_sendMessage(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        chat_id = str(params.get("chat_id", ""))
+        if not chat_id or "text" not in params:
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message text is empty"}
+
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else chat_id},
+            "text": params["text"]
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        with self._condition:
+            self._messages[(chat_id, message["message_id"])] = message
+
+        match = START_LINK_PATTERN.search(params.get("reply_markup", ""))
+        if match and self.auto_claim is not None:
+            delay = self.auto_claim(match.group(1))
+            if delay is not None:
+                self.click_start(match.group(1), delay=delay)
+        return 200, {"ok": True, "result": message}
+
+    def _api_deleteMessage(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        with self._condition:
+            message = self._messages.pop((str(params.get("chat_id")), int(params.get("message_id", 0))), None)
+        if message is None:
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message to delete not found"}
+        return 200, {"ok": True, "result": True}
+
+    def _api_deleteMessages(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        message_ids = params.get("message_ids", "[]")
+        if isinstance(message_ids, str):
+            message_ids = json.loads(message_ids)
+        with self._condition:
+            for message_id in message_ids:
+                self._messages.pop((str(params.get("chat_id")), int(message_id)), None)
+        return 200, {"ok": True, "result": True}
+
+    def _api_editMessageText(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        with self._condition:
+            message = self._messages.get((str(params.get("chat_id")), int(params.get("message_id", 0))))
+            if message is None:
+                return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message to edit not found"}
+            message["text"] = params.get("text", "")
+            # Like Telegram, an edit without reply_markup removes the keyboard
+            if params.get("reply_markup"):
+                message["reply_markup"] = json.loads(params["reply_markup"])
+            else:
+                message.pop("reply_markup", None)
+            return 200, {"ok": True, "result": dict(message)}
+
+    def _api_editMessageReplyMarkup(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        with self._condition:
+            message = self._messages.get((str(params.get("chat_id")), int(params.get("message_id", 0))))
+            if message is None:
+                return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message to edit not found"}
+            if params.get("reply_markup"):
+                message["reply_markup"] = json.loads(params["reply_markup"])
+            else:
+                message.pop("reply_markup", None)
+            return 200, {"ok": True, "result": dict(message)}
+
+    def _api_deleteWebhook(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if str(params.get("drop_pending_updates")).lower() == "true":
+            with self._condition:
+                self._updates = []
+        return 200, {"ok": True, "result": True, "description": "Webhook was deleted"}
+
+    def _api_setWebhook(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        return 200, {"ok": True, "result": True, "description": "Webhook was set"}
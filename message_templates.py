@@ -0,0 +1,411 @@
+import functools
+import html
+import json
+import os
+import re
+import string
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import pytz
+
+
+# Telegram rejects messages longer than this, counted after HTML parsing
+MAX_MESSAGE_LENGTH = 4096
+
+# Longest value a template field may take unless the template says otherwise
+DEFAULT_FIELD_LIMIT = 128
+
+DEFAULT_LOCALE = "en"
+DEFAULT_TIMEZONE = "Europe/Helsinki"
+
+BOT_USERNAME = "skat_cards_distribution_bot"
+
+# How long volunteers have to respond to a group post, in seconds
+RESPONSE_WINDOW_SECONDS = 3600
+
+# Appended to values that were cut to their limit
+ELLIPSIS = "…"
+
+# Deep-link start parameters may only contain these characters
+_START_PARAMETER = re.compile(r"[A-Za-z0-9_-]{1,64}")
+_HTML_SPECIAL = re.compile(r'[&<>"]')
+_HTML_TAG = re.compile(r"<[^>]*>")
+_FORMATTER = string.Formatter()
+
+
+def escape(text: str) -> str:
+    """
+    Escape text for messages sent with parse_mode=HTML.
+
+    Args:
+        text: Untrusted text, e.g. a location typed by a donor
+
+    Returns:
+        The text with &, <, > and " replaced by entities
+    """
+    # Most values contain nothing to escape, and the search is cheaper than escaping
+    if _HTML_SPECIAL.search(text) is None:
+        return text
+    return html.escape(text)
+
+
+def truncate(text: str, limit: int) -> str:
+    """
+    Shorten text to a maximum length, marking the cut with an ellipsis.
+
+    Args:
+        text: Text to shorten
+        limit: Maximum length including the ellipsis
+
+    Returns:
+        The text, shortened if it was longer than limit
+    """
+    if len(text) <= limit:
+        return text
+    return text[:limit - len(ELLIPSIS)].rstrip() + ELLIPSIS
+
+
+class Template:
+    def __init__(self, text: str, limits: Optional[Dict[str, int]] = None, raw: Tuple[str, ...] = ()):
+        """
+        Compile a message template written for str.format.
+
+        Field values are truncated to their limit and HTML-escaped on
+        rendering, except for raw fields, which take pre-rendered HTML such as
+        the output of another template. Since every field is bounded, the
+        longest possible message is known here and checked against
+        Telegram's limit once instead of on every send.
+
+        Args:
+            text: Template text with HTML markup and {field} placeholders
+            limits: Maximum length per field, DEFAULT_FIELD_LIMIT for fields not listed
+            raw: Fields inserted as they are; their limit must cover the longest value
+
+        Raises:
+            ValueError: If the template could exceed MAX_MESSAGE_LENGTH
+        """
+        limits = limits or {}
+        literal = []
+        fields = []
+        for literal_text, field_name, format_spec, conversion in _FORMATTER.parse(text):
+            literal.append(literal_text)
+            if field_name is not None:
+                fields.append(field_name)
+
+        self.fields: Tuple[str, ...] = tuple(dict.fromkeys(fields))
+        self._limits = {name: limits.get(name, DEFAULT_FIELD_LIMIT) for name in self.fields}
+        self._raw = frozenset(raw)
+        self._format = text.format
+        # Telegram counts the text after parsing, so tags and entities count as what they show
+        self.max_length = (len(html.unescape(_HTML_TAG.sub("", "".join(literal))))
+                           + sum(self._limits[name] for name in fields))
+        if self.max_length > MAX_MESSAGE_LENGTH:
+            raise ValueError(f"Template can reach {self.max_length} characters, Telegram allows {MAX_MESSAGE_LENGTH}")
+
+    def render(self, **values: Any) -> str:
+        """
+        Fill in the template.
+
+        Args:
+            **values: One value per field; other keys are ignored
+
+        Returns:
+            The message text
+        """
+        arguments = {}
+        for name in self.fields:
+            value = str(values[name])
+            arguments[name] = value if name in self._raw else escape(truncate(value, self._limits[name]))
+        return self._format(**arguments)
+
+
+class ClaimButton:
+    def __init__(self, text: str, bot_username: str = BOT_USERNAME):
+        """
+        Serialize the inline keyboard with the claim deep link once.
+
+        Only the request ID differs between keyboards, so it is spliced
+        into the pre-serialized JSON instead of dumping a new dictionary
+        for every post.
+
+        Args:
+            text: Label of the button
+            bot_username: Username of the bot the deep link opens
+        """
+        marker = "\x00"
+        keyboard = {"inline_keyboard": [[{"text": text, "url": f"https://t.me/{bot_username}?start={marker}"}]]}
+        # json.dumps writes the marker as an escape sequence, which cannot occur anywhere else
+        self._prefix, self._suffix = json.dumps(keyboard).split(json.dumps(marker)[1:-1])
+
+    def render(self, request_id: str) -> str:
+        """
+        Build the reply markup for a request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            Reply markup JSON
+
+        Raises:
+            ValueError: If the request ID cannot be used as a deep-link parameter
+        """
+        if _START_PARAMETER.fullmatch(request_id) is None:
+            raise ValueError(f"Invalid request ID for a deep link: {request_id!r}")
+        return self._prefix + request_id + self._suffix
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(name: str = DEFAULT_TIMEZONE) -> Any:
+    """
+    Resolve a timezone once.
+
+    Args:
+        name: IANA timezone name
+
+    Returns:
+        The pytz timezone
+    """
+    return pytz.timezone(name)
+
+
+@functools.lru_cache(maxsize=8)
+def _format_minute(minute: int, timezone: str) -> str:
+    """Format the start of a Unix minute as HH:MM in a timezone."""
+    return datetime.fromtimestamp(minute * 60, get_timezone(timezone)).strftime("%H:%M")
+
+
+def format_clock(timestamp: float, timezone: str = DEFAULT_TIMEZONE) -> str:
+    """
+    Format a time of day as HH:MM, reusing the result within the same minute.
+
+    Args:
+        timestamp: Unix time
+        timezone: IANA timezone name
+
+    Returns:
+        The local time, e.g. "14:05"
+    """
+    return _format_minute(int(timestamp // 60), timezone)
+
+
+# Message texts by locale. New languages are added here with the same keys.
+CATALOGS: Dict[str, Dict[str, str]] = {
+    "en": {
+        "claim_button": "CONFIRM PICK-UP! Click and START.",
+        "note": "<b>Note:</b> <i>{remarks}</i> \n",
+        "group_announcement": (
+            "Hey Foodsavers, we have a request for an Event Pick Up (ID: {request_id}).\n\n"
+            "<b>Where:</b> <i>{location}</i> \n"
+            "<b>When:</b> <i>{date}</i> \n"
+            "{note}"
+            "<b>Time:</b> <i>{pick_up_time}</i> \n\n"
+            "You have time until {response_time} to respond. \n"
+            "If you can pick up:"
+        ),
+        "invitation": (
+            "Hello <b>{first_name}</b>, a pick-up in your area needs a Foodsaver (ID: {request_id}).\n\n"
+            "<b>Where:</b> <i>{location}</i> \n"
+            "<b>When:</b> <i>{date}</i> \n"
+            "{note}"
+            "<b>Time:</b> <i>{pick_up_time}</i> \n\n"
+            "You are hearing about it before the group. If you can pick up:"
+        ),
+        "private_message": (
+            "Hello <b>{first_name}</b>!\n"
+            "Thank you for signing in. You're now registered.\n"
+            "Request for an Event Pick Up (ID: {request_id}):\n\n"
+            "<b>Where:</b> <i>{location}</i> \n"
+            "<b>When:</b> <i>{date}</i> \n"
+            "{note}"
+            "<b>Time:</b> <i>{pick_up_time}</i> \n\n"
+            "Please reach out to the Event host as soon as possible to:\n"
+            "<b>1.</b> Confirm Pick up.\n"
+            "<b>2.</b> Ask for pick-up time and amount.\n"
+            "\n"
+            "Call Event Host: "
+            "<a href=\"tel:{clean_number}\">{contact_number}</a>"
+            "\n"
+            "\n"
+            "Call now, message will be deleted in 15 minutes."
+        ),
+        "confirmation": "<b>{first_name}</b> is signing in for Pick-Up (ID: {request_id}) at {date}, {pick_up_time}.",
+        "confirmation_with_username": (
+            "<b>{first_name}</b> (@{username}) is signing in for Pick-Up (ID: {request_id}) at {date}, {pick_up_time}."
+        ),
+        "denial": "Unfortunately, no one has time for Pick-Up (ID: {request_id}).",
+    }
+}
+
+# Longest accepted values of the fields filled in from user input
+_FIELD_LIMITS = {
+    "location": 512,
+    "remarks": 1024,
+    "first_name": 64,
+    "username": 32,
+    "contact_number": 32,
+    "clean_number": 32,
+    "request_id": 64,
+}
+
+# Remarks the donor left empty; the bots pass "Not specified" for them once the request is claimed
+_NO_REMARKS = ("", "Not specified")
+
+_CLEAN_NUMBER = str.maketrans("", "", " -()")
+
+
+class MessageCatalog:
+    def __init__(self, locale: str = DEFAULT_LOCALE, timezone: str = DEFAULT_TIMEZONE):
+        """
+        Compile the message templates of a locale.
+
+        Args:
+            locale: Key of CATALOGS
+            timezone: IANA timezone for times shown in messages
+        """
+        texts = CATALOGS[locale]
+        self.locale = locale
+        self.timezone = timezone
+        self._claim_button = ClaimButton(texts["claim_button"])
+        self._note = Template(texts["note"], _FIELD_LIMITS)
+        note_limit = {"note": self._note.max_length}
+        limits = dict(_FIELD_LIMITS, **note_limit)
+        self._group_announcement = Template(texts["group_announcement"], limits, raw=("note",))
+        self._invitation = Template(texts["invitation"], limits, raw=("note",))
+        self._private_message = Template(texts["private_message"], limits, raw=("note",))
+        self._confirmation = Template(texts["confirmation"], _FIELD_LIMITS)
+        self._confirmation_with_username = Template(texts["confirmation_with_username"], _FIELD_LIMITS)
+        self._denial = Template(texts["denial"], _FIELD_LIMITS)
+
+    def _render_note(self, remarks: str) -> str:
+        """Render the remarks line, empty if the donor left no remarks."""
+        return "" if remarks in _NO_REMARKS else self._note.render(remarks=remarks)
+
+    def claim_button(self, request_id: str) -> str:
+        """
+        Build the inline keyboard with the deep link volunteers click to claim a request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            Reply markup JSON
+        """
+        return self._claim_button.render(request_id)
+
+    def group_announcement(self, request_id: str, location: str, remarks: str, date: str,
+                           pick_up_time: str) -> Tuple[str, str]:
+        """
+        Build the announcement posted to the group for a new request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+
+        Returns:
+            Tuple of (message text, reply markup JSON)
+        """
+        message = self._group_announcement.render(
+            request_id=request_id, location=location, date=date, pick_up_time=pick_up_time,
+            note=self._render_note(remarks),
+            response_time=format_clock(time.time() + RESPONSE_WINDOW_SECONDS, self.timezone)
+        )
+        return message, self.claim_button(request_id)
+
+    def invitation(self, first_name: str, request_id: str, location: str, remarks: str, date: str,
+                   pick_up_time: str) -> Tuple[str, str]:
+        """
+        Build the direct message offering a new request to a matching volunteer.
+
+        Args:
+            first_name: Volunteer's first name
+            request_id: The unique ID of the pickup request
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+
+        Returns:
+            Tuple of (message text, reply markup JSON)
+        """
+        message = self._invitation.render(first_name=first_name, request_id=request_id, location=location, date=date,
+                                          pick_up_time=pick_up_time, note=self._render_note(remarks))
+        return message, self.claim_button(request_id)
+
+    def private_message(self, first_name: str, contact_number: str, location: str, remarks: str, date: str,
+                        pick_up_time: str, request_id: str) -> str:
+        """
+        Build the private message sharing the donor's contact number with a volunteer.
+
+        Args:
+            first_name: User's first name
+            contact_number: Contact number to share with the user
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of pickup
+            pick_up_time: Time of pickup
+            request_id: Unique request ID
+
+        Returns:
+            Message text
+        """
+        return self._private_message.render(
+            first_name=first_name, request_id=request_id, location=location, date=date, pick_up_time=pick_up_time,
+            note=self._render_note(remarks), contact_number=contact_number,
+            clean_number=contact_number.translate(_CLEAN_NUMBER)
+        )
+
+    def confirmation(self, user_info: Dict[str, Any], date: str, pick_up_time: str) -> str:
+        """
+        Build the group message announcing who signed in for a request.
+
+        Args:
+            user_info: Dictionary containing user information
+            date: Date of pickup
+            pick_up_time: Time of pickup
+
+        Returns:
+            Message text
+        """
+        template = self._confirmation_with_username if user_info.get("username") else self._confirmation
+        return template.render(first_name=user_info["first_name"], username=user_info.get("username", ""),
+                               request_id=user_info.get("request_id", ""), date=date, pick_up_time=pick_up_time)
+
+    def denial(self, request_id: str) -> str:
+        """
+        Build the group message announcing that nobody signed in for a request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            Message text
+        """
+        return self._denial.render(request_id=request_id)
+
+
+_catalogs: Dict[Tuple[str, str], MessageCatalog] = {}
+
+
+def get_catalog(locale: Optional[str] = None, timezone: str = DEFAULT_TIMEZONE) -> MessageCatalog:
+    """
+    Get the compiled catalog of a locale, compiling it on first use.
+
+    Args:
+        locale: Key of CATALOGS, PICKUP_LOCALE or "en" if None
+        timezone: IANA timezone for times shown in messages
+
+    Returns:
+        The shared catalog
+    """
+    key = (locale or os.environ.get("PICKUP_LOCALE", DEFAULT_LOCALE), timezone)
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        # Compiling twice in a race is harmless, both results are equal
+        catalog = _catalogs.setdefault(key, MessageCatalog(*key))
+    return catalog
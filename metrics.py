@@ -0,0 +1,531 @@
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# Histogram buckets in seconds; the wait for a volunteer can take up to an hour
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0)
+
+# Histogram buckets in seconds for Streamlit script runs, which should take milliseconds
+UI_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# How often the text file export is rewritten, in seconds
+TEXTFILE_INTERVAL = 15
+
+# Stages of the pickup workflow reported by trace_stage
+STAGE_DIRECT_DM = "direct_dm"
+STAGE_GROUP_POST = "group_post"
+STAGE_WAIT = "wait"
+# From the /start click to the bot seeing it; Telegram dates messages in whole seconds
+STAGE_CLAIM_DETECTION = "claim_detection"
+STAGE_DELETE_ORIGINAL = "delete_original"
+STAGE_PRIVATE_DM = "private_dm"
+STAGE_GROUP_CONFIRMATION = "group_confirmation"
+STAGE_GROUP_DENIAL = "group_denial"
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    """Render a Prometheus label set such as {method="sendMessage"}."""
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonically increasing count, split by label values."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        """
+        Increase the counter.
+
+        Args:
+            label_values: One value per label name, in order
+            amount: Amount to add
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, values)} {count:g}")
+        return lines
+
+
+class Gauge:
+    """Value that can go up and down, split by label values."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        """
+        Set the gauge.
+
+        Args:
+            value: New value
+            label_values: One value per label name, in order
+        """
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_state(self, state: str, *label_values: str) -> None:
+        """
+        Mark one state as current, with the state as the last label.
+
+        Every other state seen for the same leading labels drops to 0, which
+        is how Prometheus represents enumerations.
+
+        Args:
+            state: The current state
+            label_values: Values of all labels but the state, in order
+        """
+        with self._lock:
+            for values in self._values:
+                if values[:-1] == label_values:
+                    self._values[values] = 0.0
+            self._values[label_values + (state,)] = 1.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, values)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, split by label values."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """
+        Record one observation.
+
+        Args:
+            value: Observed value, e.g. a duration in seconds
+            label_values: One value per label name, in order
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = ([0] * (len(self.buckets) + 1), [0.0])
+                self._series[label_values] = series
+            series[0][index] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.label_names, values, f'le="{bound:g}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                cumulative += counts[-1]
+                labels = _format_labels(self.label_names, values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, values)} {total[0]:g}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, values)} {cumulative}")
+        return lines
+
+
+class _StageTimer:
+    """Context manager timing one workflow stage."""
+
+    __slots__ = ("registry", "stage", "request_id", "started")
+
+    def __init__(self, registry: "MetricsRegistry", stage: str, request_id: str):
+        self.registry = registry
+        self.stage = stage
+        self.request_id = request_id
+
+    def __enter__(self) -> "_StageTimer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.registry.observe_stage(self.stage, time.perf_counter() - self.started, self.request_id)
+
+
+class _NullTimer:
+    """Stand-in for _StageTimer when metrics are disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = True):
+        """
+        Initialize the registry with the metrics of the bot.
+
+        Args:
+            enabled: False turns every recording call into a no-op
+        """
+        self.enabled = enabled
+        self.api_calls = Counter("telegram_api_calls_total", "Bot API calls by method and outcome.",
+                                 ("method", "outcome"))
+        self.api_latency = Histogram("telegram_api_call_seconds", "Duration of Bot API calls.", ("method",))
+        self.stage_latency = Histogram("pickup_stage_seconds", "Duration of each pickup workflow stage.", ("stage",))
+        self.workflows = Histogram("pickup_workflow_seconds",
+                                   "Duration of complete pickup workflows, from the donor's submission.", ("outcome",))
+        self.claim_to_dm = Histogram("pickup_claim_to_dm_seconds",
+                                     "Time from a volunteer's /start to the DM with the contact number.")
+        self.api_retries = Counter("telegram_api_retries_total", "Bot API calls sent again after a transient failure.",
+                                   ("method", "reason"))
+        self.api_failures = Counter("telegram_api_failures_total",
+                                    "Bot API calls given up, by whether the failure was fatal or retries ran out.",
+                                    ("method", "kind"))
+        self.circuit_state = Gauge("telegram_circuit_state", "Current state of the Bot API circuit breaker.",
+                                   ("circuit", "state"))
+        self.circuit_transitions = Counter("telegram_circuit_transitions_total",
+                                           "State changes of the Bot API circuit breaker.", ("circuit", "state"))
+        self.circuit_rejections = Counter("telegram_circuit_rejections_total",
+                                          "Bot API calls rejected while the circuit was open.", ("circuit", "method"))
+        self.ui_reruns = Histogram("pickup_ui_rerun_seconds", "Wall time of Streamlit script runs by page and phase.",
+                                   ("page", "phase"), UI_BUCKETS)
+        self.ui_over_budget = Counter("pickup_ui_reruns_over_budget_total",
+                                      "Streamlit script runs slower than the latency budget.", ("page",))
+        self.request_records = Gauge("pickup_request_records", "Request records held in memory by kind.", ("kind",))
+        self.request_record_bytes = Gauge("pickup_request_record_bytes",
+                                          "Memory held by request records by kind, counting shared strings per record.",
+                                          ("kind",))
+        self.http_requests = Gauge("telegram_http_requests", "HTTP requests sent over the pooled Bot API connections.")
+        self.http_connections = Gauge("telegram_http_connections", "Connections opened to the Bot API host.")
+        self.connection_reuse = Gauge("telegram_connection_reuse_ratio",
+                                      "Share of Bot API requests sent over an already open connection.")
+        # Callbacks receiving (stage, request ID, seconds), e.g. for structured logs or a tracer
+        self.stage_listeners: List[Callable[[str, str, float], None]] = []
+        # Callbacks run before each render, to set gauges that are cheaper to read than to keep current
+        self.collectors: List[Callable[["MetricsRegistry"], None]] = []
+
+    def observe_api_call(self, method: str, seconds: float, outcome: str) -> None:
+        """
+        Record one Bot API call.
+
+        Args:
+            method: Bot API method name
+            seconds: Duration of the HTTP round trip
+            outcome: "ok", "error", "rate_limited" or "exception"
+        """
+        if not self.enabled:
+            return
+        self.api_calls.inc(method, outcome)
+        self.api_latency.observe(seconds, method)
+
+    def observe_retry(self, method: str, reason: str) -> None:
+        """
+        Record a Bot API call that is sent again.
+
+        Args:
+            method: Bot API method name
+            reason: One of the REASON_* constants of resilience
+        """
+        if not self.enabled:
+            return
+        self.api_retries.inc(method, reason)
+
+    def observe_failure(self, method: str, kind: str) -> None:
+        """
+        Record a Bot API call that was given up.
+
+        Args:
+            method: Bot API method name
+            kind: "fatal" if it could not be retried, "exhausted" if it ran out of attempts
+        """
+        if not self.enabled:
+            return
+        self.api_failures.inc(method, kind)
+
+    def observe_circuit(self, circuit: str, state: str, changed: bool = True) -> None:
+        """
+        Record the state of a circuit breaker.
+
+        Args:
+            circuit: Name of the circuit
+            state: One of the CIRCUIT_* constants of resilience
+            changed: False for the initial state, which is not counted as a transition
+        """
+        if not self.enabled:
+            return
+        self.circuit_state.set_state(state, circuit)
+        if changed:
+            self.circuit_transitions.inc(circuit, state)
+
+    def observe_circuit_rejection(self, circuit: str, method: str) -> None:
+        """
+        Record a call rejected by an open circuit.
+
+        Args:
+            circuit: Name of the circuit
+            method: Bot API method name
+        """
+        if not self.enabled:
+            return
+        self.circuit_rejections.inc(circuit, method)
+
+    def observe_stage(self, stage: str, seconds: float, request_id: str = "") -> None:
+        """
+        Record the duration of a workflow stage and pass it to the stage listeners.
+
+        Args:
+            stage: One of the STAGE_* constants
+            seconds: Duration of the stage
+            request_id: The unique ID of the pickup request
+        """
+        if not self.enabled:
+            return
+        self.stage_latency.observe(seconds, stage)
+        for listener in self.stage_listeners:
+            try:
+                listener(stage, request_id, seconds)
+            except Exception as e:
+                print(f"Stage listener failed: {e}")
+
+    def trace_stage(self, stage: str, request_id: str = "") -> Any:
+        """
+        Time a workflow stage.
+
+        Args:
+            stage: One of the STAGE_* constants
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            Context manager recording the time spent inside it
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage, request_id)
+
+    def observe_workflow(self, seconds: float, outcome: str) -> None:
+        """
+        Record a finished pickup workflow.
+
+        Args:
+            seconds: Time from the start of the workflow, when the donor submitted the request, to its end;
+                for a request resumed after a restart, from the resumption
+            outcome: "fulfilled", "timed_out" or "cancelled"
+        """
+        if not self.enabled:
+            return
+        self.workflows.observe(seconds, outcome)
+
+    def observe_claim_to_dm(self, seconds: float) -> None:
+        """
+        Record how long a volunteer waited for the contact number after claiming a request.
+
+        Args:
+            seconds: Time from the /start message to the sent DM
+        """
+        if not self.enabled:
+            return
+        self.claim_to_dm.observe(seconds)
+
+    def observe_rerun(self, page: str, phase: str, seconds: float, over_budget: bool = False) -> None:
+        """
+        Record one phase of a Streamlit script run.
+
+        Args:
+            page: Page of the form that was rendered
+            phase: Part of the run, e.g. "render" or "total"
+            seconds: Wall time of the phase
+            over_budget: True if the run as a whole exceeded the latency budget
+        """
+        if not self.enabled:
+            return
+        self.ui_reruns.observe(seconds, page, phase)
+        if over_budget:
+            self.ui_over_budget.inc(page)
+
+    def observe_request_records(self, kind: str, count: int, size: int) -> None:
+        """
+        Record how many request records are held in memory and their size.
+
+        Args:
+            kind: "active" or "finished"
+            count: Number of records
+            size: Approximate size of the records in bytes
+        """
+        if not self.enabled:
+            return
+        self.request_records.set(count, kind)
+        self.request_record_bytes.set(size, kind)
+
+    def observe_connections(self, requests: int, connections: int, reuse_ratio: float) -> None:
+        """
+        Record how well the HTTP connections to the Bot API are reused.
+
+        Args:
+            requests: Requests sent so far
+            connections: Connections opened so far
+            reuse_ratio: Share of requests that did not open a connection
+        """
+        if not self.enabled:
+            return
+        self.http_requests.set(requests)
+        self.http_connections.set(connections)
+        self.connection_reuse.set(reuse_ratio)
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            The exposition text
+        """
+        for collect in self.collectors:
+            try:
+                collect(self)
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines: List[str] = []
+        for metric in (self.api_calls, self.api_latency, self.api_retries, self.api_failures, self.circuit_state,
+                       self.circuit_transitions, self.circuit_rejections, self.stage_latency, self.workflows,
+                       self.claim_to_dm, self.ui_reruns, self.ui_over_budget, self.request_records,
+                       self.request_record_bytes, self.http_requests, self.http_connections, self.connection_reuse):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """
+        Write the metrics to a file, e.g. for the node_exporter textfile collector.
+
+        Args:
+            path: Target file, replaced atomically
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry on GET /metrics."""
+
+    server: "MetricsServer"
+
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, registry: MetricsRegistry, host: str = "0.0.0.0", port: int = 9464):
+        """
+        Initialize the metrics endpoint.
+
+        Args:
+            registry: Registry to expose
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+        """
+        super().__init__((host, port), _MetricsHandler)
+        self.registry = registry
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, name="metrics-endpoint")
+        thread.daemon = True
+        thread.start()
+        host, port = self.server_address[:2]
+        print(f"Metrics available on http://{host}:{port}/metrics")
+
+
+def start_textfile_export(registry: MetricsRegistry, path: str, interval: float = TEXTFILE_INTERVAL) -> threading.Thread:
+    """
+    Rewrite the metrics file periodically in a background thread.
+
+    Args:
+        registry: Registry to export
+        path: Target file
+        interval: Seconds between rewrites
+
+    Returns:
+        The export thread
+    """
+    def export_loop() -> None:
+        while True:
+            try:
+                registry.write_textfile(path)
+            except OSError as e:
+                print(f"Failed to write metrics to {path}: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=export_loop, name="metrics-textfile")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> MetricsRegistry:
+    """
+    Get the process-wide metrics registry.
+
+    Recording is switched off with PICKUP_METRICS=0, which reduces every
+    instrumented call to an attribute check.
+
+    Returns:
+        The shared registry
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(enabled=os.environ.get("PICKUP_METRICS", "1") != "0")
+    return _registry
@@ -0,0 +1,346 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from async_bot import get_background_loop
+from update_dispatcher import RequestCancelled
+
+
+# Job statuses, in the order a job normally goes through them
+JOB_QUEUED = "queued"
+JOB_POSTED = "posted"
+JOB_CLAIMED = "claimed"
+JOB_FULFILLED = "fulfilled"
+JOB_TIMED_OUT = "timed_out"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINAL_STATUSES = (JOB_FULFILLED, JOB_TIMED_OUT, JOB_FAILED, JOB_CANCELLED)
+
+DEFAULT_MAX_WORKERS = 64
+
+# Finished jobs are forgotten this long after they ended
+FINISHED_JOB_TTL_SECONDS = 3600
+
+# Submissions repeated with the same idempotency key within this time attach to the first job
+IDEMPOTENCY_TTL_SECONDS = FINISHED_JOB_TTL_SECONDS
+# Upper bound of remembered idempotency keys, the oldest are dropped first
+IDEMPOTENCY_CACHE_SIZE = 4096
+
+# How often jobs are checked for missed heartbeats, in seconds
+REAPER_INTERVAL_SECONDS = 10
+
+# An orphaned job whose request is still unclaimed once this share of its wait
+# has passed is withdrawn, so no volunteer claims a donor who has left
+ORPHAN_CANCEL_FRACTION = 0.5
+
+
+class PickupJob:
+    """Status of one pickup workflow running in the background."""
+
+    __slots__ = ("job_id", "status", "request_id", "error", "created_at", "updated_at",
+                 "cancel_requested", "heartbeat_timeout", "heartbeat_at", "orphaned", "wait_seconds")
+
+    def __init__(self, job_id: str, heartbeat_timeout: Optional[float] = None, wait_seconds: float = 60.0):
+        self.job_id = job_id
+        self.status = JOB_QUEUED
+        self.request_id: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.cancel_requested = False
+        # Jobs with a timeout are marked orphaned while their submitter sends no heartbeats
+        self.heartbeat_timeout = heartbeat_timeout
+        self.heartbeat_at = self.created_at
+        self.orphaned = False
+        # How long the workflow waits for a volunteer, from the submission on
+        self.wait_seconds = wait_seconds
+
+    @property
+    def done(self) -> bool:
+        """Whether the workflow has finished."""
+        return self.status in FINAL_STATUSES
+
+    @property
+    def success(self) -> bool:
+        """Whether a volunteer picked up the request."""
+        return self.status == JOB_FULFILLED
+
+
+class PickupJobExecutor:
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        """
+        Initialize the executor.
+
+        Args:
+            max_workers: Maximum number of workflows running at the same time
+        """
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pickup-workflow")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, PickupJob] = {}
+        # Idempotency key -> (job ID, expiry time), oldest first
+        self._keys: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # Bot of every unfinished job
+        self._running: Dict[str, Any] = {}
+        self._reaper: Optional[threading.Thread] = None
+
+    def submit(self, bot: Any, idempotency_key: Optional[str] = None, heartbeat_timeout: Optional[float] = None,
+               **workflow_kwargs: Any) -> str:
+        """
+        Start a pickup workflow in the background.
+
+        A submission repeating the idempotency key of an earlier one, e.g.
+        after a rerun of the app, gets the job of the earlier submission
+        back and sends nothing to Telegram.
+
+        Args:
+            bot: TelegramPickupBot or AsyncTelegramPickupBot running the workflow
+            idempotency_key: Key identifying the submission, no deduplication if None
+            heartbeat_timeout: Mark the job orphaned if heartbeat() is not called for this many seconds,
+                e.g. because the donor closed the page; never if None. An orphaned request is
+                only withdrawn if it is still unclaimed after half its wait, as a backgrounded
+                mobile tab stops sending heartbeats as well
+            **workflow_kwargs: Arguments of run_pickup_workflow
+
+        Returns:
+            Job ID to query the status of the workflow
+        """
+        job = PickupJob(uuid.uuid4().hex, heartbeat_timeout, workflow_kwargs.get("wait_minutes", 1) * 60)
+        with self._lock:
+            self._evict_finished()
+            if idempotency_key is not None:
+                existing = self._job_for_key(idempotency_key)
+                if existing is not None:
+                    print(f"Duplicate submission {idempotency_key}, attaching to job {existing}")
+                    return existing
+                self._keys[idempotency_key] = (job.job_id, time.monotonic() + IDEMPOTENCY_TTL_SECONDS)
+                while len(self._keys) > IDEMPOTENCY_CACHE_SIZE:
+                    self._keys.popitem(last=False)
+            self._jobs[job.job_id] = job
+            self._running[job.job_id] = bot
+            if heartbeat_timeout is not None:
+                self._ensure_reaper()
+
+            if asyncio.iscoroutinefunction(bot.run_pickup_workflow):
+                # Async workflows share the background event loop instead of taking a worker thread
+                future = asyncio.run_coroutine_threadsafe(
+                    bot.run_pickup_workflow(on_status=self._status_callback(job, bot), **workflow_kwargs),
+                    get_background_loop()
+                )
+            else:
+                future = None
+                self._pool.submit(self._run, job, bot, workflow_kwargs)
+
+        if future is not None:
+            future.add_done_callback(lambda done: self._finish(job, done))
+        return job.job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Withdraw the request of a job that no volunteer has claimed yet.
+
+        The workflow stops waiting, deletes its group messages and the job
+        ends as cancelled, which frees its worker and its place in the poller.
+
+        Args:
+            job_id: ID returned by submit()
+
+        Returns:
+            True if the job is being cancelled, False if it is unknown, claimed or finished
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done or job.status == JOB_CLAIMED:
+                return False
+            job.cancel_requested = True
+            bot = self._running.get(job_id)
+
+        print(f"Cancelling pickup job {job_id}")
+        if bot is not None and job.request_id is not None:
+            return self._cancel_request(job, bot)
+        # Otherwise the workflow is cancelled once it reports its request ID
+        return True
+
+    @staticmethod
+    def _cancel_request(job: PickupJob, bot: Any) -> bool:
+        """
+        Withdraw the request of a job through the dispatcher of its token.
+
+        The dispatcher refuses once a volunteer's claim has arrived, even if
+        the workflow has not reported it yet. Otherwise the workflow, sync or
+        async, raises RequestCancelled and retracts its messages itself; its
+        task is not cancelled, which would cut that cleanup short.
+        """
+        if not bot.cancel_request(job.request_id):
+            print(f"Request {job.request_id} of pickup job {job.job_id} is already claimed")
+            return False
+        return True
+
+    def heartbeat(self, job_id: str) -> None:
+        """
+        Tell the executor that the submitter of a job is still there.
+
+        Args:
+            job_id: ID returned by submit()
+        """
+        job = self.get(job_id)
+        if job is not None:
+            job.heartbeat_at = time.time()
+            if job.orphaned:
+                print(f"Submitter of pickup job {job_id} is back")
+                job.orphaned = False
+
+    def get(self, job_id: str) -> Optional[PickupJob]:
+        """
+        Look up a job.
+
+        Args:
+            job_id: ID returned by submit()
+
+        Returns:
+            The job if it is known, None otherwise
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, idempotency_key: str) -> Optional[str]:
+        """
+        Look up the job started by a submission.
+
+        Args:
+            idempotency_key: Key passed to submit()
+
+        Returns:
+            The job ID if the key is known and has not expired, None otherwise
+        """
+        with self._lock:
+            return self._job_for_key(idempotency_key)
+
+    def _job_for_key(self, idempotency_key: str) -> Optional[str]:
+        """Return the live job of an idempotency key. Must be called with the lock held."""
+        entry = self._keys.get(idempotency_key)
+        if entry is None:
+            return None
+        job_id, expires_at = entry
+        if expires_at < time.monotonic() or job_id not in self._jobs:
+            del self._keys[idempotency_key]
+            return None
+        return job_id
+
+    def _run(self, job: PickupJob, bot: Any, workflow_kwargs: Dict[str, Any]) -> None:
+        """Run the workflow and keep the job status up to date."""
+        future: "Future[bool]" = Future()
+        if job.cancel_requested:
+            # Cancelled while waiting for a free worker, nothing was sent yet
+            future.cancel()
+        else:
+            try:
+                future.set_result(bot.run_pickup_workflow(on_status=self._status_callback(job, bot), **workflow_kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        self._finish(job, future)
+
+    def _status_callback(self, job: PickupJob, bot: Any) -> Callable[[str, str], None]:
+        """Build the on_status callback of a workflow updating the given job."""
+        def on_status(request_id: str, status: str) -> None:
+            first_report = job.request_id is None
+            job.request_id = request_id
+            self._set_status(job, status)
+            if first_report and job.cancel_requested:
+                # cancel() came before the request ID was known
+                self._cancel_request(job, bot)
+        return on_status
+
+    def _finish(self, job: PickupJob, future: "Future[bool]") -> None:
+        """Record the outcome of a finished workflow."""
+        with self._lock:
+            self._running.pop(job.job_id, None)
+        try:
+            picked_up = future.result()
+            self._set_status(job, JOB_FULFILLED if picked_up else JOB_TIMED_OUT)
+        except (CancelledError, RequestCancelled):
+            self._set_status(job, JOB_CANCELLED)
+        except Exception as e:
+            print(f"Pickup job {job.job_id} failed: {e}")
+            job.error = str(e)
+            self._set_status(job, JOB_FAILED)
+
+    @staticmethod
+    def _set_status(job: PickupJob, status: str) -> None:
+        """Update the status of a job."""
+        job.status = status
+        job.updated_at = time.time()
+
+    def _evict_finished(self) -> None:
+        """Forget jobs that finished a while ago. Must be called with the lock held."""
+        cutoff = time.time() - FINISHED_JOB_TTL_SECONDS
+        expired = [job_id for job_id, job in self._jobs.items() if job.done and job.updated_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+        # Keys expire in insertion order, as they all live equally long
+        now = time.monotonic()
+        while self._keys:
+            key, (_, expires_at) = next(iter(self._keys.items()))
+            if expires_at >= now:
+                break
+            del self._keys[key]
+
+    def _ensure_reaper(self) -> None:
+        """Start the thread marking abandoned jobs if it is not running. Must be called with the lock held."""
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_loop, name="pickup-job-reaper")
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap_loop(self) -> None:
+        """
+        Mark unfinished jobs whose submitter stopped sending heartbeats as orphaned.
+
+        Orphaned jobs keep running at first: a phone puts a backgrounded tab to
+        sleep, and the donor still expects the volunteer's call once it wakes
+        up again. Only a request that is still unclaimed once more than
+        ORPHAN_CANCEL_FRACTION of its wait has passed is withdrawn.
+        """
+        while True:
+            time.sleep(REAPER_INTERVAL_SECONDS)
+            now = time.time()
+            with self._lock:
+                abandoned = [job for job in self._jobs.values()
+                             if job.heartbeat_timeout is not None and not job.done and not job.orphaned
+                             and now - job.heartbeat_at > job.heartbeat_timeout]
+                for job in abandoned:
+                    job.orphaned = True
+                stale = [job for job in self._jobs.values()
+                         if job.orphaned and job.status == JOB_POSTED and not job.cancel_requested
+                         and now - job.created_at > job.wait_seconds * ORPHAN_CANCEL_FRACTION]
+            for job in abandoned:
+                print(f"No heartbeat for pickup job {job.job_id}, marked as orphaned")
+            for job in stale:
+                print(f"Pickup job {job.job_id} is orphaned and still unclaimed, withdrawing its request")
+                self.cancel(job.job_id)
+
+
+_executor: Optional[PickupJobExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> PickupJobExecutor:
+    """
+    Get the process-wide job executor, creating it on first use.
+
+    The number of concurrent workflows can be set with the PICKUP_MAX_WORKERS
+    environment variable.
+
+    Returns:
+        The shared executor
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = PickupJobExecutor(int(os.environ.get("PICKUP_MAX_WORKERS", DEFAULT_MAX_WORKERS)))
+        return _executor
@@ -0,0 +1,505 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from resilience import CircuitBreaker, CircuitOpenError
+from telegram_transport import TelegramTransport
+
+
+# Priorities of outbound calls, lower values are sent first
+PRIORITY_URGENT = 0        # DM with the contact number, new group posts
+PRIORITY_NORMAL = 1        # Group confirmations, message edits
+PRIORITY_HOUSEKEEPING = 2  # Deletions, denial notices
+
+# Telegram allows about 30 messages per second overall, 20 per minute in a
+# group and about one per second in a private chat
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+GROUP_RATE = 20 / 60
+GROUP_BURST = 5
+PRIVATE_RATE = 1.0
+PRIVATE_BURST = 2
+
+# Per-chat limits apply to posting; deletions only count against the global limit
+CHAT_LIMITED_PREFIXES = ("send", "edit")
+
+# How often a call is put back into the queue after a 429 before giving up
+MAX_RATE_LIMIT_RETRIES = 5
+
+DEFAULT_SEND_WORKERS = 4
+
+# While the API is unreachable, a call still queued this long after it was
+# submitted fails with CircuitOpenError instead of waiting for the circuit to close
+QUEUED_CALL_TIMEOUT_SECONDS = 60.0
+
+# Per-chat buckets that refilled completely are dropped this often; a full
+# bucket behaves like a new one, so only memory is saved
+BUCKET_SWEEP_SECONDS = 60.0
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at a fixed rate."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        # Set from retry_after when Telegram rejects a call with 429
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """
+        Return how long a caller has to wait for the next token.
+
+        Args:
+            now: Current monotonic time
+
+        Returns:
+            Seconds until a token is available, 0 if one is available now
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_idle(self, now: float) -> bool:
+        """
+        Return True if the bucket is full again and not blocked, so a new bucket would behave the same.
+
+        Args:
+            now: Current monotonic time
+        """
+        refilled = self.tokens + (now - self.updated_at) * self.rate >= self.capacity
+        return refilled and now >= self.blocked_until
+
+    def consume(self) -> None:
+        """Take one token. Only call after delay() returned 0."""
+        self.tokens -= 1
+
+    def block(self, seconds: float, now: float) -> None:
+        """
+        Stop handing out tokens for a while.
+
+        Args:
+            seconds: Duration of the block, e.g. retry_after of a 429 response
+            now: Current monotonic time
+        """
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+
+class _OutboundCall:
+    """A Bot API call waiting in the outbound queue."""
+
+    __slots__ = ("method", "params", "chat_id", "future", "retries", "send", "loop", "deadline")
+
+    def __init__(self, method: str, params: Dict[str, Any], chat_id: Optional[Union[str, int]],
+                 send: Optional[Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.method = method
+        self.params = params
+        self.chat_id = chat_id
+        self.future: "Future[Dict[str, Any]]" = Future()
+        self.retries = 0
+        self.deadline = time.monotonic() + QUEUED_CALL_TIMEOUT_SECONDS
+        # Calls of async bots are sent as a coroutine on their loop instead of on a send worker
+        self.send = send
+        self.loop = loop
+
+
+def is_group_chat(chat_id: Union[str, int]) -> bool:
+    """Return True for group and channel chat IDs, which are negative."""
+    return str(chat_id).startswith("-")
+
+
+class OutboundQueue:
+    def __init__(self, send: Callable[[str, Dict[str, Any]], Dict[str, Any]],
+                 workers: int = DEFAULT_SEND_WORKERS, breaker: Optional[CircuitBreaker] = None):
+        """
+        Initialize the queue.
+
+        Args:
+            send: Function performing one Bot API call for a method and its parameters
+            workers: Number of calls that may be in flight at the same time
+            breaker: Circuit breaker of the transport behind send; calls stay queued while it is open
+        """
+        self._send = send
+        self._breaker = breaker
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="telegram-send")
+        self._condition = threading.Condition()
+        # Per rate-limited chat, and "" for calls without a chat limit: heap of (priority, sequence, call)
+        self._lanes: Dict[str, List[tuple]] = {}
+        # (priority, sequence, lane) of lane heads that may be sendable; entries whose call is
+        # no longer the head of its lane are skipped
+        self._ready: List[tuple] = []
+        # (monotonic time, lane) of lanes waiting for the rate limit of their chat
+        self._blocked: List[tuple] = []
+        self._pending = 0
+        self._sequence = itertools.count()
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._swept_at = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, method: str, params: Dict[str, Any], priority: int = PRIORITY_NORMAL) -> "Future[Dict[str, Any]]":
+        """
+        Queue a Bot API call.
+
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            params: Parameters of the call, "chat_id" selects the per-chat limit
+            priority: One of the PRIORITY_* constants
+
+        Returns:
+            Future resolved with the JSON response of the API
+        """
+        call = _OutboundCall(method, params, params.get("chat_id"))
+        self._push(priority, next(self._sequence), call)
+        return call.future
+
+    def submit_many(self, method: str, params_list: List[Dict[str, Any]], priority: int = PRIORITY_NORMAL,
+                    on_done: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> "List[Future[Dict[str, Any]]]":
+        """
+        Queue several Bot API calls at once.
+
+        Args:
+            method: Bot API method name, e.g. "deleteMessage"
+            params_list: Parameters of each call
+            priority: One of the PRIORITY_* constants
+            on_done: Receives the JSON responses in the order of params_list once the last call
+                finished, on a send worker; a call that raised is reported as a failed response
+
+        Returns:
+            Futures resolved with the JSON responses, in the order of params_list
+        """
+        futures = [self.submit(method, params, priority) for params in params_list]
+        if on_done is None:
+            return futures
+        if not futures:
+            on_done([])
+            return futures
+
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def finished(_: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append({"ok": False, "description": str(e)})
+            on_done(results)
+
+        for future in futures:
+            future.add_done_callback(finished)
+        return futures
+
+    def call(self, method: str, params: Dict[str, Any], priority: int = PRIORITY_NORMAL) -> Dict[str, Any]:
+        """
+        Queue a Bot API call and wait for its response.
+
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            params: Parameters of the call
+            priority: One of the PRIORITY_* constants
+
+        Returns:
+            JSON response of the API
+
+        Raises:
+            CircuitOpenError: If the API stayed unreachable for QUEUED_CALL_TIMEOUT_SECONDS
+        """
+        return self.submit(method, params, priority).result()
+
+    async def call_async(self, method: str, params: Dict[str, Any], priority: int,
+                         send: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Queue a Bot API call of an async bot and wait for its response.
+
+        The call waits for the rate limits like any other, but is then sent by
+        awaiting send on the running loop, so it takes no send worker.
+
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            params: Parameters of the call
+            priority: One of the PRIORITY_* constants
+            send: Coroutine function performing one Bot API call for a method and its parameters
+
+        Returns:
+            JSON response of the API
+        """
+        call = _OutboundCall(method, params, params.get("chat_id"), send, asyncio.get_running_loop())
+        self._push(priority, next(self._sequence), call)
+        return await asyncio.wrap_future(call.future)
+
+    def pending(self) -> int:
+        """Return the number of calls waiting to be sent."""
+        with self._condition:
+            return self._pending
+
+    @staticmethod
+    def _lane(call: _OutboundCall) -> str:
+        """Return the lane of a call: its chat if the chat's rate limit applies, "" otherwise."""
+        if call.chat_id is None or not call.method.startswith(CHAT_LIMITED_PREFIXES):
+            return ""
+        return str(call.chat_id)
+
+    def _push(self, priority: int, sequence: int, call: _OutboundCall) -> None:
+        """Put a call into the queue and wake the scheduler."""
+        key = self._lane(call)
+        with self._condition:
+            lane = self._lanes.setdefault(key, [])
+            if not lane or (priority, sequence) < lane[0][:2]:
+                # The call becomes the head of its lane
+                heapq.heappush(self._ready, (priority, sequence, key))
+            heapq.heappush(lane, (priority, sequence, call))
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="telegram-outbound-queue")
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def _chat_bucket(self, chat_id: Optional[Union[str, int]]) -> Optional[TokenBucket]:
+        """Return the bucket limiting a chat, creating it on first use. Must be called with the lock held."""
+        if chat_id is None:
+            return None
+        key = str(chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            if is_group_chat(key):
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST)
+            self._chat_buckets[key] = bucket
+        return bucket
+
+    def _sweep_buckets(self, now: float) -> None:
+        """Drop the buckets of chats that have gone quiet. Must be called with the lock held."""
+        if now - self._swept_at < BUCKET_SWEEP_SECONDS:
+            return
+        self._swept_at = now
+        for key in [key for key, bucket in self._chat_buckets.items() if bucket.is_idle(now)]:
+            del self._chat_buckets[key]
+
+    def chat_buckets(self) -> int:
+        """Return the number of chats with a rate limit bucket."""
+        with self._condition:
+            return len(self._chat_buckets)
+
+    def _next_call(self) -> tuple:
+        """Wait for the most urgent call that the rate limits allow to be sent now."""
+        with self._condition:
+            while True:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+
+                # While the API is down the calls wait here instead of failing
+                circuit_delay = self._breaker.retry_in() if self._breaker is not None else 0.0
+                if circuit_delay > 0:
+                    # ...but only until their deadline, so a long outage cannot hang the workflows
+                    next_deadline = self._fail_expired(time.monotonic(), circuit_delay)
+                    self._condition.wait(min(circuit_delay, next_deadline))
+                    continue
+
+                now = time.monotonic()
+                self._sweep_buckets(now)
+                global_delay = self._global_bucket.delay(now)
+                if global_delay > 0:
+                    self._condition.wait(global_delay)
+                    continue
+
+                while self._blocked and self._blocked[0][0] <= now:
+                    _, key = heapq.heappop(self._blocked)
+                    lane = self._lanes.get(key)
+                    if lane:
+                        heapq.heappush(self._ready, (lane[0][0], lane[0][1], key))
+
+                entry = self._pop_ready(now)
+                if entry is not None:
+                    self._global_bucket.consume()
+                    return entry
+                self._condition.wait(self._blocked[0][0] - now if self._blocked else None)
+
+    def _pop_ready(self, now: float) -> Optional[tuple]:
+        """
+        Take the most urgent call of a lane whose chat may be sent to now. Must be called with the lock held.
+
+        A rate-limited chat must not hold back calls to other chats, so its
+        lane is parked until its bucket refills instead of being scanned again.
+        """
+        while self._ready:
+            priority, sequence, key = heapq.heappop(self._ready)
+            lane = self._lanes.get(key)
+            if not lane or lane[0][:2] != (priority, sequence):
+                continue
+            if lane[0][2].future.done():
+                # Failed while the circuit was open, or its awaiting task went away
+                self._take(key, lane)
+                continue
+            bucket = self._chat_bucket(key) if key else None
+            delay = bucket.delay(now) if bucket is not None else 0.0
+            if delay > 0:
+                heapq.heappush(self._blocked, (now + delay, key))
+                continue
+
+            entry = self._take(key, lane)
+            if bucket is not None:
+                bucket.consume()
+            return entry
+        return None
+
+    def _take(self, key: str, lane: List[tuple]) -> tuple:
+        """Remove the head of a lane from the queue. Must be called with the lock held."""
+        entry = heapq.heappop(lane)
+        if lane:
+            heapq.heappush(self._ready, (lane[0][0], lane[0][1], key))
+        else:
+            del self._lanes[key]
+        self._pending -= 1
+        return entry
+
+    def _fail_expired(self, now: float, retry_in: float) -> float:
+        """
+        Fail and drop the queued calls whose deadline passed while the circuit is open.
+
+        Must be called with the lock held.
+
+        Args:
+            now: Current monotonic time
+            retry_in: Seconds until the circuit lets a call through
+
+        Returns:
+            Seconds until the next queued call expires, infinity if there is none
+        """
+        name = getattr(self._breaker, "name", "telegram")
+        next_deadline = float("inf")
+        for key, lane in list(self._lanes.items()):
+            head = lane[0][:2]
+            kept = []
+            for entry in lane:
+                call = entry[2]
+                if not call.future.done() and call.deadline <= now:
+                    print(f"Giving up on queued {call.method} to chat {call.chat_id}, the API is unreachable")
+                    call.future.set_exception(CircuitOpenError(name, retry_in))
+                if call.future.done():
+                    continue
+                kept.append(entry)
+                next_deadline = min(next_deadline, call.deadline - now)
+            if len(kept) == len(lane):
+                continue
+            self._pending -= len(lane) - len(kept)
+            if not kept:
+                del self._lanes[key]
+                continue
+            heapq.heapify(kept)
+            self._lanes[key] = kept
+            if kept[0][:2] != head:
+                # The ready entry of the old head is stale now
+                heapq.heappush(self._ready, (kept[0][0], kept[0][1], key))
+        return next_deadline
+
+    def _run(self) -> None:
+        """Hand calls to the send workers as the rate limits allow."""
+        while True:
+            priority, sequence, call = self._next_call()
+            if call.future.done():
+                # The awaiting task of an async bot went away, or the call expired in the queue
+                continue
+            if call.loop is not None:
+                sent = asyncio.run_coroutine_threadsafe(call.send(call.method, call.params), call.loop)
+                sent.add_done_callback(functools.partial(self._sent, priority, sequence, call))
+            else:
+                self._pool.submit(self._execute, priority, sequence, call)
+
+    def _execute(self, priority: int, sequence: int, call: _OutboundCall) -> None:
+        """Send one call on a send worker."""
+        try:
+            result = self._send(call.method, call.params)
+        except Exception as e:
+            self._finish(priority, sequence, call, error=e)
+        else:
+            self._finish(priority, sequence, call, result=result)
+
+    def _sent(self, priority: int, sequence: int, call: _OutboundCall, sent: "Future[Dict[str, Any]]") -> None:
+        """Finish a call that was sent on the loop of its async bot."""
+        if sent.cancelled():
+            call.future.cancel()
+        elif sent.exception() is not None:
+            self._finish(priority, sequence, call, error=sent.exception())
+        else:
+            self._finish(priority, sequence, call, result=sent.result())
+
+    def _finish(self, priority: int, sequence: int, call: _OutboundCall, result: Optional[Dict[str, Any]] = None,
+                error: Optional[BaseException] = None) -> None:
+        """Resolve a sent call, or requeue it if Telegram asks to retry later."""
+        if isinstance(error, CircuitOpenError) and time.monotonic() < call.deadline:
+            # The circuit opened after the call was taken from the queue, so it waits for it to close
+            self._push(priority, sequence, call)
+            return
+        if call.future.cancelled():
+            return
+        if error is not None:
+            call.future.set_exception(error)
+            return
+
+        if result.get("error_code") == 429 and call.retries < MAX_RATE_LIMIT_RETRIES:
+            retry_after = result.get("parameters", {}).get("retry_after", 1)
+            print(f"Rate limited on {call.method} to chat {call.chat_id}, retrying in {retry_after} seconds")
+            with self._condition:
+                bucket = None
+                if call.method.startswith(CHAT_LIMITED_PREFIXES):
+                    bucket = self._chat_bucket(call.chat_id)
+                (bucket or self._global_bucket).block(retry_after, time.monotonic())
+            call.retries += 1
+            # The original sequence number keeps the call ahead of newer ones
+            self._push(priority, sequence, call)
+            return
+
+        call.future.set_result(result)
+
+
+_queues: Dict[Tuple[str, TelegramTransport], OutboundQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_outbound_queue(token: str, transport: TelegramTransport) -> OutboundQueue:
+    """
+    Get the process-wide outbound queue for a bot token and transport, creating it on first use.
+
+    Telegram's limits apply per bot, so all bot instances sharing a token must
+    share a queue. The queue sends through the transport it was created for,
+    so bots on another transport, e.g. one pointed at a test server, get
+    their own queue instead of sending through the first caller's.
+
+    Args:
+        token: Telegram bot API token
+        transport: Transport the calls of the queue are sent through; its circuit breaker holds them back
+
+    Returns:
+        The queue of this token and transport
+    """
+    key = (token, transport)
+    with _queues_lock:
+        queue = _queues.get(key)
+        if queue is None:
+            queue = OutboundQueue(functools.partial(transport.call, token), breaker=transport.breaker)
+            _queues[key] = queue
+        return queue
@@ -0,0 +1,329 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from metrics import get_registry
+from request_store import STATE_CLAIMED, STATE_POSTED
+from volunteer_registry import ANY_SLOT, TIME_SLOTS
+
+
+# Finished requests kept in memory, the least recently used go first
+DEFAULT_MAX_FINISHED = 500
+
+# Finished requests are dropped this many seconds after they were last looked at
+DEFAULT_FINISHED_TTL = 6 * 3600
+
+# Labels every request repeats; they are shared instead of copied per request
+_LABELS = {label: label for label in TIME_SLOTS + (ANY_SLOT, "Today", "Not specified", "")}
+
+
+def intern_label(value: str) -> str:
+    """
+    Return the one shared copy of a repeated field such as a time slot or a location.
+
+    Args:
+        value: Field of a request, e.g. "14:00 - 16:00"
+
+    Returns:
+        A string equal to value that other requests share
+    """
+    label = _LABELS.get(value)
+    if label is not None:
+        return label
+    return sys.intern(value)
+
+
+class VolunteerRecord:
+    """The volunteer who claimed a request."""
+
+    __slots__ = ("user_id", "first_name", "username", "message_id", "claimed_at", "detected_at")
+
+    def __init__(self, user_id: int, first_name: str, username: str = "", message_id: Optional[int] = None,
+                 claimed_at: Optional[float] = None, detected_at: Optional[float] = None):
+        """
+        Initialize the record.
+
+        Args:
+            user_id: Telegram ID of the volunteer
+            first_name: First name of the volunteer
+            username: Username of the volunteer
+            message_id: ID of the volunteer's /start message
+            claimed_at: Unix time of the /start click
+            detected_at: Unix time the bot saw the click
+        """
+        self.user_id = user_id
+        self.first_name = intern_label(first_name)
+        self.username = intern_label(username)
+        self.message_id = message_id
+        self.claimed_at = claimed_at
+        self.detected_at = detected_at
+
+    @classmethod
+    def from_user_info(cls, user_info: Dict[str, Any]) -> "VolunteerRecord":
+        """
+        Build the record from the user info of a claim.
+
+        Args:
+            user_info: Dictionary containing user information, as parsed from a /start update
+
+        Returns:
+            The record
+        """
+        return cls(user_info["id"], user_info.get("first_name", "User"), user_info.get("username", ""),
+                   user_info.get("message_id"), user_info.get("claimed_at"), user_info.get("detected_at"))
+
+    def as_user_info(self, request_id: str) -> Dict[str, Any]:
+        """
+        Return the user info dictionary the store and the message templates expect.
+
+        Args:
+            request_id: The unique ID of the claimed request
+
+        Returns:
+            Dictionary containing user information
+        """
+        user_info = {"id": self.user_id, "first_name": self.first_name, "username": self.username,
+                     "message_id": self.message_id, "request_id": request_id}
+        if self.claimed_at is not None:
+            user_info["claimed_at"] = self.claimed_at
+        if self.detected_at is not None:
+            user_info["detected_at"] = self.detected_at
+        return user_info
+
+
+class RequestRecord:
+    """A pickup request the bot is working on or has recently finished."""
+
+    __slots__ = ("request_id", "message_id", "announcements", "location", "date", "remarks", "pick_up_time",
+                 "created_at", "state", "volunteer", "finished_at")
+
+    def __init__(self, request_id: str, message_id: Optional[int], announcements: Dict[str, int], location: str,
+                 date: str, remarks: str, pick_up_time: str, created_at: Optional[float] = None):
+        """
+        Initialize the record of a request that was just posted.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            message_id: ID of the announcement in the primary group, None if it was not posted
+            announcements: Message ID of the announcement by group chat ID
+            location: Pickup location
+            date: Date of the pickup
+            remarks: Additional remarks of the donor
+            pick_up_time: Time slot of the pickup
+            created_at: Unix time the request was created, now if None
+        """
+        self.request_id = request_id
+        self.message_id = message_id
+        self.announcements = announcements
+        self.location = intern_label(location)
+        self.date = intern_label(date)
+        self.remarks = intern_label(remarks)
+        self.pick_up_time = intern_label(pick_up_time)
+        self.created_at = time.time() if created_at is None else created_at
+        self.state = STATE_POSTED
+        self.volunteer: Optional[VolunteerRecord] = None
+        self.finished_at: Optional[float] = None
+
+    def claim(self, volunteer: VolunteerRecord) -> None:
+        """
+        Record the volunteer who claimed the request.
+
+        Args:
+            volunteer: The volunteer
+        """
+        self.volunteer = volunteer
+        self.state = STATE_CLAIMED
+
+    def finish(self, state: str) -> None:
+        """
+        Close the request.
+
+        Args:
+            state: "fulfilled", "timed_out" or "cancelled"
+        """
+        self.state = state
+        self.finished_at = time.time()
+
+
+def resumed_request(request: Dict[str, Any],
+                    now: float) -> Tuple[RequestRecord, Dict[str, Any], Optional[VolunteerRecord]]:
+    """
+    Rebuild a stored open request for a bot that takes it over.
+
+    Args:
+        request: Open request as returned by RequestStore.take_over_requests
+        now: Unix time the remaining wait is counted from
+
+    Returns:
+        Tuple of (record to track, arguments of _complete_pickup_workflow without the volunteer,
+        volunteer who already claimed the request or None)
+    """
+    announcements = request["announcements"] or {request["chat_id"]: request["message_id"]}
+    record = RequestRecord(request["request_id"], request["message_id"], announcements,
+                           location=request["location"], date=request["date"], remarks=request["remarks"],
+                           pick_up_time=request["pick_up_time"], created_at=request["created_at"])
+    workflow_kwargs = {
+        "request_id": request["request_id"],
+        "location": request["location"],
+        "date": request["date"],
+        "pick_up_time": request["pick_up_time"],
+        "contact_number": request["contact_number"] or "",
+        "remarks": request["remarks"],
+        "wait_minutes": max(request["wait_deadline"] - now, 0) / 60,
+    }
+    # Claimed requests only miss the DM, so no further waiting is needed
+    volunteer = VolunteerRecord.from_user_info(request["volunteer"]) if request["volunteer"] else None
+    return record, workflow_kwargs, volunteer
+
+
+def _object_size(value: Any, seen: Set[int]) -> int:
+    """Return the size of an object and everything it holds that was not counted yet."""
+    if value is None or isinstance(value, bool) or id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += _object_size(key, seen) + _object_size(item, seen)
+    elif hasattr(value, "__slots__"):
+        for name in value.__slots__:
+            size += _object_size(getattr(value, name, None), seen)
+    return size
+
+
+def footprint(records: Iterable[Any]) -> Dict[str, int]:
+    """
+    Estimate the memory held by a set of records.
+
+    Strings shared between records, like interned time slots, are counted
+    once, so the result is what dropping all records would free at most.
+
+    Args:
+        records: Request or volunteer records
+
+    Returns:
+        Dictionary with the number of records, their total size and the size per record in bytes
+    """
+    seen: Set[int] = set()
+    count = 0
+    size = 0
+    for record in records:
+        count += 1
+        size += _object_size(record, seen)
+    return {"records": count, "bytes": size, "bytes_per_record": size // count if count else 0}
+
+
+class FinishedRequests:
+    def __init__(self, max_size: int = DEFAULT_MAX_FINISHED, ttl: float = DEFAULT_FINISHED_TTL):
+        """
+        Initialize the bounded in-memory history of finished requests.
+
+        The history never holds more than max_size records, and records not
+        looked at for ttl seconds are dropped. The durable history is the
+        request store; this one only answers questions about recent requests
+        without a database round trip.
+
+        Args:
+            max_size: Most records kept
+            ttl: Seconds a record is kept after it was added or last looked at
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Request ID -> (monotonic expiry, size in bytes, record), least recently used first
+        self._records: "OrderedDict[str, Tuple[float, int, RequestRecord]]" = OrderedDict()
+        # Sum of the sizes, kept up to date on every add and eviction
+        self._bytes = 0
+
+    def add(self, record: RequestRecord) -> None:
+        """
+        Keep a finished request, evicting the oldest ones beyond the bounds.
+
+        Args:
+            record: The finished request
+        """
+        # Measured once here, so the gauges never need a walk over the whole history
+        size = _object_size(record, set())
+        now = time.monotonic()
+        with self._lock:
+            previous = self._records.pop(record.request_id, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._records[record.request_id] = (now + self.ttl, size, record)
+            self._bytes += size
+            self._evict(now)
+            count, total = len(self._records), self._bytes
+        get_registry().observe_request_records("finished", count, total)
+
+    def get(self, request_id: str) -> Optional[RequestRecord]:
+        """
+        Look up a finished request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            The record, None if it is unknown or was evicted
+        """
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._evict(now)
+            count, total = len(self._records), self._bytes
+            entry = self._records.get(request_id)
+            if entry is not None:
+                self._records[request_id] = (now + self.ttl, entry[1], entry[2])
+                self._records.move_to_end(request_id)
+        if evicted:
+            get_registry().observe_request_records("finished", count, total)
+        return entry[2] if entry is not None else None
+
+    def _evict(self, now: float) -> int:
+        """Drop expired records and those beyond max_size and return how many; the caller holds the lock."""
+        evicted = 0
+        while self._records:
+            expires_at, size, _ = next(iter(self._records.values()))
+            if len(self._records) <= self.max_size and expires_at > now:
+                break
+            self._records.popitem(last=False)
+            self._bytes -= size
+            evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict(time.monotonic())
+            return len(self._records)
+
+    def footprint(self) -> Dict[str, int]:
+        """
+        Estimate the memory held by the history.
+
+        Unlike the gauges, which add up the size of each record on its own,
+        this walks all records and counts strings they share only once.
+
+        Returns:
+            Dictionary with the number of records, their total size and the size per record in bytes
+        """
+        with self._lock:
+            records = [record for _, _, record in self._records.values()]
+        return footprint(records)
+
+
+_finished: Optional[FinishedRequests] = None
+_finished_lock = threading.Lock()
+
+
+def get_finished_requests() -> FinishedRequests:
+    """
+    Get the process-wide history of finished requests shared by all bots.
+
+    Returns:
+        The shared history
+    """
+    global _finished
+    with _finished_lock:
+        if _finished is None:
+            _finished = FinishedRequests()
+        return _finished
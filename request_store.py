@@ -0,0 +1,311 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Any, Union
+
+
+DEFAULT_DB_PATH = "pickup_requests.db"
+
+# Lifecycle states of a pickup request
+STATE_POSTED = "posted"
+STATE_CLAIMED = "claimed"
+STATE_FULFILLED = "fulfilled"
+STATE_TIMED_OUT = "timed_out"
+STATE_CANCELLED = "cancelled"
+OPEN_STATES = (STATE_POSTED, STATE_CLAIMED)
+
+# Finished requests are kept this long for inspection before being purged
+FINISHED_RETENTION_SECONDS = 7 * 24 * 3600
+
+# An open request is leased to the process running its workflow, which renews
+# the lease; replicas sharing the database resume it only once the lease ran out
+REQUEST_LEASE_SECONDS = 60
+LEASE_RENEWAL_SECONDS = REQUEST_LEASE_SECONDS / 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pickup_requests (
+    request_id TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    message_id INTEGER,
+    announcements TEXT,
+    location TEXT NOT NULL,
+    remarks TEXT NOT NULL,
+    date TEXT NOT NULL,
+    pick_up_time TEXT NOT NULL,
+    contact_number TEXT,
+    volunteer TEXT,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    wait_deadline REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_pickup_requests_state ON pickup_requests (state, wait_deadline);
+
+CREATE TABLE IF NOT EXISTS pending_deletions (
+    deletion_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    delete_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pending_deletions_deadline ON pending_deletions (delete_at);
+"""
+
+# Statements are kept as constants so sqlite3's statement cache reuses the
+# compiled form on every call
+_INSERT_REQUEST = """
+INSERT OR REPLACE INTO pickup_requests
+    (request_id, chat_id, message_id, announcements, location, remarks, date, pick_up_time,
+     contact_number, volunteer, state, created_at, wait_deadline, updated_at, owner, lease_until)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, ?, ?, ?)
+"""
+_SELECT_REQUEST = "SELECT * FROM pickup_requests WHERE request_id = ?"
+# Rows written before leases existed have none and are free to take
+_SELECT_UNLEASED_REQUESTS = """
+SELECT * FROM pickup_requests WHERE state IN (?, ?) AND (lease_until IS NULL OR lease_until < ?) ORDER BY wait_deadline
+"""
+_COUNT_LEASED_ELSEWHERE = """
+SELECT COUNT(*) FROM pickup_requests WHERE state IN (?, ?) AND lease_until >= ? AND owner != ?
+"""
+_TAKE_REQUEST_LEASE = "UPDATE pickup_requests SET owner = ?, lease_until = ? WHERE request_id = ?"
+_RENEW_REQUEST_LEASES = "UPDATE pickup_requests SET lease_until = ? WHERE owner = ? AND state IN (?, ?)"
+_UPDATE_CLAIMED = "UPDATE pickup_requests SET state = ?, volunteer = ?, updated_at = ? WHERE request_id = ?"
+# The contact number is only needed while the request is open
+_UPDATE_FINISHED = "UPDATE pickup_requests SET state = ?, contact_number = NULL, updated_at = ? WHERE request_id = ?"
+_PURGE_FINISHED = "DELETE FROM pickup_requests WHERE state NOT IN (?, ?) AND updated_at < ?"
+
+_INSERT_DELETION = "INSERT INTO pending_deletions (chat_id, message_id, delete_at) VALUES (?, ?, ?)"
+_UPDATE_DELETION = "UPDATE pending_deletions SET delete_at = ? WHERE deletion_id = ?"
+_DELETE_DELETION = "DELETE FROM pending_deletions WHERE deletion_id = ?"
+_SELECT_DELETIONS = "SELECT deletion_id, chat_id, message_id, delete_at FROM pending_deletions ORDER BY delete_at"
+
+
+class RequestStore:
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        """
+        Open (and create if needed) the request database.
+
+        Args:
+            path: Path of the SQLite database file
+        """
+        self.path = path
+        # Identifies this process as the lease holder of the requests it runs
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._renewal: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=64)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """Add columns introduced after a database file was created."""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(pickup_requests)")}
+        if "announcements" not in columns:
+            self._conn.execute("ALTER TABLE pickup_requests ADD COLUMN announcements TEXT")
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE pickup_requests ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE pickup_requests ADD COLUMN lease_until REAL")
+
+    def save_request(self, request_id: str, chat_id: Union[str, int], message_id: Optional[int], location: str,
+                     remarks: str, date: str, pick_up_time: str, contact_number: str, wait_deadline: float,
+                     announcements: Optional[Dict[str, int]] = None) -> None:
+        """
+        Persist a freshly posted pickup request, leased to this process.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            chat_id: Chat ID of the group the request was posted to
+            message_id: ID of the group message
+            location: Pickup location
+            remarks: Additional remarks of the donor
+            date: Date of the pickup
+            pick_up_time: Time of the pickup
+            contact_number: Contact number for the pickup
+            wait_deadline: Unix time at which the wait for volunteers ends
+            announcements: Message IDs by chat ID when the request was posted to several groups
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(_INSERT_REQUEST, (
+                request_id, str(chat_id), message_id, json.dumps(announcements) if announcements else None,
+                location, remarks, date, pick_up_time,
+                contact_number, STATE_POSTED, now, wait_deadline, now, self.owner, now + REQUEST_LEASE_SECONDS
+            ))
+            self._ensure_renewal()
+
+    def get_request(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a pickup request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            The stored request if found, None otherwise
+        """
+        with self._lock:
+            row = self._conn.execute(_SELECT_REQUEST, (request_id,)).fetchone()
+        return self._request_from_row(row) if row else None
+
+    def take_over_requests(self) -> List[Dict[str, Any]]:
+        """
+        Lease the open requests no live process is working on to this process.
+
+        Replicas sharing the database renew the leases of the requests they
+        run, so only requests of a process that stopped are returned.
+
+        Returns:
+            The requests taken over, earliest deadline first
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(_SELECT_UNLEASED_REQUESTS, OPEN_STATES + (now,)).fetchall()
+                lease_until = now + REQUEST_LEASE_SECONDS
+                self._conn.executemany(_TAKE_REQUEST_LEASE,
+                                       [(self.owner, lease_until, row["request_id"]) for row in rows])
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            if rows:
+                self._ensure_renewal()
+        return [self._request_from_row(row) for row in rows]
+
+    def leased_elsewhere(self) -> int:
+        """Return the number of open requests another live process holds the lease of."""
+        with self._lock:
+            row = self._conn.execute(_COUNT_LEASED_ELSEWHERE, OPEN_STATES + (time.time(), self.owner)).fetchone()
+        return row[0]
+
+    def renew_leases(self) -> None:
+        """Extend the leases of all open requests of this process."""
+        with self._lock:
+            self._conn.execute(_RENEW_REQUEST_LEASES, (time.time() + REQUEST_LEASE_SECONDS, self.owner) + OPEN_STATES)
+
+    def _ensure_renewal(self) -> None:
+        """Start the thread renewing the request leases if it is not running. Must be called with the lock held."""
+        if self._renewal is None:
+            self._renewal = threading.Thread(target=self._renewal_loop, name="request-lease-renewal")
+            self._renewal.daemon = True
+            self._renewal.start()
+
+    def _renewal_loop(self) -> None:
+        """Renew the request leases until the store is closed."""
+        while not self._closed.wait(LEASE_RENEWAL_SECONDS):
+            try:
+                self.renew_leases()
+            except Exception as e:
+                print(f"Failed to renew request leases: {e}")
+
+    def mark_claimed(self, request_id: str, user_info: Dict[str, Any]) -> None:
+        """
+        Record the volunteer who claimed a request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            user_info: Dictionary containing user information
+        """
+        with self._lock:
+            self._conn.execute(_UPDATE_CLAIMED, (STATE_CLAIMED, json.dumps(user_info), time.time(), request_id))
+
+    def mark_finished(self, request_id: str, state: str) -> None:
+        """
+        Move a request to a final state and forget its contact number.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            state: STATE_FULFILLED, STATE_TIMED_OUT or STATE_CANCELLED
+        """
+        with self._lock:
+            self._conn.execute(_UPDATE_FINISHED, (state, time.time(), request_id))
+
+    def purge_finished(self, older_than_seconds: float = FINISHED_RETENTION_SECONDS) -> int:
+        """
+        Remove finished requests that have not changed for a while.
+
+        Args:
+            older_than_seconds: Minimum age in seconds of the requests to remove
+
+        Returns:
+            Number of removed requests
+        """
+        with self._lock:
+            cursor = self._conn.execute(_PURGE_FINISHED, OPEN_STATES + (time.time() - older_than_seconds,))
+        return cursor.rowcount
+
+    def add_deletion(self, chat_id: Union[str, int], message_id: int, delete_at: float) -> int:
+        """
+        Persist a pending message deletion.
+
+        Args:
+            chat_id: Chat ID where the message was sent
+            message_id: ID of the message to delete
+            delete_at: Unix time at which the message should be deleted
+
+        Returns:
+            ID of the stored deletion
+        """
+        with self._lock:
+            cursor = self._conn.execute(_INSERT_DELETION, (str(chat_id), message_id, delete_at))
+        return cursor.lastrowid
+
+    def update_deletion(self, deletion_id: int, delete_at: float) -> None:
+        """
+        Move a persisted deletion to a new deadline.
+
+        Args:
+            deletion_id: ID returned by add_deletion()
+            delete_at: New Unix time at which the message should be deleted
+        """
+        with self._lock:
+            self._conn.execute(_UPDATE_DELETION, (delete_at, deletion_id))
+
+    def remove_deletions(self, deletion_ids: List[int]) -> None:
+        """
+        Forget deletions that were carried out or cancelled.
+
+        Args:
+            deletion_ids: IDs returned by add_deletion()
+        """
+        if not deletion_ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(_DELETE_DELETION, [(deletion_id,) for deletion_id in deletion_ids])
+            except Exception:
+                # Leaving the transaction open would make every later write on the connection fail
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def pending_deletions(self) -> List[Dict[str, Any]]:
+        """Return all persisted deletions, earliest deadline first."""
+        with self._lock:
+            rows = self._conn.execute(_SELECT_DELETIONS).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._closed.set()
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _request_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+        """Convert a database row to a request dictionary."""
+        request = dict(row)
+        request["volunteer"] = json.loads(request["volunteer"]) if request["volunteer"] else None
+        request["announcements"] = json.loads(request["announcements"]) if request["announcements"] else None
+        return request
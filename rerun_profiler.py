@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from metrics import get_registry
+
+
+# Streamlit runs the whole script on every interaction; runs slower than this
+# many milliseconds are reported and counted as over budget
+DEFAULT_BUDGET_MS = 150.0
+
+# Recent runs kept per page for the summary
+HISTORY_SIZE = 200
+
+PHASE_TOTAL = "total"
+
+
+class RerunTimer:
+    """Wall-clock timer of one script run, split into named phases."""
+
+    __slots__ = ("started", "phases", "_phase", "_phase_started")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._phase: Optional[str] = None
+        self._phase_started = self.started
+
+    def phase(self, name: str) -> None:
+        """
+        End the current phase and start the next one.
+
+        Args:
+            name: Label of the phase that starts now, e.g. "render"
+        """
+        now = time.perf_counter()
+        if self._phase is not None:
+            self.phases[self._phase] = self.phases.get(self._phase, 0.0) + now - self._phase_started
+        self._phase = name
+        self._phase_started = now
+
+    def stop(self) -> float:
+        """
+        End the run.
+
+        Returns:
+            Wall time of the whole run in seconds
+        """
+        self.phase(PHASE_TOTAL)
+        total = self._phase_started - self.started
+        self.phases[PHASE_TOTAL] = total
+        self._phase = None
+        return total
+
+
+class RerunProfiler:
+    def __init__(self, budget_ms: float = DEFAULT_BUDGET_MS, verbose: bool = False):
+        """
+        Initialize the profiler of the Streamlit app.
+
+        Every run is recorded in the metrics registry. In verbose mode each
+        run is also printed, and summary() reports percentiles per page.
+
+        Args:
+            budget_ms: Latency budget of a script run in milliseconds
+            verbose: Print every run instead of only those over budget
+        """
+        self.budget_ms = budget_ms
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._history: Dict[str, Deque[float]] = {}
+
+    def record(self, timer: RerunTimer, page: str) -> None:
+        """
+        Stop a run's timer and record its phases.
+
+        Args:
+            timer: Timer started at the top of the script
+            page: Page of the form that was rendered
+        """
+        total = timer.stop()
+        total_ms = total * 1000
+        over_budget = total_ms > self.budget_ms
+        metrics = get_registry()
+        for phase, seconds in timer.phases.items():
+            metrics.observe_rerun(page, phase, seconds, over_budget and phase == PHASE_TOTAL)
+        with self._lock:
+            history = self._history.get(page)
+            if history is None:
+                history = self._history[page] = deque(maxlen=HISTORY_SIZE)
+            history.append(total_ms)
+
+        if self.verbose or over_budget:
+            phases = ", ".join(f"{phase} {seconds * 1000:.1f}" for phase, seconds in timer.phases.items()
+                               if phase != PHASE_TOTAL)
+            budget_note = f" over the {self.budget_ms:.0f} ms budget" if over_budget else ""
+            print(f"Rerun of page {page} took {total_ms:.1f} ms{budget_note} ({phases})")
+
+    def summary(self) -> List[Dict[str, float]]:
+        """
+        Summarize the recent runs of each page.
+
+        Returns:
+            One row per page with the number of runs and the p50, p95 and maximum wall time in milliseconds
+        """
+        with self._lock:
+            snapshot: List[Tuple[str, List[float]]] = [(page, sorted(runs)) for page, runs in self._history.items()]
+        rows = []
+        for page, runs in sorted(snapshot):
+            rows.append({
+                "page": page,
+                "runs": len(runs),
+                "p50_ms": round(runs[int(0.5 * (len(runs) - 1))], 1),
+                "p95_ms": round(runs[int(0.95 * (len(runs) - 1))], 1),
+                "max_ms": round(runs[-1], 1),
+            })
+        return rows
+
+
+_profiler: Optional[RerunProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_rerun_profiler() -> RerunProfiler:
+    """
+    Get the process-wide profiler shared by all sessions.
+
+    PICKUP_PROFILE_RERUNS=1 switches on verbose mode, PICKUP_RERUN_BUDGET_MS
+    sets the latency budget.
+
+    Returns:
+        The shared profiler
+    """
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = RerunProfiler(
+                budget_ms=float(os.environ.get("PICKUP_RERUN_BUDGET_MS", DEFAULT_BUDGET_MS)),
+                verbose=os.environ.get("PICKUP_PROFILE_RERUNS") == "1"
+            )
+        return _profiler
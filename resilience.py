@@ -0,0 +1,248 @@
+import random
+import threading
+import time
+from typing import Optional, Tuple
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from metrics import get_registry
+
+
+# Attempts per Bot API call, including the first one
+MAX_ATTEMPTS = 3
+
+# Retry delays grow from the base up to the cap; each one is drawn uniformly
+# below that bound so that retrying callers spread out
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+# Consecutive failed calls after which the circuit opens
+FAILURE_THRESHOLD = 5
+
+# How long an open circuit rejects calls before letting a probe through, in seconds
+OPEN_SECONDS = 30.0
+
+# How often callers holding work check a half-open circuit again, in seconds
+PROBE_WAIT_SECONDS = 0.25
+
+# Circuit states
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_HALF_OPEN = "half_open"
+CIRCUIT_OPEN = "open"
+
+# Ways a call can fail transiently
+REASON_CONNECT = "connect"          # No connection, the request never reached Telegram
+REASON_UNAVAILABLE = "unavailable"  # 502, 503 or 504 from the gateway in front of the API
+REASON_NETWORK = "network"          # Connection lost or read timed out, the call may have been carried out
+REASON_SERVER = "server_error"      # Any other 5xx, the call may have been carried out
+
+# Methods that can be repeated without a visible effect if the first attempt went through
+IDEMPOTENT_PREFIXES = ("get", "delete", "edit", "set")
+
+_GATEWAY_STATUSES = (502, 503, 504)
+
+
+def failure_reason(error: Exception) -> Optional[str]:
+    """
+    Classify an exception raised by requests.
+
+    Args:
+        error: Exception of a failed call
+
+    Returns:
+        One of the REASON_* constants if the failure may be transient, None if it is fatal
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return REASON_CONNECT
+    # requests wraps refused connections as MaxRetryError(reason=NewConnectionError)
+    if isinstance(error, requests.ConnectionError) and error.args \
+            and isinstance(getattr(error.args[0], "reason", None), NewConnectionError):
+        return REASON_CONNECT
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return REASON_NETWORK
+    return None
+
+
+def status_reason(status: int) -> Optional[str]:
+    """
+    Classify an HTTP status of the API.
+
+    Args:
+        status: HTTP status code of the response
+
+    Returns:
+        One of the REASON_* constants for server errors, None otherwise
+    """
+    if status in _GATEWAY_STATUSES:
+        return REASON_UNAVAILABLE
+    if status >= 500:
+        return REASON_SERVER
+    return None
+
+
+def is_retryable(method: str, reason: Optional[str]) -> bool:
+    """
+    Decide whether a failed call may be sent again.
+
+    A call that may already have been carried out is only repeated if doing so
+    is harmless, so a lost response never turns into a second group post.
+
+    Args:
+        method: Bot API method name
+        reason: Result of failure_reason() or status_reason()
+
+    Returns:
+        True if the call should be retried
+    """
+    if reason is None:
+        return False
+    if reason in (REASON_NETWORK, REASON_SERVER):
+        return method.startswith(IDEMPOTENT_PREFIXES)
+    return True
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_MAX_SECONDS) -> float:
+    """
+    Work out the pause before a retry, with full jitter.
+
+    Args:
+        attempt: Number of the failed attempt, starting at 0
+        base: Upper bound of the first pause in seconds
+        cap: Largest upper bound in seconds
+
+    Returns:
+        Seconds to wait
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def within_deadline(deadline: Optional[float], pause: float, timeout: Tuple[float, float]) -> bool:
+    """
+    Check whether a retry would end in time.
+
+    Args:
+        deadline: Monotonic time by which the call must have ended, None for no limit
+        pause: Backoff before the retry in seconds
+        timeout: Connect and read timeout of the retry in seconds
+
+    Returns:
+        True if the retry ends before the deadline even when it runs into both timeouts
+    """
+    if deadline is None:
+        return True
+    return time.monotonic() + pause + timeout[0] + timeout[1] <= deadline
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Telegram API circuit {name} is open, next attempt in {retry_in:.1f} seconds")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    def __init__(self, name: str = "telegram", failure_threshold: int = FAILURE_THRESHOLD,
+                 open_seconds: float = OPEN_SECONDS):
+        """
+        Initialize a closed circuit.
+
+        After failure_threshold consecutive failures the circuit opens and
+        rejects calls for open_seconds. Then a single probe call is let
+        through: if it succeeds the circuit closes, otherwise it opens again.
+
+        Args:
+            name: Label of the circuit in the metrics
+            failure_threshold: Consecutive failures that open the circuit
+            open_seconds: Seconds the circuit stays open
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        get_registry().observe_circuit(name, CIRCUIT_CLOSED, changed=False)
+
+    @property
+    def state(self) -> str:
+        """Current state, one of the CIRCUIT_* constants."""
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self._state
+
+    def retry_in(self) -> float:
+        """
+        Return how long a caller has to hold back a call.
+
+        Returns:
+            Seconds until a call may be made, 0 if one may be made now
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._refresh(now)
+            if self._state == CIRCUIT_OPEN:
+                return self._opened_at + self.open_seconds - now
+            if self._state == CIRCUIT_HALF_OPEN and self._probing:
+                return PROBE_WAIT_SECONDS
+            return 0.0
+
+    def before_call(self, method: str) -> None:
+        """
+        Ask for permission to make a call. Every permitted call must be
+        followed by record_success() or record_failure().
+
+        Args:
+            method: Bot API method name, for the metrics
+
+        Raises:
+            CircuitOpenError: If the circuit rejects the call
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._refresh(now)
+            if self._state == CIRCUIT_CLOSED:
+                return
+            if self._state == CIRCUIT_HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            retry_in = max(self._opened_at + self.open_seconds - now, PROBE_WAIT_SECONDS)
+        get_registry().observe_circuit_rejection(self.name, method)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self) -> None:
+        """Report a call that reached the API."""
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != CIRCUIT_CLOSED:
+                self._transition(CIRCUIT_CLOSED)
+
+    def abandon_call(self) -> None:
+        """Report a permitted call that was cancelled before it finished."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        """Report a call that failed to reach the API or got a server error."""
+        with self._lock:
+            self._failures += 1
+            if self._state == CIRCUIT_HALF_OPEN or (self._state == CIRCUIT_CLOSED
+                                                    and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self._transition(CIRCUIT_OPEN)
+
+    def _refresh(self, now: float) -> None:
+        """Let an open circuit whose time is up accept a probe. Must be called with the lock held."""
+        if self._state == CIRCUIT_OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(CIRCUIT_HALF_OPEN)
+
+    def _transition(self, state: str) -> None:
+        """Change the state and report it. Must be called with the lock held."""
+        print(f"Telegram API circuit {self.name} is {state.replace('_', '-')}")
+        self._state = state
+        get_registry().observe_circuit(self.name, state)
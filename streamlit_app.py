@@ -1,7 +1,17 @@
 import streamlit as st
 import datetime
-import time
-from config import TelegramPickupBot
+import os
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+from rerun_profiler import RerunTimer, get_rerun_profiler
+from volunteer_registry import TIME_SLOTS
+
+# The bots pull in requests, pytz and aiohttp; they are imported on first use
+# instead of on every script run
+
+rerun_timer = RerunTimer()
+rerun_timer.phase("startup")
 
 # --- Page Config ---
 st.set_page_config(
@@ -12,7 +22,7 @@ st.set_page_config(
 )
 
 # --- CSS ---
-st.markdown("""
+PAGE_STYLE = """
 <style>
     .main { padding: 2rem; }
     .stButton>button {
@@ -39,7 +49,8 @@ st.markdown("""
         margin-bottom: 30px;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(PAGE_STYLE, unsafe_allow_html=True)
 
 # --- Session State Defaults ---
 st.session_state.setdefault('page', 1)
@@ -53,6 +64,115 @@ st.session_state.setdefault('showing_thank_you', False)
 st.session_state.setdefault('submission_success', False)
 st.session_state.setdefault('submission_error', None)
 st.session_state.setdefault('wait_minutes', 15)
+st.session_state.setdefault('job_id', None)
+# Identifies one submission of the form, so reruns cannot broadcast it twice
+st.session_state.setdefault('submission_key', None)
+
+# An open page reports every 2 seconds; without a report for this long the job is
+# marked orphaned. The request keeps running, since a backgrounded mobile tab
+# stops reporting too and its donor still expects the volunteer's call; it is
+# only withdrawn if still unclaimed after half its wait
+SESSION_HEARTBEAT_TIMEOUT = 120
+
+# --- Process-wide Resources ---
+@st.cache_resource
+def load_settings() -> Dict[str, Any]:
+    """Read the secrets and switches once per process."""
+    return {
+        "token": st.secrets["TELEGRAM_BOT_TOKEN"],
+        "group_chat_id": st.secrets["GROUP_CHAT_ID"],
+        # Further groups or regions that get every request at the same time, comma-separated
+        "fanout_chat_ids": [chat_id.strip() for chat_id in str(st.secrets.get("FANOUT_CHAT_IDS", "")).split(",")
+                            if chat_id.strip()],
+        # PICKUP_ASYNC=1 runs all workflows on one event loop instead of a thread each
+        "use_async": os.environ.get("PICKUP_ASYNC") == "1",
+        "edit_in_place": os.environ.get("PICKUP_EDIT_IN_PLACE") == "1",
+    }
+
+def get_bot_class(settings: Dict[str, Any]) -> type:
+    """Return the bot class the switches select, so every part of the app runs the same bot."""
+    if settings["use_async"]:
+        from async_bot import AsyncTelegramPickupBot
+        return AsyncTelegramPickupBot
+    from config import TelegramPickupBot
+    return TelegramPickupBot
+
+def bootstrap(settings: Dict[str, Any]):
+    """Open the request store, recover work from before a restart and start update ingestion and metrics export."""
+    from metrics import MetricsServer, get_registry, start_textfile_export
+    from request_store import RequestStore, DEFAULT_DB_PATH
+    from volunteer_registry import get_volunteer_registry
+    from webhook_server import start_webhook_mode, DEFAULT_PORT
+
+    store = RequestStore(os.environ.get("PICKUP_DB_PATH", DEFAULT_DB_PATH))
+
+    # Receive updates through a webhook when TELEGRAM_WEBHOOK_URL is set, otherwise keep polling;
+    # switched before resumed requests wait, so no getUpdates call races the webhook
+    public_url = os.environ.get("TELEGRAM_WEBHOOK_URL")
+    if public_url:
+        start_webhook_mode(
+            get_bot_class(settings)(token=settings["token"], chat_id=settings["group_chat_id"]),
+            public_url=public_url,
+            secret_token=os.environ["TELEGRAM_WEBHOOK_SECRET"],
+            port=int(os.environ.get("TELEGRAM_WEBHOOK_PORT", DEFAULT_PORT))
+        )
+
+    # Resumed requests run on the bot the workflows use, sharing its one dispatcher for the token
+    get_bot_class(settings)(token=settings["token"], chat_id=settings["group_chat_id"], store=store,
+                            edit_in_place=settings["edit_in_place"], volunteers=get_volunteer_registry()).reconcile()
+
+    # Expose metrics on PICKUP_METRICS_PORT and/or write them to PICKUP_METRICS_FILE, if set
+    registry = get_registry()
+    if os.environ.get("PICKUP_METRICS_PORT"):
+        MetricsServer(registry, port=int(os.environ["PICKUP_METRICS_PORT"])).start()
+    if os.environ.get("PICKUP_METRICS_FILE"):
+        start_textfile_export(registry, os.environ["PICKUP_METRICS_FILE"])
+    return store
+
+def report_bootstrap(future: "Future") -> None:
+    """Log a failed bootstrap right away instead of only on the first submission."""
+    if future.exception() is not None:
+        print(f"Startup failed: {future.exception()}")
+
+@st.cache_resource
+def start_services() -> "Future":
+    """Run the bootstrap once per process in the background, so the first page does not wait for it."""
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pickup-bootstrap")
+    future = pool.submit(bootstrap, load_settings())
+    future.add_done_callback(report_bootstrap)
+    pool.shutdown(wait=False)
+    return future
+
+start_services()
+
+def get_request_store():
+    """Return the request store once the bootstrap has finished."""
+    return start_services().result()
+
+@st.cache_resource
+def get_pickup_bot():
+    """Build the bot once per process; all workflows share it together with its transport and queues."""
+    from volunteer_registry import get_volunteer_registry
+    settings = load_settings()
+    return get_bot_class(settings)(token=settings["token"], chat_id=settings["group_chat_id"],
+                                   store=get_request_store(), edit_in_place=settings["edit_in_place"],
+                                   fanout_chat_ids=settings["fanout_chat_ids"], volunteers=get_volunteer_registry())
+
+def get_executor():
+    """Return the process-wide workflow executor, importing the bots on first use."""
+    from pickup_jobs import get_executor
+    return get_executor()
+
+# --- Memoized Page Data ---
+# Slots of today that end after the given hour, plus the last one, which is always offered
+SLOT_ENDS = (14, 16, 18, 20, 22)
+
+@st.cache_data
+def time_options(today: bool, current_hour: int) -> Tuple[str, ...]:
+    """Time slots offered for a date, shared with the volunteer registry so requests match availability."""
+    if not today:
+        return tuple(TIME_SLOTS)
+    return tuple(slot for slot, end in zip(TIME_SLOTS, SLOT_ENDS) if current_hour < end) + (TIME_SLOTS[-1],)
 
 # --- Navigation Functions ---
 def next_page(): st.session_state.page += 1
@@ -63,33 +183,81 @@ def reset_form():
         'location': "", 'remarks': "", 'date': "Today",
         'pickup_time': "", 'contact_number': "",
         'submitted': False, 'page': 1, 'showing_thank_you': False,
-        'submission_success': False, 'submission_error': None
+        'submission_success': False, 'submission_error': None, 'job_id': None,
+        'submission_key': None
     })
 
 def process_submission():
     st.session_state.submitted = True
+    submission_key = st.session_state.submission_key or uuid.uuid4().hex
+    st.session_state.submission_key = submission_key
+    # A rerun of an already submitted form attaches to its running workflow
+    existing_job_id = get_executor().find(submission_key)
+    if existing_job_id is not None:
+        st.session_state.job_id = existing_job_id
+        return
     try:
-        TOKEN = st.secrets["TELEGRAM_BOT_TOKEN"]
-        GROUP_CHAT_ID = st.secrets["GROUP_CHAT_ID"]
-        pickup_bot = TelegramPickupBot(token=TOKEN, chat_id=GROUP_CHAT_ID)
+        pickup_bot = get_pickup_bot()
 
         date_str = st.session_state.date
         if date_str == "Today":
             date_str = datetime.datetime.now().strftime("%A, %d %B")
 
-        result = pickup_bot.run_pickup_workflow(
+        # The workflow waits up to wait_minutes, so it runs in the background
+        # instead of blocking this script run
+        st.session_state.job_id = get_executor().submit(
+            pickup_bot,
+            idempotency_key=submission_key,
             location=st.session_state.location or "Not specified",
             remarks=st.session_state.remarks,
             date=date_str,
             pick_up_time=st.session_state.pickup_time,
             contact_number=st.session_state.contact_number,
-            wait_minutes=st.session_state.wait_minutes
+            wait_minutes=st.session_state.wait_minutes,
+            heartbeat_timeout=SESSION_HEARTBEAT_TIMEOUT
         )
-        st.session_state.submission_success = result
     except Exception as e:
         st.session_state.submission_error = str(e)
         st.session_state.submission_success = False
 
+def current_job():
+    job_id = st.session_state.job_id
+    if not job_id:
+        return None
+    # Every rerun proves the donor still has the page open
+    get_executor().heartbeat(job_id)
+    return get_executor().get(job_id)
+
+def cancel_submission():
+    if st.session_state.job_id:
+        get_executor().cancel(st.session_state.job_id)
+
+@st.fragment(run_every=2)
+def show_job_status():
+    """Refresh the status of the running workflow without rerunning the whole page."""
+    # Timed on its own, since it reruns every 2 seconds without the rest of the script
+    fragment_timer = RerunTimer()
+    fragment_timer.phase("fragment")
+    from pickup_jobs import JOB_POSTED, JOB_CLAIMED
+    job = current_job()
+    if job is None or job.done:
+        # Let the full page render the final result
+        st.rerun()
+    elif job.status == JOB_CLAIMED:
+        st.success("A Foodsaver claimed your request. Your number is being shared...")
+    elif job.cancel_requested:
+        st.info("Withdrawing your request...")
+    else:
+        if job.status == JOB_POSTED:
+            st.info("Your request was posted. Waiting for a Foodsaver to respond...")
+        else:
+            st.info("We are reaching out to potential Foodsaver...")
+        st.button("Cancel my request", on_click=cancel_submission, use_container_width=True)
+    get_rerun_profiler().record(fragment_timer, "status")
+
+rerun_timer.phase("render")
+rendered_page = str(st.session_state.page)
+
 # --- Progress Bar ---
 total_pages = 4
 progress = st.session_state.page / total_pages
@@ -141,23 +309,8 @@ elif st.session_state.page == 2:
     st.title("Pick-up Time")
     st.markdown("This can be an estimation. You can confirm the details once an available Foodsaver is reaching out to you!")
 
-    # Time Options
-    time_options = []
-    if st.session_state.date == "Today":
-        if current_hour < 14: time_options.append("Before 14:00")
-        if current_hour < 16: time_options.append("14:00 - 16:00")
-        if current_hour < 18: time_options.append("16:00 - 18:00")
-        if current_hour < 20: time_options.append("18:00 - 20:00")
-        if current_hour < 22: time_options.append("20:00 - 22:00")
-        time_options.append("After 22:00")
-    else:
-        time_options = [
-            "Before 14:00", "14:00 - 16:00", "16:00 - 18:00",
-            "18:00 - 20:00", "20:00 - 22:00", "After 22:00"
-        ]
-
     cols = st.columns(2)
-    for i, label in enumerate(time_options):
+    for i, label in enumerate(time_options(st.session_state.date == "Today", current_hour)):
         def set_time(val=label):
             st.session_state.pickup_time = val
             next_page()
@@ -204,6 +357,9 @@ elif st.session_state.page == 4:
         def on_submit():
             if st.session_state.contact_number.strip():
                 st.session_state.showing_thank_you = True
+                # A double click keeps the key of the first click
+                if st.session_state.submission_key is None:
+                    st.session_state.submission_key = uuid.uuid4().hex
 
         with col2:
             st.button("Submit", on_click=on_submit, use_container_width=True, disabled=not st.session_state.contact_number.strip())
@@ -215,14 +371,22 @@ elif st.session_state.page == 4:
 
     elif st.session_state.showing_thank_you and not st.session_state.submitted:
         st.success("Thank you! Submission completed.")
-        placeholder = st.empty()
-        placeholder.info("We are reaching out to potential Foodsaver...")
-        time.sleep(2)
         process_submission()
-        placeholder.empty()
 
     if st.session_state.submitted:
-        if st.session_state.submission_error:
+        from pickup_jobs import JOB_CANCELLED
+        job = current_job()
+        if job is not None and job.done:
+            st.session_state.submission_success = job.success
+            st.session_state.submission_error = job.error
+
+        if job is not None and not job.done:
+            show_job_status()
+        elif job is not None and job.status == JOB_CANCELLED:
+            st.info("Your request was withdrawn and removed from the group.")
+            if st.button("Start Over"):
+                reset_form()
+        elif st.session_state.submission_error:
             st.error(f"There was an error: {st.session_state.submission_error}")
             if st.button("Try Again"):
                 reset_form()
@@ -238,3 +402,11 @@ elif st.session_state.page == 4:
             st.warning(f"No Foodsavers were available within {st.session_state.wait_minutes} minutes. Try again later or [use Telegram](https://t.me/+2NxhCayA8bg4ODlk).")
             if st.button("Try Again"):
                 reset_form()
+
+# --- Rerun Profiling ---
+profiler = get_rerun_profiler()
+profiler.record(rerun_timer, rendered_page)
+if profiler.verbose:
+    with st.sidebar:
+        st.caption(f"Script runs of this process, budget {profiler.budget_ms:.0f} ms")
+        st.table(profiler.summary())
@@ -0,0 +1,321 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Any, Union, Tuple
+
+import requests
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from requests.adapters import HTTPAdapter
+
+from metrics import MetricsRegistry, get_registry
+from resilience import (MAX_ATTEMPTS, CircuitBreaker, backoff_delay, failure_reason, is_retryable, within_deadline,
+                        status_reason)
+from traffic_log import TrafficRecorder, get_traffic_recorder
+
+
+# Can be pointed at a local stand-in such as fake_telegram_server for tests and benchmarks
+API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL", "https://api.telegram.org")
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 15.0
+
+# Turns the HTTP status and raw body of a response into the decoded API result
+Decoder = Callable[[int, bytes], Dict[str, Any]]
+
+# orjson decodes several times faster than the standard library if it is installed;
+# both raise ValueError subclasses on malformed input
+json_loads: Callable[[Union[bytes, str]], Any] = orjson.loads if orjson is not None else json.loads
+
+
+def api_outcome(result: Dict[str, Any]) -> str:
+    """
+    Classify a Bot API response for the call metrics.
+
+    Args:
+        result: Decoded JSON response of the API
+
+    Returns:
+        "ok", "rate_limited" or "error"
+    """
+    if result.get("ok"):
+        return "ok"
+    if result.get("error_code") == 429:
+        return "rate_limited"
+    return "error"
+
+
+def decode_response(status: int, body: bytes) -> Dict[str, Any]:
+    """
+    Decode a Bot API response body.
+
+    Gateways in front of the API answer server errors with HTML pages, which
+    are turned into an error result like the API's own.
+
+    Args:
+        status: HTTP status code of the response
+        body: Raw body of the response
+
+    Returns:
+        Decoded JSON response of the API
+    """
+    try:
+        return json_loads(body)
+    except ValueError:
+        if status < 500:
+            raise
+        return {"ok": False, "error_code": status, "description": f"HTTP {status} without an API response"}
+
+
+class CallAttempts:
+    def __init__(self, method: str, params: Optional[Dict[str, Any]], breaker: CircuitBreaker, max_attempts: int,
+                 timeout: Tuple[float, float], recorder: Optional[TrafficRecorder] = None,
+                 deadline: Optional[float] = None):
+        """
+        Keep track of the attempts of one Bot API call.
+
+        The sync and the asyncio transport only make the HTTP round trips;
+        after each attempt this decides whether to retry and for how long to
+        back off, and reports the attempt to the circuit breaker, the metrics
+        and the traffic log.
+
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            params: Query parameters of the call
+            breaker: Circuit breaker guarding the API host
+            max_attempts: Attempts when failures are transient, 1 disables retries
+            timeout: Connect and read timeout of an attempt in seconds
+            recorder: Traffic log every attempt is written to, if any
+            deadline: Monotonic time by which the call must have ended; no retry is
+                started that could run past it
+        """
+        self.method = method
+        self.params = params
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.recorder = recorder
+        self.deadline = deadline
+        self.attempt = 0
+        self._started = 0.0
+
+    def begin(self) -> None:
+        """
+        Start an attempt.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker rejects the call
+        """
+        self.breaker.before_call(self.method)
+        self._started = time.perf_counter()
+
+    def answered(self, status: int, result: Dict[str, Any]) -> Optional[float]:
+        """
+        Report an attempt that got a decoded response.
+
+        Args:
+            status: HTTP status code of the response
+            result: Decoded JSON response of the API
+
+        Returns:
+            Seconds to back off before the next attempt, None if result is the outcome of the call
+        """
+        seconds = time.perf_counter() - self._started
+        get_registry().observe_api_call(self.method, seconds, api_outcome(result))
+        if self.recorder is not None:
+            self.recorder.record_call(self.method, self.params, seconds, status=status, result=result)
+        reason = status_reason(status)
+        if reason is None:
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        return self._retry(reason)
+
+    def failed(self, error: Exception, reason: Optional[str], status: Optional[int] = None) -> float:
+        """
+        Report an attempt that raised.
+
+        Args:
+            error: Exception of the attempt
+            reason: Classification of the error, one of the REASON_* constants of resilience or None if fatal
+            status: HTTP status code if a response arrived before the error
+
+        Returns:
+            Seconds to back off before the next attempt
+
+        Raises:
+            Exception: The error itself if the call is not retried
+        """
+        seconds = time.perf_counter() - self._started
+        get_registry().observe_api_call(self.method, seconds, "exception")
+        if self.recorder is not None:
+            self.recorder.record_call(self.method, self.params, seconds, status=status, error=error)
+        self.breaker.record_failure()
+        pause = self._retry(reason)
+        if pause is None:
+            raise error
+        return pause
+
+    def abandon(self) -> None:
+        """Report an attempt that was cancelled before it finished."""
+        self.breaker.abandon_call()
+
+    def _retry(self, reason: Optional[str]) -> Optional[float]:
+        """Return the backoff before the next attempt, None if the call must not be retried."""
+        metrics = get_registry()
+        retryable = is_retryable(self.method, reason)
+        pause = backoff_delay(self.attempt)
+        if not retryable or self.attempt + 1 >= self.max_attempts \
+                or not within_deadline(self.deadline, pause, self.timeout):
+            metrics.observe_failure(self.method, "exhausted" if retryable else "fatal")
+            return None
+        metrics.observe_retry(self.method, reason)
+        self.attempt += 1
+        return pause
+
+
+class TelegramTransport:
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 base_url: str = API_BASE_URL,
+                 max_attempts: int = MAX_ATTEMPTS,
+                 breaker: Optional[CircuitBreaker] = None,
+                 recorder: Optional[TrafficRecorder] = None):
+        """
+        Initialize a pooled, keep-alive HTTP transport for the Bot API.
+
+        Args:
+            pool_size: Maximum number of open connections to the API host
+            connect_timeout: Seconds to wait for a TCP/TLS connection
+            read_timeout: Seconds to wait for a response once connected
+            base_url: Root URL of the Bot API
+            max_attempts: Attempts per call when failures are transient, 1 disables retries
+            breaker: Circuit breaker guarding the API host, a new one if None
+            recorder: Traffic log every call is written to, if any
+        """
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker()
+        self.recorder = recorder
+
+        # pool_block makes threads wait for a free connection instead of
+        # opening throwaway ones beyond the pool size
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+    def call(self, token: str, method: str, params: Optional[Dict[str, Any]] = None,
+             read_timeout: Optional[float] = None, decoder: Decoder = decode_response,
+             deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Call a Bot API method.
+
+        Args:
+            token: Telegram bot API token
+            method: Bot API method name, e.g. "sendMessage"
+            params: Query parameters of the call
+            read_timeout: Override of the read timeout, e.g. for long polling
+            decoder: Decodes the response, e.g. one that skips parts the caller ignores
+            deadline: Monotonic time by which the call must have ended; no retry is
+                started that could run past it
+
+        Returns:
+            Decoded JSON response of the API
+
+        Raises:
+            CircuitOpenError: If the circuit breaker rejects the call
+            requests.RequestException: If the call failed and could not be retried
+        """
+        url = f"{self.base_url}/bot{token}/{method}"
+        timeout: Tuple[float, float] = (self.connect_timeout, read_timeout or self.read_timeout)
+        attempts = CallAttempts(method, params, self.breaker, self.max_attempts, timeout, self.recorder, deadline)
+        while True:
+            attempts.begin()
+            response = None
+            try:
+                response = self._session.get(url, params=params, timeout=timeout)
+                result = decoder(response.status_code, response.content)
+            except Exception as e:
+                pause = attempts.failed(e, failure_reason(e), response.status_code if response is not None else None)
+            else:
+                pause = attempts.answered(response.status_code, result)
+                if pause is None:
+                    return result
+            time.sleep(pause)
+
+    def connection_stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Report how often pooled connections were reused.
+
+        Returns:
+            Dictionary with the number of requests, opened connections, reused connections and the reuse ratio
+        """
+        requests_sent = 0
+        connections_opened = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+
+        reused = max(requests_sent - connections_opened, 0)
+        return {
+            "requests": requests_sent,
+            "connections": connections_opened,
+            "reused": reused,
+            "reuse_ratio": reused / requests_sent if requests_sent else 0.0
+        }
+
+    def observe_connections(self, registry: MetricsRegistry) -> None:
+        """
+        Report the connection reuse of this transport to a metrics registry.
+
+        Args:
+            registry: Registry receiving the gauges, e.g. as one of its collectors
+        """
+        stats = self.connection_stats()
+        registry.observe_connections(stats["requests"], stats["connections"], stats["reuse_ratio"])
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self._session.close()
+
+
+_transport: Optional[TelegramTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> TelegramTransport:
+    """
+    Get the process-wide transport shared by all bot instances and threads.
+
+    Pool size and timeouts can be set with the TELEGRAM_POOL_SIZE,
+    TELEGRAM_CONNECT_TIMEOUT and TELEGRAM_READ_TIMEOUT environment variables,
+    the API root with TELEGRAM_API_BASE_URL. PICKUP_TRAFFIC_LOG records all
+    calls to a traffic log.
+
+    Returns:
+        The shared transport
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = TelegramTransport(
+                pool_size=int(os.environ.get("TELEGRAM_POOL_SIZE", DEFAULT_POOL_SIZE)),
+                connect_timeout=float(os.environ.get("TELEGRAM_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+                read_timeout=float(os.environ.get("TELEGRAM_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+                recorder=get_traffic_recorder()
+            )
+            # The exported connection gauges describe the shared pool
+            get_registry().collectors.append(_transport.observe_connections)
+        return _transport
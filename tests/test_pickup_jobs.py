@@ -0,0 +1,199 @@
+"""
+Background pickup jobs: cancellation against claims, orphaned submissions and duplicate submissions.
+
+    python -m pytest tests/test_pickup_jobs.py
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_bot import AsyncTelegramPickupBot, AsyncTelegramTransport
+from config import TelegramPickupBot
+from fake_telegram_server import FakeTelegramServer
+import pickup_jobs
+from pickup_jobs import JOB_CANCELLED, JOB_FULFILLED, JOB_POSTED, JOB_TIMED_OUT, PickupJobExecutor
+from request_store import RequestStore
+from telegram_transport import TelegramTransport
+from update_dispatcher import get_dispatcher
+
+
+GROUP_CHAT_ID = "-1001234567890"
+VOLUNTEER_ID = 424242
+
+WORKFLOW_KWARGS = {"location": "Otaniemi", "date": "Today", "pick_up_time": "14:00 - 16:00",
+                   "contact_number": "0401234567", "remarks": "", "wait_minutes": 1}
+
+
+def start_update(request_id: str) -> Dict[str, Any]:
+    """Build the update Telegram delivers when a volunteer sends "/start <request_id>"."""
+    chat = {"id": VOLUNTEER_ID, "type": "private", "first_name": "Volunteer", "username": "volunteer"}
+    return {"update_id": 1, "message": {"message_id": 1000, "date": int(time.time()), "chat": chat,
+                                        "from": dict(chat, is_bot=False), "text": f"/start {request_id}"}}
+
+
+def wait_until(predicate, timeout: float = 10.0) -> bool:
+    """Poll a condition until it holds or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+class CancelTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = FakeTelegramServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.store = RequestStore(os.path.join(tempfile.mkdtemp(), "requests.db"))
+        self.addCleanup(self.store.close)
+        self.executor = PickupJobExecutor(max_workers=4)
+        # Dispatchers are per token and process, a fresh token keeps the tests apart
+        self.token = f"test:{uuid.uuid4().hex}"
+
+    def async_bot(self) -> AsyncTelegramPickupBot:
+        return AsyncTelegramPickupBot(self.token, GROUP_CHAT_ID, store=self.store,
+                                      transport=AsyncTelegramTransport(base_url=self.server.base_url))
+
+    def sync_bot(self) -> TelegramPickupBot:
+        return TelegramPickupBot(self.token, GROUP_CHAT_ID, store=self.store,
+                                 transport=TelegramTransport(base_url=self.server.base_url))
+
+    def posted_job(self, bot: Any) -> str:
+        job_id = self.executor.submit(bot, **WORKFLOW_KWARGS)
+        self.assertTrue(wait_until(lambda: self.executor.get(job_id).status == JOB_POSTED))
+        return job_id
+
+    def assert_claim_survives_cancel(self, bot: Any) -> None:
+        job_id = self.posted_job(bot)
+        job = self.executor.get(job_id)
+        # The claim is taken from the update stream; the workflow has not reported it yet
+        get_dispatcher(self.token, bot.get_bot_updates).dispatch(start_update(job.request_id))
+
+        self.assertFalse(self.executor.cancel(job_id))
+        self.assertTrue(wait_until(lambda: job.done))
+        self.assertEqual(job.status, JOB_FULFILLED)
+        # The announcement, the volunteer's DM with the contact and the confirmation
+        self.assertEqual(self.server.calls["sendMessage"], 3)
+
+    def test_async_claim_wins_over_a_later_cancel(self) -> None:
+        self.assert_claim_survives_cancel(self.async_bot())
+
+    def test_sync_claim_wins_over_a_later_cancel(self) -> None:
+        self.assert_claim_survives_cancel(self.sync_bot())
+
+    def test_async_cancel_retracts_an_unclaimed_request(self) -> None:
+        job_id = self.posted_job(self.async_bot())
+        job = self.executor.get(job_id)
+
+        self.assertTrue(self.executor.cancel(job_id))
+        self.assertTrue(wait_until(lambda: job.done))
+        self.assertEqual(job.status, JOB_CANCELLED)
+        self.assertTrue(wait_until(lambda: self.server.live_messages() == 0))
+        self.assertEqual(self.store.get_request(job.request_id)["state"], "cancelled")
+
+
+
+class OrphanTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = FakeTelegramServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.token = f"test:{uuid.uuid4().hex}"
+        self.bot = AsyncTelegramPickupBot(self.token, GROUP_CHAT_ID,
+                                          transport=AsyncTelegramTransport(base_url=self.server.base_url))
+        interval = pickup_jobs.REAPER_INTERVAL_SECONDS
+        pickup_jobs.REAPER_INTERVAL_SECONDS = 0.05
+        self.addCleanup(setattr, pickup_jobs, "REAPER_INTERVAL_SECONDS", interval)
+        self.executor = PickupJobExecutor(max_workers=4)
+
+    def submit(self, wait_minutes: float) -> str:
+        kwargs = dict(WORKFLOW_KWARGS, wait_minutes=wait_minutes)
+        return self.executor.submit(self.bot, heartbeat_timeout=0.1, **kwargs)
+
+    def test_unclaimed_orphan_is_withdrawn_after_half_its_wait(self) -> None:
+        job_id = self.submit(wait_minutes=0.05)
+        job = self.executor.get(job_id)
+
+        self.assertTrue(wait_until(lambda: job.orphaned))
+        self.assertEqual(job.status, JOB_POSTED)
+        self.assertTrue(wait_until(lambda: job.done))
+        self.assertEqual(job.status, JOB_CANCELLED)
+        # Withdrawn before the wait of 3 seconds ran out
+        self.assertLess(job.updated_at - job.created_at, 2.5)
+
+    def test_orphan_with_a_heartbeat_keeps_its_request(self) -> None:
+        job_id = self.submit(wait_minutes=0.02)
+        job = self.executor.get(job_id)
+        while not job.done:
+            self.executor.heartbeat(job_id)
+            time.sleep(0.02)
+
+        self.assertFalse(job.orphaned)
+        self.assertEqual(job.status, JOB_TIMED_OUT)
+
+
+class IdempotencyTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = FakeTelegramServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.token = f"test:{uuid.uuid4().hex}"
+        self.bot = AsyncTelegramPickupBot(self.token, GROUP_CHAT_ID,
+                                          transport=AsyncTelegramTransport(base_url=self.server.base_url))
+        self.executor = PickupJobExecutor(max_workers=4)
+        self.job_ids = []
+        # Runs before the server stops, so no workflow is left talking to it
+        self.addCleanup(self.finish_jobs)
+
+    def submit(self, idempotency_key: str) -> str:
+        job_id = self.executor.submit(self.bot, idempotency_key=idempotency_key,
+                                      **dict(WORKFLOW_KWARGS, wait_minutes=0.01))
+        self.job_ids.append(job_id)
+        return job_id
+
+    def finish_jobs(self) -> None:
+        for job_id in self.job_ids:
+            self.executor.cancel(job_id)
+        wait_until(lambda: all(self.executor.get(job_id).done for job_id in self.job_ids))
+
+    def patch(self, name: str, value: Any) -> None:
+        original = getattr(pickup_jobs, name)
+        setattr(pickup_jobs, name, value)
+        self.addCleanup(setattr, pickup_jobs, name, original)
+
+    def test_duplicate_submission_attaches_to_the_running_job(self) -> None:
+        job_id = self.submit("donor-1")
+        self.assertTrue(wait_until(lambda: self.executor.get(job_id).status == JOB_POSTED))
+
+        self.assertEqual(self.submit("donor-1"), job_id)
+        self.assertEqual(self.executor.find("donor-1"), job_id)
+        # Only the first submission was announced
+        self.assertEqual(self.server.calls["sendMessage"], 1)
+
+    def test_key_expires_after_its_ttl(self) -> None:
+        self.patch("IDEMPOTENCY_TTL_SECONDS", 0.1)
+        job_id = self.submit("donor-1")
+        time.sleep(0.2)
+
+        self.assertIsNone(self.executor.find("donor-1"))
+        self.assertNotEqual(self.submit("donor-1"), job_id)
+
+    def test_oldest_key_is_dropped_when_the_cache_is_full(self) -> None:
+        self.patch("IDEMPOTENCY_CACHE_SIZE", 2)
+        job_ids = [self.submit(f"donor-{i}") for i in range(3)]
+
+        self.assertIsNone(self.executor.find("donor-0"))
+        self.assertEqual(self.executor.find("donor-1"), job_ids[1])
+        self.assertEqual(self.executor.find("donor-2"), job_ids[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
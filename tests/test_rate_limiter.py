@@ -0,0 +1,114 @@
+"""
+Outbound queue: priority order, per-chat rate limits and outages.
+
+    python -m pytest tests/test_rate_limiter.py
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limiter
+from rate_limiter import GROUP_BURST, PRIORITY_HOUSEKEEPING, PRIORITY_NORMAL, PRIORITY_URGENT, OutboundQueue
+from resilience import CircuitOpenError
+
+
+GROUP_CHAT_ID = "-1001234567890"
+
+
+class HeldBreaker:
+    """Stands in for an open circuit, so calls pile up in the queue until release()."""
+
+    def __init__(self):
+        self.name = "telegram"
+        self.held = True
+
+    def retry_in(self) -> float:
+        return 0.01 if self.held else 0.0
+
+    def release(self) -> None:
+        self.held = False
+
+
+class OutboundQueueTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sent: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.breaker = HeldBreaker()
+        # One worker sends in the order the scheduler hands the calls over
+        self.queue = OutboundQueue(self.send, workers=1, breaker=self.breaker)
+
+    def send(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            self.sent.append(dict(params, method=method))
+        return {"ok": True, "result": True}
+
+    def test_sends_by_priority_then_submission_order(self) -> None:
+        futures = [
+            self.queue.submit("deleteMessage", {"chat_id": 1, "message_id": 1}, PRIORITY_HOUSEKEEPING),
+            self.queue.submit("sendMessage", {"chat_id": 2, "text": "a"}, PRIORITY_NORMAL),
+            self.queue.submit("sendMessage", {"chat_id": 3, "text": "b"}, PRIORITY_URGENT),
+            self.queue.submit("sendMessage", {"chat_id": 2, "text": "c"}, PRIORITY_URGENT),
+            self.queue.submit("sendMessage", {"chat_id": 4, "text": "d"}, PRIORITY_NORMAL),
+        ]
+        self.breaker.release()
+        for future in futures:
+            future.result(timeout=5)
+
+        self.assertEqual([params.get("text", "delete") for params in self.sent], ["b", "c", "a", "d", "delete"])
+        self.assertEqual(self.queue.pending(), 0)
+
+    def test_rate_limited_chat_does_not_hold_back_other_chats(self) -> None:
+        group = [self.queue.submit("sendMessage", {"chat_id": GROUP_CHAT_ID, "text": str(i)}, PRIORITY_URGENT)
+                 for i in range(GROUP_BURST + 2)]
+        private = self.queue.submit("sendMessage", {"chat_id": 42, "text": "dm"}, PRIORITY_NORMAL)
+        deletion = self.queue.submit("deleteMessage", {"chat_id": GROUP_CHAT_ID, "message_id": 1},
+                                     PRIORITY_HOUSEKEEPING)
+        started = time.monotonic()
+        self.breaker.release()
+
+        private.result(timeout=5)
+        # Deletions only count against the global limit
+        deletion.result(timeout=5)
+        for future in group[:GROUP_BURST]:
+            future.result(timeout=5)
+        self.assertLess(time.monotonic() - started, 1.0)
+        # The group's bucket is empty, so its last two messages wait for it to refill
+        self.assertEqual(self.queue.pending(), 2)
+        self.assertFalse(any(future.done() for future in group[GROUP_BURST:]))
+
+
+class OutageTest(unittest.TestCase):
+    def setUp(self) -> None:
+        timeout = rate_limiter.QUEUED_CALL_TIMEOUT_SECONDS
+        rate_limiter.QUEUED_CALL_TIMEOUT_SECONDS = 0.2
+        self.addCleanup(setattr, rate_limiter, "QUEUED_CALL_TIMEOUT_SECONDS", timeout)
+        self.attempts = 0
+
+    def test_call_held_by_an_open_circuit_fails_at_its_deadline(self) -> None:
+        queue = OutboundQueue(lambda method, params: {"ok": True}, workers=1, breaker=HeldBreaker())
+        future = queue.submit("sendMessage", {"chat_id": 42, "text": "dm"}, PRIORITY_URGENT)
+
+        with self.assertRaises(CircuitOpenError):
+            future.result(timeout=5)
+        self.assertEqual(queue.pending(), 0)
+
+    def test_call_rejected_by_the_circuit_is_not_requeued_forever(self) -> None:
+        def send(method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+            self.attempts += 1
+            raise CircuitOpenError("telegram", 0.01)
+
+        queue = OutboundQueue(send, workers=1)
+        future = queue.submit("sendMessage", {"chat_id": 42, "text": "dm"}, PRIORITY_URGENT)
+
+        with self.assertRaises(CircuitOpenError):
+            future.result(timeout=5)
+        self.assertGreater(self.attempts, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Update coordination between processes: poller election, the claim inbox and lease handover.
+
+Each dispatcher with its own coordinator on a shared database file stands
+in for one replica of the app.
+
+    python -m pytest tests/test_update_coordinator.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_coordinator import UpdateCoordinator
+from update_dispatcher import UpdateDispatcher
+
+
+VOLUNTEER_ID = 424242
+
+
+def start_update(update_id: int, request_id: str) -> Dict[str, Any]:
+    """Build the update Telegram delivers when a volunteer sends "/start <request_id>"."""
+    chat = {"id": VOLUNTEER_ID, "type": "private", "first_name": "Volunteer", "username": "volunteer"}
+    return {"update_id": update_id, "message": {"message_id": 1000 + update_id, "date": int(time.time()),
+                                                "chat": chat, "from": dict(chat, is_bot=False),
+                                                "text": f"/start {request_id}"}}
+
+
+def wait_until(predicate, timeout: float = 10.0) -> bool:
+    """Poll a condition until it holds or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+class FakeUpdates:
+    """The getUpdates stream of one bot token, shared by all replicas."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updates: List[Dict[str, Any]] = []
+
+    def add(self, update: Dict[str, Any]) -> None:
+        with self.lock:
+            self.updates.append(update)
+
+    def fetcher(self, calls: List[Optional[int]]):
+        """Return a fetch_updates function for one replica that records the offsets it polled with."""
+        def fetch_updates(offset: Optional[int], timeout: int, deadline: Optional[float]) -> Dict[str, Any]:
+            calls.append(offset)
+            # A short stand-in for the long poll
+            time.sleep(0.05)
+            with self.lock:
+                result = [update for update in self.updates if offset is None or update["update_id"] >= offset]
+            return {"ok": True, "result": result}
+
+        return fetch_updates
+
+
+class CoordinatedDispatcherTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.path = os.path.join(tempfile.mkdtemp(), "coordination.db")
+        self.token = f"test:{uuid.uuid4().hex}"
+        self.stream = FakeUpdates()
+
+    def replica(self) -> tuple:
+        """Start one replica; returns its dispatcher and the offsets it polled getUpdates with."""
+        coordinator = UpdateCoordinator(self.path, self.token)
+        calls: List[Optional[int]] = []
+        dispatcher = UpdateDispatcher(self.stream.fetcher(calls), coordinator)
+
+        def stop() -> None:
+            with dispatcher._lock:
+                request_ids = list(dispatcher._waiters)
+            for request_id in request_ids:
+                dispatcher.cancel(request_id)
+                dispatcher.unregister(request_id)
+            wait_until(lambda: dispatcher._thread is None)
+            coordinator.close()
+
+        self.addCleanup(stop)
+        return dispatcher, calls
+
+    def test_exactly_one_replica_polls(self) -> None:
+        first, first_calls = self.replica()
+        second, second_calls = self.replica()
+        first.register("req-a", timeout=5)
+        second.register("req-b", timeout=5)
+
+        self.assertTrue(wait_until(lambda: first_calls or second_calls))
+        time.sleep(0.5)
+        self.assertEqual(sum(1 for calls in (first_calls, second_calls) if calls), 1)
+
+    def test_claim_fetched_by_the_poller_reaches_the_other_replica(self) -> None:
+        poller, poller_calls = self.replica()
+        other, other_calls = self.replica()
+        poller.register("req-a", timeout=5)
+        self.assertTrue(wait_until(lambda: poller_calls))
+
+        self.stream.add(start_update(1, "req-b"))
+        user_info = other.wait_for_claim("req-b", timeout=5)
+
+        self.assertIsNotNone(user_info)
+        self.assertEqual(user_info["id"], VOLUNTEER_ID)
+        self.assertEqual(other_calls, [])
+
+
+class LeaseTest(unittest.TestCase):
+    def setUp(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(), "coordination.db")
+        token = f"test:{uuid.uuid4().hex}"
+        self.first = UpdateCoordinator(path, token, lease_seconds=0.2)
+        self.second = UpdateCoordinator(path, token, lease_seconds=0.2)
+        self.addCleanup(self.first.close)
+        self.addCleanup(self.second.close)
+
+    def test_lease_moves_once_the_poller_stops_renewing(self) -> None:
+        self.assertTrue(self.first.acquire())
+        self.assertTrue(self.first.save_offset(42))
+        self.assertFalse(self.second.acquire())
+
+        time.sleep(0.3)
+
+        self.assertTrue(self.second.acquire())
+        # The new poller continues from the offset the old one acknowledged
+        self.assertEqual(self.second.offset, 42)
+        self.assertFalse(self.first.save_offset(43))
+        self.assertFalse(self.first.acquire())
+
+    def test_released_lease_is_taken_over_right_away(self) -> None:
+        self.assertTrue(self.first.acquire())
+        self.first.release()
+
+        self.assertTrue(self.second.acquire())
+
+    def test_first_claim_of_a_request_wins_across_replicas(self) -> None:
+        first_claim = self.first.post_claim("req-a", {"id": 1, "first_name": "First"})
+        second_claim = self.second.post_claim("req-a", {"id": 2, "first_name": "Second"})
+
+        self.assertEqual(first_claim["id"], 1)
+        self.assertEqual(second_claim["id"], 1)
+        self.assertEqual(self.second.claims_for(["req-a", "req-b"]), {"req-a": first_claim})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Update dispatcher: routing /start claims from one getUpdates stream to the waiting requests.
+
+    python -m pytest tests/test_update_dispatcher.py
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_dispatcher import UpdateDispatcher
+
+
+def start_update(update_id: int, request_id: str, user_id: int, first_name: str) -> Dict[str, Any]:
+    """Build the update Telegram delivers when a volunteer sends "/start <request_id>"."""
+    chat = {"id": user_id, "type": "private", "first_name": first_name, "username": first_name.lower()}
+    return {"update_id": update_id, "message": {"message_id": 1000 + update_id, "date": int(time.time()),
+                                                "chat": chat, "from": dict(chat, is_bot=False),
+                                                "text": f"/start {request_id}"}}
+
+
+class FakeUpdates:
+    """A getUpdates stream that hands out the updates added to it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updates: List[Dict[str, Any]] = []
+
+    def add(self, update: Dict[str, Any]) -> None:
+        with self.lock:
+            self.updates.append(update)
+
+    def fetch_updates(self, offset: Optional[int], timeout: int, deadline: Optional[float]) -> Dict[str, Any]:
+        # A short stand-in for the long poll
+        time.sleep(0.02)
+        with self.lock:
+            result = [update for update in self.updates if offset is None or update["update_id"] >= offset]
+        return {"ok": True, "result": result}
+
+
+class UpdateDispatcherTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.stream = FakeUpdates()
+        self.dispatcher = UpdateDispatcher(self.stream.fetch_updates)
+
+    def test_concurrent_waiters_each_get_their_own_claim(self) -> None:
+        claims: Dict[str, Optional[Dict[str, Any]]] = {}
+
+        def wait(request_id: str) -> None:
+            claims[request_id] = self.dispatcher.wait_for_claim(request_id, timeout=5)
+            self.dispatcher.unregister(request_id)
+
+        threads = [threading.Thread(target=wait, args=(request_id,)) for request_id in ("req-a", "req-b")]
+        for thread in threads:
+            thread.start()
+        self.stream.add(start_update(1, "req-b", 2, "Bea"))
+        self.stream.add(start_update(2, "req-a", 1, "Ann"))
+        # A later /start for a claimed request does not replace the first volunteer
+        self.stream.add(start_update(3, "req-a", 3, "Cid"))
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(claims["req-a"]["first_name"], "Ann")
+        self.assertEqual(claims["req-b"]["first_name"], "Bea")
+
+    def test_claim_before_the_wait_is_buffered(self) -> None:
+        self.assertFalse(self.dispatcher.dispatch(start_update(1, "req-a", 1, "Ann")))
+
+        started = time.monotonic()
+        user_info = self.dispatcher.wait_for_claim("req-a", timeout=5)
+        self.dispatcher.unregister("req-a")
+
+        self.assertEqual(user_info["first_name"], "Ann")
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_unclaimed_wait_times_out(self) -> None:
+        self.stream.add(start_update(1, "req-b", 2, "Bea"))
+
+        self.assertIsNone(self.dispatcher.wait_for_claim("req-a", timeout=0.2))
+        self.dispatcher.unregister("req-a")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Webhook ingestion with the asyncio bot.
+
+Runs the async workflow against the fake Bot API with the token switched
+to webhook mode, and claims the request by POSTing the /start update to
+the webhook receiver the way Telegram would.
+
+    python -m pytest tests/test_webhook.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_bot import AsyncTelegramPickupBot, AsyncTelegramTransport
+from fake_telegram_server import FakeTelegramServer
+from request_store import STATE_FULFILLED, RequestStore
+from update_dispatcher import get_dispatcher
+from webhook_server import replay_updates, start_webhook_mode
+
+
+GROUP_CHAT_ID = "-1001234567890"
+VOLUNTEER_ID = 424242
+SECRET = "webhook-test-secret"
+
+
+def start_update(request_id: str, update_id: int) -> Dict[str, Any]:
+    """Build the update Telegram posts when a volunteer sends "/start <request_id>"."""
+    chat = {"id": VOLUNTEER_ID, "type": "private", "first_name": "Volunteer", "username": "volunteer"}
+    return {
+        "update_id": update_id,
+        "message": {"message_id": 1000 + update_id, "date": int(time.time()), "chat": chat,
+                    "from": dict(chat, is_bot=False), "text": f"/start {request_id}"}
+    }
+
+
+class AsyncWebhookTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = FakeTelegramServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.db_path = os.path.join(tempfile.mkdtemp(), "requests.db")
+        self.store = RequestStore(self.db_path)
+        self.addCleanup(self.store.close)
+        # Dispatchers are per token and process, a fresh token keeps the tests apart
+        self.token = f"test:{uuid.uuid4().hex}"
+        self.bot = AsyncTelegramPickupBot(self.token, GROUP_CHAT_ID, store=self.store,
+                                          transport=AsyncTelegramTransport(base_url=self.server.base_url))
+        self.webhook = start_webhook_mode(self.bot, public_url="https://example.org/telegram/webhook",
+                                          secret_token=SECRET, host="127.0.0.1", port=0)
+        self.addCleanup(self.webhook.stop)
+
+    def run_workflow(self, wait_minutes: float) -> Dict[str, Any]:
+        """Start the workflow on the background loop and return its outcome holder once the request is posted."""
+        outcome: Dict[str, Any] = {"posted": threading.Event(), "request_ids": []}
+
+        def on_status(request_id: str, state: str) -> None:
+            outcome["request_ids"].append(request_id)
+            outcome["posted"].set()
+
+        def run() -> None:
+            try:
+                outcome["result"] = self.bot.run_pickup_workflow_blocking(
+                    location="Otaniemi", date="Today", pick_up_time="14:00 - 16:00", contact_number="0401234567",
+                    remarks="", wait_minutes=wait_minutes, on_status=on_status)
+            except Exception as e:
+                outcome["error"] = e
+
+        outcome["thread"] = threading.Thread(target=run, daemon=True)
+        outcome["thread"].start()
+        self.assertTrue(outcome["posted"].wait(10), "the request was never posted")
+        return outcome
+
+    def test_claim_arrives_through_the_webhook(self) -> None:
+        outcome = self.run_workflow(wait_minutes=1)
+        request_id = outcome["request_ids"][0]
+
+        statuses = replay_updates(self.webhook.url, SECRET, [start_update(request_id, 1)])
+        self.assertEqual(statuses, [(1, 200)])
+
+        outcome["thread"].join(10)
+        self.assertNotIn("error", outcome)
+        self.assertIs(outcome["result"], True)
+        self.assertEqual(self.store.get_request(request_id)["state"], STATE_FULFILLED)
+        self.assertEqual(self.server.calls["setWebhook"], 1)
+        # Telegram answers getUpdates with 409 while a webhook is set
+        self.assertEqual(self.server.calls["getUpdates"], 0)
+
+    def test_no_poll_loop_while_waiting(self) -> None:
+        outcome = self.run_workflow(wait_minutes=0.02)
+        dispatcher = get_dispatcher(self.token, self.bot.get_bot_updates)
+        self.assertFalse(dispatcher.polling)
+
+        outcome["thread"].join(10)
+        self.assertNotIn("error", outcome)
+        self.assertIs(outcome["result"], False)
+        self.assertEqual(self.server.calls["getUpdates"], 0)
+
+    def test_rejects_updates_without_the_secret(self) -> None:
+        outcome = self.run_workflow(wait_minutes=0.02)
+        request_id = outcome["request_ids"][0]
+
+        statuses = replay_updates(self.webhook.url, "wrong-secret", [start_update(request_id, 1)])
+        self.assertEqual(statuses, [(1, 403)])
+
+        outcome["thread"].join(10)
+        self.assertIs(outcome["result"], False)
+
+
+if __name__ == "__main__":
+    unittest.main()
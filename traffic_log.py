@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Version of the log format, written to the header line
+FORMAT_VERSION = 1
+
+# A log is a JSON line per entry. Each start of the app writes a header with
+# the format version and the Unix time the session started; every other line
+# is one Bot API call with these keys:
+#   t   seconds since the start of the recording, when the response arrived
+#   m   Bot API method
+#   p   parameters of the call
+#   ms  duration of the HTTP round trip in milliseconds
+#   s   HTTP status, missing if the call raised
+#   e   error_code of a failed API result
+#   x   exception class name if the call raised
+#   u   updates returned by getUpdates as the bot decoded them; batches
+#       without a claim are reduced to their last update ID by the
+#       getUpdates decoder, so only that ID is kept of them
+
+# Phone numbers are written with at least 9 digits; request IDs have 8 characters
+PHONE_PATTERN = re.compile(r"\+?\d(?:[\s().-]*\d){8,}")
+TOKEN_PATTERN = re.compile(r"\d{5,}:[A-Za-z0-9_-]{30,}")
+
+# Free-text fields in which phone numbers are searched
+TEXT_KEYS = frozenset(("text", "caption"))
+# Fields replaced as a whole
+SECRET_KEYS = {"phone_number": "[phone]", "secret_token": "[secret]", "vcard": "[vcard]"}
+
+
+def redact(value: Any, key: Optional[str] = None) -> Any:
+    """
+    Remove phone numbers and bot tokens from a Bot API payload.
+
+    Args:
+        value: Parameters, result or update of a call, or any value inside one
+        key: Name of the field holding the value
+
+    Returns:
+        A redacted copy of the value
+    """
+    if key in SECRET_KEYS:
+        return SECRET_KEYS[key]
+    if isinstance(value, dict):
+        return {name: redact(item, name) for name, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        value = TOKEN_PATTERN.sub("[token]", value)
+        if key in TEXT_KEYS:
+            value = PHONE_PATTERN.sub("[phone]", value)
+    return value
+
+
+class TrafficRecorder:
+    def __init__(self, path: str):
+        """
+        Open a traffic log for appending.
+
+        Args:
+            path: Path of the log file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        # Line buffering keeps the log readable while the app is running
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._write({"v": FORMAT_VERSION, "started": round(time.time(), 3)})
+
+    def record_call(self, method: str, params: Optional[Dict[str, Any]], seconds: float,
+                    status: Optional[int] = None, result: Optional[Dict[str, Any]] = None,
+                    error: Optional[Exception] = None) -> None:
+        """
+        Append one Bot API call to the log.
+
+        Recording must never break a call, so failures are only printed.
+
+        Args:
+            method: Bot API method
+            params: Parameters of the call
+            seconds: Duration of the HTTP round trip
+            status: HTTP status of the response, None if the call raised
+            result: Response as decoded by the transport, None if it could not be decoded
+            error: Exception raised by the call
+        """
+        try:
+            entry: Dict[str, Any] = {
+                "t": round(time.monotonic() - self._started, 3),
+                "m": method,
+                "p": redact(params or {}),
+                "ms": round(seconds * 1000, 1)
+            }
+            if error is not None:
+                entry["x"] = type(error).__name__
+            if status is not None:
+                entry["s"] = status
+            if isinstance(result, dict):
+                if not result.get("ok"):
+                    entry["e"] = result.get("error_code")
+                elif method == "getUpdates":
+                    entry["u"] = redact(result.get("result", []))
+            self._write(entry)
+        except Exception as e:
+            print(f"Failed to record {method} call: {e}")
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        """Append a line to the log."""
+        line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        """Close the log file."""
+        with self._lock:
+            self._file.close()
+
+
+def read_session(path: str, session: int = 0) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Load one recording session from a traffic log.
+
+    Every start of the app appends a new header to the log, and the times of
+    its entries start at 0 again, so sessions are replayed one at a time.
+
+    Args:
+        path: Path of the log file
+        session: Index of the session, 0 for the first one
+
+    Returns:
+        Tuple of (header, entries in recording order)
+
+    Raises:
+        ValueError: If the file holds no such session of a known format version
+    """
+    header: Optional[Dict[str, Any]] = None
+    entries: List[Dict[str, Any]] = []
+    index = -1
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if "v" in entry:
+                index += 1
+                if index > session:
+                    break
+                header = entry
+            elif index == session:
+                entries.append(entry)
+
+    if header is None or index < session:
+        raise ValueError(f"{path} has no session {session}")
+    if header["v"] != FORMAT_VERSION:
+        raise ValueError(f"Session {session} of {path} has format version {header['v']}, expected {FORMAT_VERSION}")
+    return header, entries
+
+
+_recorder: Optional[TrafficRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_traffic_recorder() -> Optional[TrafficRecorder]:
+    """
+    Get the process-wide traffic recorder if recording is switched on.
+
+    Recording is opt-in: PICKUP_TRAFFIC_LOG names the log file.
+
+    Returns:
+        The shared recorder, None if PICKUP_TRAFFIC_LOG is not set
+    """
+    global _recorder
+    path = os.environ.get("PICKUP_TRAFFIC_LOG")
+    if not path:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = TrafficRecorder(path)
+        return _recorder
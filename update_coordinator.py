@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+
+# The poller lease runs out this long after its last renewal, in seconds. It
+# is renewed before every getUpdates call, so it has to outlast a long poll.
+LEASE_SECONDS = 45
+
+# Longest getUpdates timeout of the elected poller, in seconds
+COORDINATED_POLL_TIMEOUT = 20
+
+# How often processes that do not poll look for claims in the inbox, in seconds
+INBOX_POLL_SECONDS = 0.25
+
+# Claims are kept in the inbox this long, so late registrations still find them
+INBOX_RETENTION_SECONDS = 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS poller_lease (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    update_offset INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS claim_inbox (
+    name TEXT NOT NULL,
+    request_id TEXT NOT NULL,
+    user_info TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (name, request_id)
+);
+CREATE INDEX IF NOT EXISTS idx_claim_inbox_created ON claim_inbox (created_at);
+"""
+
+_SELECT_LEASE = "SELECT owner, expires_at, update_offset FROM poller_lease WHERE name = ?"
+_INSERT_LEASE = "INSERT INTO poller_lease (name, owner, expires_at, update_offset) VALUES (?, ?, ?, NULL)"
+_TAKE_LEASE = "UPDATE poller_lease SET owner = ?, expires_at = ? WHERE name = ?"
+_SAVE_OFFSET = "UPDATE poller_lease SET update_offset = ?, expires_at = ? WHERE name = ? AND owner = ?"
+_RELEASE_LEASE = "UPDATE poller_lease SET expires_at = 0 WHERE name = ? AND owner = ?"
+# The primary key keeps the first claim of a request, whichever process stored it
+_INSERT_CLAIM = "INSERT OR IGNORE INTO claim_inbox (name, request_id, user_info, created_at) VALUES (?, ?, ?, ?)"
+_SELECT_CLAIM = "SELECT user_info FROM claim_inbox WHERE name = ? AND request_id = ?"
+_PURGE_CLAIMS = "DELETE FROM claim_inbox WHERE created_at < ?"
+
+# Request IDs looked up per inbox query
+_MAX_LOOKUP = 500
+
+
+class UpdateCoordinator:
+    def __init__(self, path: str, token: str, lease_seconds: float = LEASE_SECONDS):
+        """
+        Open (and create if needed) the coordination database shared by all processes of a bot.
+
+        Telegram allows one getUpdates consumer per token. The processes
+        elect it through a lease in the database: the holder polls and stores
+        every claim in the inbox, the other processes read the claims of
+        their waiting requests from there.
+
+        Args:
+            path: Path of the SQLite database file, on storage all processes can reach
+            token: Telegram bot API token, only a hash of it is stored
+            lease_seconds: Seconds the lease stays valid after its last renewal
+        """
+        self.path = path
+        self.name = hashlib.sha256(token.encode()).hexdigest()[:16]
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        # Offset of the next update to fetch, as acknowledged by the last poller
+        self.offset: Optional[int] = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def acquire(self) -> bool:
+        """
+        Take the poller lease if it is free or expired, or renew it if held.
+
+        Leases expire by wall-clock time, since monotonic clocks are not
+        comparable between processes.
+
+        Returns:
+            True if this process is the poller now, False otherwise
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(_SELECT_LEASE, (self.name,)).fetchone()
+                if row is None:
+                    self._conn.execute(_INSERT_LEASE, (self.name, self.owner, now + self.lease_seconds))
+                    offset = None
+                elif row[0] == self.owner or row[1] < now:
+                    if row[0] != self.owner:
+                        print(f"Taking over update polling from {row[0]}")
+                        self._conn.execute(_PURGE_CLAIMS, (now - INBOX_RETENTION_SECONDS,))
+                    self._conn.execute(_TAKE_LEASE, (self.owner, now + self.lease_seconds, self.name))
+                    offset = row[2]
+                else:
+                    self._conn.execute("COMMIT")
+                    return False
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.offset = offset
+        return True
+
+    def save_offset(self, offset: Optional[int]) -> bool:
+        """
+        Record the offset after a batch of updates and renew the lease.
+
+        Args:
+            offset: Offset of the next update to fetch
+
+        Returns:
+            True if this process still held the lease, False otherwise
+        """
+        with self._lock:
+            cursor = self._conn.execute(_SAVE_OFFSET, (offset, time.time() + self.lease_seconds, self.name, self.owner))
+        if cursor.rowcount:
+            self.offset = offset
+        return cursor.rowcount > 0
+
+    def release(self) -> None:
+        """Give up the lease so another process can poll right away."""
+        with self._lock:
+            self._conn.execute(_RELEASE_LEASE, (self.name, self.owner))
+
+    def post_claim(self, request_id: str, user_info: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Store a claim in the inbox unless the request was claimed before.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            user_info: Dictionary containing user information
+
+        Returns:
+            User info of the first volunteer who claimed the request
+        """
+        with self._lock:
+            self._conn.execute(_INSERT_CLAIM, (self.name, request_id, json.dumps(user_info), time.time()))
+            row = self._conn.execute(_SELECT_CLAIM, (self.name, request_id)).fetchone()
+        return json.loads(row[0])
+
+    def claims_for(self, request_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Look up the claims of waiting requests in the inbox.
+
+        Args:
+            request_ids: IDs of the requests waiting in this process
+
+        Returns:
+            User info of the first volunteer by request ID, for the claimed requests only
+        """
+        claims: Dict[str, Dict[str, Any]] = {}
+        # Chunked to stay below SQLite's limit of bound parameters
+        for start in range(0, len(request_ids), _MAX_LOOKUP):
+            chunk = list(request_ids[start:start + _MAX_LOOKUP])
+            query = (f"SELECT request_id, user_info FROM claim_inbox "
+                     f"WHERE name = ? AND request_id IN ({','.join('?' * len(chunk))})")
+            with self._lock:
+                rows = self._conn.execute(query, [self.name] + chunk).fetchall()
+            claims.update((request_id, json.loads(user_info)) for request_id, user_info in rows)
+        return claims
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def create_coordinator(token: str) -> Optional[UpdateCoordinator]:
+    """
+    Create a coordinator for a bot token if coordination is configured.
+
+    Coordination is switched on by pointing PICKUP_COORDINATION_DB at a
+    database file shared by all replicas. Every dispatcher needs its own
+    coordinator, since each one competes for the lease on its own.
+
+    Args:
+        token: Telegram bot API token
+
+    Returns:
+        The coordinator, None if PICKUP_COORDINATION_DB is not set
+    """
+    path = os.environ.get("PICKUP_COORDINATION_DB")
+    return UpdateCoordinator(path, token) if path else None
@@ -0,0 +1,482 @@
+import asyncio
+import json
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Any, Tuple
+
+from telegram_transport import decode_response
+from update_coordinator import COORDINATED_POLL_TIMEOUT, INBOX_POLL_SECONDS, UpdateCoordinator, create_coordinator
+
+
+# How many /start claims for request IDs nobody is waiting for (yet) are kept
+UNCLAIMED_BUFFER_SIZE = 256
+
+# Longest long-poll timeout sent to getUpdates, in seconds
+LONG_POLL_TIMEOUT = 30
+
+# Pause after a failed poll before trying again, in seconds
+ERROR_BACKOFF_SECONDS = 2
+
+# Update types the bot handles; claims arrive as private messages
+ALLOWED_UPDATES = ("message",)
+# getUpdates and setWebhook take the list JSON-encoded
+ALLOWED_UPDATES_PARAM = json.dumps(list(ALLOWED_UPDATES))
+
+# A claim is a "/start <request_id>" message; JSON encoders may escape the slash
+_CLAIM_MARKERS = (b"/start ", b"\\/start ")
+_OK_RESPONSE = re.compile(rb'\s*\{\s*"ok"\s*:\s*true\s*,')
+_UPDATE_ID_KEY = b'"update_id"'
+_UPDATE_ID_VALUE = re.compile(rb'\s*:\s*(\d+)')
+_JSON_WHITESPACE = b" \t\r\n"
+
+
+def long_poll_timeout(deadlines: List[float], now: float) -> int:
+    """
+    Work out the getUpdates timeout that ends with the latest waiting request.
+
+    Args:
+        deadlines: Monotonic deadlines of the waiting requests
+        now: Current monotonic time
+
+    Returns:
+        Long-poll timeout in whole seconds, 0 if every wait has ended
+    """
+    if not deadlines:
+        return 0
+    remaining = max(deadlines) - now
+    if remaining <= 0:
+        return 0
+    return min(LONG_POLL_TIMEOUT, math.ceil(remaining))
+
+
+def parse_start_update(update: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Extract a "/start <request_id>" claim from a private message update.
+
+    Args:
+        update: A single update object as returned by getUpdates
+
+    Returns:
+        Tuple of (request ID, user info) if the update is a claim, None otherwise
+    """
+    message = update.get("message")
+    if not message or "chat" not in message:
+        return None
+
+    chat = message["chat"]
+    if chat.get("type") != "private":
+        return None
+
+    text = message.get("text", "")
+    if not text.startswith("/start"):
+        return None
+
+    message_parts = text.split()
+    if len(message_parts) < 2:
+        return None
+
+    request_id = message_parts[1]
+    user_info = {
+        "id": chat["id"],
+        "first_name": chat.get("first_name", "User"),
+        "username": chat.get("username", ""),
+        "message_id": message.get("message_id"),
+        "request_id": request_id,
+        # Unix time of the /start click, used for latency reporting
+        "claimed_at": message.get("date", time.time()),
+        # Unix time the bot saw the click
+        "detected_at": time.time()
+    }
+    return request_id, user_info
+
+
+def _last_update_id(body: bytes) -> Optional[int]:
+    """Find the ID of the last update in a raw getUpdates body without decoding it."""
+    end = len(body)
+    while True:
+        start = body.rfind(_UPDATE_ID_KEY, 0, end)
+        if start < 0:
+            return None
+        # A key follows { or , while the same text inside a string follows an escaping backslash
+        before = start - 1
+        while before >= 0 and body[before] in _JSON_WHITESPACE:
+            before -= 1
+        match = _UPDATE_ID_VALUE.match(body, start + len(_UPDATE_ID_KEY))
+        if before >= 0 and body[before] in b"{," and match is not None:
+            return int(match.group(1))
+        end = start
+
+
+def decode_updates(status: int, body: bytes) -> Dict[str, Any]:
+    """
+    Decode a getUpdates response, skipping batches that cannot hold a claim.
+
+    Most updates are group chatter. A batch without a "/start " anywhere in
+    its raw body is not decoded; it is reduced to its last update ID, which
+    is all the poll loop needs to acknowledge the whole batch.
+
+    Args:
+        status: HTTP status code of the response
+        body: Raw body of the response
+
+    Returns:
+        Decoded JSON response of the API; a skipped batch holds one update with only an update_id
+    """
+    if status == 200 and _OK_RESPONSE.match(body) and not any(marker in body for marker in _CLAIM_MARKERS):
+        last_update_id = _last_update_id(body)
+        return {"ok": True, "result": [] if last_update_id is None else [{"update_id": last_update_id}]}
+    return decode_response(status, body)
+
+
+class RequestCancelled(Exception):
+    """Raised by wait_for_claim when the donor withdrew the request."""
+
+    def __init__(self, request_id: str):
+        super().__init__(f"Request {request_id} was cancelled")
+        self.request_id = request_id
+
+
+class _Waiter:
+    """A pickup request waiting for its first volunteer."""
+
+    __slots__ = ("event", "user_info", "deadline", "cancelled", "listeners")
+
+    def __init__(self, deadline: float):
+        self.event = threading.Event()
+        self.user_info: Optional[Dict[str, Any]] = None
+        self.deadline = deadline
+        self.cancelled = False
+        # Called once the request is claimed or cancelled, e.g. to wake an event loop
+        self.listeners: List[Callable[[], None]] = []
+
+    def wake(self) -> None:
+        """Wake everyone waiting for the request."""
+        self.event.set()
+        for listener in self.listeners:
+            listener()
+
+
+class UpdateDispatcher:
+    def __init__(self, fetch_updates: Callable[[Optional[int], int, Optional[float]], Dict[str, Any]],
+                 coordinator: Optional[UpdateCoordinator] = None):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            fetch_updates: Function performing one getUpdates call for a given offset, long-poll timeout
+                and monotonic deadline for retries
+            coordinator: Elects one poller among several processes and shares their claims, None for a single process
+        """
+        self._fetch_updates = fetch_updates
+        self.coordinator = coordinator
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, _Waiter] = {}
+        self._unclaimed: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Requests cancelled while they were not waiting, e.g. during the group post
+        self._cancelled: "OrderedDict[str, None]" = OrderedDict()
+        # Requests that stopped waiting because a volunteer claimed them; they can no longer be cancelled
+        self._claimed: "OrderedDict[str, None]" = OrderedDict()
+        self._offset: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        # False while updates are pushed to dispatch() by a webhook receiver
+        self.polling = True
+
+    def register(self, request_id: str, timeout: float = LONG_POLL_TIMEOUT) -> None:
+        """
+        Start listening for claims of a request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            timeout: Number of seconds the request will wait for a claim
+        """
+        self._register(request_id, timeout)
+
+    def _register(self, request_id: str, timeout: float, listener: Optional[Callable[[], None]] = None) -> _Waiter:
+        """Register a request and return its waiter; the listener is called once it is claimed or cancelled."""
+        with self._lock:
+            waiter = self._waiters.get(request_id)
+            if waiter is None:
+                waiter = _Waiter(time.monotonic() + timeout)
+                # A volunteer may have been faster than the registration
+                user_info = self._unclaimed.pop(request_id, None)
+                if request_id in self._cancelled:
+                    del self._cancelled[request_id]
+                    waiter.cancelled = True
+                    waiter.event.set()
+                elif user_info is not None:
+                    waiter.user_info = user_info
+                    waiter.event.set()
+                self._waiters[request_id] = waiter
+                self._ensure_polling()
+            if listener is not None:
+                waiter.listeners.append(listener)
+                if waiter.event.is_set():
+                    listener()
+            return waiter
+
+    def unregister(self, request_id: str) -> None:
+        """
+        Stop listening for claims of a request.
+
+        Args:
+            request_id: The unique ID of the pickup request
+        """
+        with self._lock:
+            waiter = self._waiters.pop(request_id, None)
+            if waiter is not None and waiter.user_info is not None:
+                self._claimed[request_id] = None
+                while len(self._claimed) > UNCLAIMED_BUFFER_SIZE:
+                    self._claimed.popitem(last=False)
+
+    def wait_for_claim(self, request_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Block until a volunteer claims the request or the timeout expires.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            User info of the volunteer if the request was claimed, None otherwise
+
+        Raises:
+            RequestCancelled: If cancel() was called for the request
+        """
+        waiter = self._register(request_id, timeout)
+        waiter.event.wait(timeout)
+        if waiter.cancelled:
+            raise RequestCancelled(request_id)
+        return waiter.user_info
+
+    async def wait_for_claim_async(self, request_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait on the running event loop until a volunteer claims the request or the timeout expires.
+
+        Works like wait_for_claim() without blocking a thread, so the asyncio
+        bot shares the poller, and the webhook ingestion, of its token.
+
+        Args:
+            request_id: The unique ID of the pickup request
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            User info of the volunteer if the request was claimed, None otherwise
+
+        Raises:
+            RequestCancelled: If cancel() was called for the request
+        """
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+
+        def resolve() -> None:
+            if not woken.done():
+                woken.set_result(None)
+
+        # Claims arrive on the poll thread or the webhook receiver, so the loop is woken thread-safely
+        waiter = self._register(request_id, timeout, lambda: loop.call_soon_threadsafe(resolve))
+        try:
+            await asyncio.wait_for(woken, timeout)
+        except asyncio.TimeoutError:
+            pass
+        if waiter.cancelled:
+            raise RequestCancelled(request_id)
+        return waiter.user_info
+
+    def cancel(self, request_id: str) -> bool:
+        """
+        Withdraw a request, waking its wait_for_claim() with RequestCancelled.
+
+        A request that is not waiting right now is cancelled as soon as it
+        registers, unless it stopped waiting because a volunteer claimed it.
+
+        Args:
+            request_id: The unique ID of the pickup request
+
+        Returns:
+            True if the request was cancelled, False if a volunteer had already claimed it
+        """
+        with self._lock:
+            # A claim buffered before the registration counts as well, the volunteer expects the DM
+            if request_id in self._claimed or request_id in self._unclaimed:
+                return False
+            waiter = self._waiters.get(request_id)
+            if waiter is None:
+                self._cancelled[request_id] = None
+                while len(self._cancelled) > UNCLAIMED_BUFFER_SIZE:
+                    self._cancelled.popitem(last=False)
+                return True
+            if waiter.user_info is not None:
+                return False
+            waiter.cancelled = True
+        print(f"Request {request_id} cancelled")
+        waiter.wake()
+        return True
+
+    def dispatch(self, update: Dict[str, Any]) -> bool:
+        """
+        Hand a single update to the request waiting for it.
+
+        Args:
+            update: A single update object as returned by getUpdates
+
+        Returns:
+            True if the update was a claim delivered to a waiting request, False otherwise
+        """
+        claim = parse_start_update(update)
+        if claim is None:
+            return False
+
+        request_id, user_info = claim
+        if self.coordinator is not None:
+            # Another process may have seen an earlier claim of the same request
+            user_info = self.coordinator.post_claim(request_id, user_info)
+        return self._deliver(request_id, user_info)
+
+    def _deliver(self, request_id: str, user_info: Dict[str, Any]) -> bool:
+        """Hand a claim to the request waiting for it, or keep it for a later registration."""
+        with self._lock:
+            waiter = self._waiters.get(request_id)
+            if waiter is None:
+                self._unclaimed[request_id] = user_info
+                self._unclaimed.move_to_end(request_id)
+                while len(self._unclaimed) > UNCLAIMED_BUFFER_SIZE:
+                    self._unclaimed.popitem(last=False)
+                return False
+            # First claim wins, later /start clicks for the same request are ignored
+            if waiter.user_info is not None or waiter.cancelled:
+                return False
+            waiter.user_info = user_info
+
+        print(f"New user detected for request {request_id}: {user_info['first_name']}")
+        waiter.wake()
+        return True
+
+    def use_webhook(self) -> None:
+        """Stop polling; updates are handed to dispatch() by a webhook receiver from now on."""
+        with self._lock:
+            self.polling = False
+
+    def _ensure_polling(self) -> None:
+        """Start the poll thread if it is not running. Must be called with the lock held."""
+        # With a coordinator the thread also reads the inbox filled by other processes
+        if (self.polling or self.coordinator is not None) and self._thread is None:
+            self._thread = threading.Thread(target=self._poll_loop, name="telegram-update-dispatcher")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _poll_loop(self) -> None:
+        """Long-poll getUpdates while at least one request is still within its wait."""
+        while True:
+            with self._lock:
+                pending = {request_id: waiter.deadline for request_id, waiter in self._waiters.items()
+                           if waiter.user_info is None and not waiter.cancelled}
+                timeout = long_poll_timeout(list(pending.values()), time.monotonic())
+                if timeout == 0 or not (self.polling or self.coordinator is not None):
+                    self._thread = None
+                    break
+
+            deadline = None
+            if self.coordinator is not None:
+                if not self._coordinate(list(pending)):
+                    time.sleep(INBOX_POLL_SECONDS)
+                    continue
+                # Short polls keep the lease fresh and hand over quickly once this process is idle
+                timeout = min(timeout, COORDINATED_POLL_TIMEOUT)
+                # Retries must not outlast the lease, or a second poller could take over meanwhile
+                deadline = time.monotonic() + self.coordinator.lease_seconds
+
+            try:
+                updates = self._fetch_updates(self._offset, timeout, deadline)
+            except Exception as e:
+                print(f"Failed to get updates: {e}")
+                time.sleep(ERROR_BACKOFF_SECONDS)
+                continue
+
+            if updates.get("ok"):
+                for update in updates["result"]:
+                    # Update the offset to acknowledge this update
+                    self._offset = update["update_id"] + 1
+                    self.dispatch(update)
+                if self.coordinator is not None and not self._save_offset():
+                    # Another process polls now; its claims reach this one through the inbox
+                    time.sleep(INBOX_POLL_SECONDS)
+            else:
+                print(f"Failed to get updates: {updates}")
+                time.sleep(ERROR_BACKOFF_SECONDS)
+
+        if self.coordinator is not None:
+            self.coordinator.release()
+
+    def _save_offset(self) -> bool:
+        """
+        Store the offset for the next poller and renew the lease.
+
+        Returns:
+            True if this process still holds the lease, False if it lost it and must stop polling
+        """
+        try:
+            if self.coordinator.save_offset(self._offset):
+                return True
+            print("Lost the poller lease, stopping to poll getUpdates")
+        except Exception as e:
+            print(f"Failed to save the update offset, stopping to poll getUpdates: {e}")
+        # The next poller continues from the offset it finds in the database
+        self._offset = None
+        return False
+
+    def _coordinate(self, request_ids: List[str]) -> bool:
+        """
+        Deliver claims other processes stored in the inbox and compete for the poller lease.
+
+        Args:
+            request_ids: IDs of the requests still waiting in this process
+
+        Returns:
+            True if this process should poll getUpdates now, False otherwise
+        """
+        try:
+            for request_id, user_info in self.coordinator.claims_for(request_ids).items():
+                self._deliver(request_id, user_info)
+            if not self.polling or not self.coordinator.acquire():
+                return False
+        except Exception as e:
+            print(f"Failed to coordinate update polling: {e}")
+            return False
+        # Continue where the previous poller stopped
+        self._offset = self.coordinator.offset
+        return True
+
+
+_dispatchers: Dict[str, UpdateDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(token: str,
+                   fetch_updates: Callable[[Optional[int], int, Optional[float]], Dict[str, Any]]) -> UpdateDispatcher:
+    """
+    Get the process-wide dispatcher for a bot token, creating it on first use.
+
+    Telegram allows only one getUpdates consumer per token, so all bot
+    instances sharing a token must share a dispatcher: sync bots wait on it
+    with wait_for_claim, async bots with wait_for_claim_async, and the
+    webhook receiver feeds it in place of polling. When the app runs as
+    several processes, setting PICKUP_COORDINATION_DB makes their
+    dispatchers elect a single poller through that database.
+
+    Args:
+        token: Telegram bot API token
+        fetch_updates: Function performing one getUpdates call for a given offset, long-poll timeout
+            and monotonic deadline for retries
+
+    Returns:
+        The dispatcher owning the update stream of this token
+    """
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(token)
+        if dispatcher is None:
+            dispatcher = UpdateDispatcher(fetch_updates, create_coordinator(token))
+            _dispatchers[token] = dispatcher
+        return dispatcher
@@ -0,0 +1,363 @@
+import argparse
+import bisect
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+DEFAULT_REGISTRY_PATH = "user_data.json"
+
+# Pick-up windows offered to donors on page 2 of the app
+TIME_SLOTS = ("Before 14:00", "14:00 - 16:00", "16:00 - 18:00", "18:00 - 20:00", "20:00 - 22:00", "After 22:00")
+
+# Volunteers registered for this slot match every pick-up time
+ANY_SLOT = "Any time"
+
+# Locations and areas are matched by their words
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def area_keys(text: str) -> Set[str]:
+    """
+    Split a location or area name into the lowercase words it is indexed by.
+
+    Args:
+        text: Free-text location, e.g. "Otaniemi Campus, A-Block"
+
+    Returns:
+        Set of index keys
+    """
+    return set(_WORD_PATTERN.findall(text.lower()))
+
+
+class VolunteerRegistry:
+    def __init__(self, path: str = DEFAULT_REGISTRY_PATH):
+        """
+        Load the registry, creating an empty one if the file does not exist.
+
+        Args:
+            path: Path of the JSON file holding the volunteers
+        """
+        self.path = path
+        # Claims are appended here between full writes of the registry file
+        self.journal_path = f"{path}.claims"
+        self._lock = threading.Lock()
+        self._volunteers: Dict[int, Dict[str, Any]] = {}
+        # Precomputed indexes, so matching never scans all volunteers
+        self._by_area: Dict[str, Set[int]] = {}
+        self._by_slot: Dict[str, Set[int]] = {}
+        # Rank keys of the volunteers of each slot in ascending order, so the best are read from the front
+        self._ranked: Dict[str, List[Tuple[int, float, int]]] = {}
+        # Sequence number of the last journaled claim, and of the last one included in the registry file
+        self._claim_seq = 0
+        self._saved_seq = 0
+
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for volunteer in data.get("volunteers", []):
+                self._add(volunteer)
+            self._saved_seq = self._claim_seq = data.get("claim_seq", 0)
+        self._replay_journal()
+
+    def _replay_journal(self) -> None:
+        """Apply the claims journaled after the registry file was last written."""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    claim = json.loads(line)
+                except ValueError:
+                    # A line cut off by a crash
+                    continue
+                if claim["seq"] <= self._saved_seq:
+                    continue
+                self._claim_seq = max(self._claim_seq, claim["seq"])
+                self._count_claim(claim["id"], claim["at"])
+
+    def register(self, user_id: int, first_name: str, username: str = "", areas: Iterable[str] = (),
+                 slots: Iterable[str] = (ANY_SLOT,)) -> Dict[str, Any]:
+        """
+        Add a volunteer or replace their areas and availability.
+
+        Args:
+            user_id: Telegram ID of the volunteer
+            first_name: First name of the volunteer
+            username: Username of the volunteer
+            areas: Areas the volunteer can pick up in, e.g. ["Otaniemi", "Tapiola"]
+            slots: Entries of TIME_SLOTS the volunteer is available in, or ANY_SLOT
+
+        Returns:
+            The stored volunteer
+        """
+        with self._lock:
+            volunteer = self._register(user_id, first_name, username, areas, slots)
+            self._save()
+        return volunteer
+
+    def register_many(self, volunteers: Iterable[Dict[str, Any]]) -> int:
+        """
+        Register many volunteers at once, writing the file only once.
+
+        Args:
+            volunteers: Dictionaries with the arguments of register()
+
+        Returns:
+            Number of registered volunteers
+        """
+        count = 0
+        with self._lock:
+            for volunteer in volunteers:
+                self._register(**volunteer)
+                count += 1
+            self._save()
+        return count
+
+    def _register(self, user_id: int, first_name: str, username: str = "", areas: Iterable[str] = (),
+                  slots: Iterable[str] = (ANY_SLOT,)) -> Dict[str, Any]:
+        """Add or replace a volunteer without saving. Must be called with the lock held."""
+        slots = list(dict.fromkeys(slots))
+        unknown = [slot for slot in slots if slot not in TIME_SLOTS and slot != ANY_SLOT]
+        if unknown:
+            raise ValueError(f"Unknown time slots: {unknown}")
+
+        previous = self._remove(int(user_id))
+        volunteer = {
+            "id": int(user_id),
+            "first_name": first_name,
+            "username": username,
+            "areas": sorted(set().union(*(area_keys(area) for area in areas))) if areas else [],
+            "slots": slots,
+            "claims": previous["claims"] if previous else 0,
+            "last_claimed_at": previous["last_claimed_at"] if previous else None
+        }
+        self._add(volunteer)
+        return volunteer
+
+    def remove(self, user_id: int) -> bool:
+        """
+        Remove a volunteer.
+
+        Args:
+            user_id: Telegram ID of the volunteer
+
+        Returns:
+            True if the volunteer was registered, False otherwise
+        """
+        with self._lock:
+            removed = self._remove(int(user_id))
+            if removed:
+                self._save()
+        return removed is not None
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Return a registered volunteer, None if unknown."""
+        with self._lock:
+            return self._volunteers.get(int(user_id))
+
+    def find(self, location: str, pick_up_time: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Find the volunteers best matching a pickup request.
+
+        Volunteers available in the slot and registered for an area named in
+        the location rank first, then the remaining volunteers available in
+        the slot. Within a tier, volunteers with fewer claims come first so
+        the work is spread. The second tier is read from the front of the
+        pre-ranked slot lists, so the cost does not grow with the registry.
+
+        Args:
+            location: Free-text pickup location
+            pick_up_time: Entry of TIME_SLOTS chosen by the donor
+            limit: Maximum number of volunteers to return
+
+        Returns:
+            Matching volunteers, best first
+        """
+        with self._lock:
+            in_slot = self._by_slot.get(pick_up_time, set())
+            any_time = self._by_slot.get(ANY_SLOT, set())
+            nearby: Set[int] = set()
+            for key in area_keys(location):
+                nearby |= self._by_area.get(key, set())
+
+            # Area sets are small, so the best tier is found without touching the slot sets
+            best = {user_id for user_id in nearby if user_id in in_slot or user_id in any_time}
+            ranked = heapq.nsmallest(limit, best, key=self._rank_key)
+            if len(ranked) < limit:
+                # Volunteers registered for the slot and for any time are in both lists
+                seen = set(best)
+                for _, _, user_id in heapq.merge(self._ranked.get(pick_up_time, ()), self._ranked.get(ANY_SLOT, ())):
+                    if user_id in seen:
+                        continue
+                    seen.add(user_id)
+                    ranked.append(user_id)
+                    if len(ranked) >= limit:
+                        break
+            return [self._volunteers[user_id] for user_id in ranked]
+
+    def record_claim(self, user_id: int) -> None:
+        """
+        Count a claimed request for a volunteer, if registered.
+
+        Only one line is appended to the claims journal; the registry file
+        takes the claims in with its next full write.
+
+        Args:
+            user_id: Telegram ID of the volunteer
+        """
+        now = time.time()
+        with self._lock:
+            if not self._count_claim(int(user_id), now):
+                return
+            self._claim_seq += 1
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps({"seq": self._claim_seq, "id": int(user_id), "at": now}) + "\n")
+
+    def _count_claim(self, user_id: int, claimed_at: float) -> bool:
+        """Count a claim and move the volunteer down the rankings. Must be called with the lock held."""
+        volunteer = self._volunteers.get(user_id)
+        if volunteer is None:
+            return False
+        self._unrank(volunteer)
+        volunteer["claims"] += 1
+        volunteer["last_claimed_at"] = claimed_at
+        self._rank(volunteer)
+        return True
+
+    def clear(self) -> None:
+        """Remove all volunteers."""
+        with self._lock:
+            self._volunteers = {}
+            self._by_area = {}
+            self._by_slot = {}
+            self._ranked = {}
+            self._save()
+
+    def __len__(self) -> int:
+        return len(self._volunteers)
+
+    def _rank_key(self, user_id: int) -> Tuple[int, float, int]:
+        volunteer = self._volunteers[user_id]
+        return volunteer["claims"], volunteer["last_claimed_at"] or 0.0, user_id
+
+    def _rank(self, volunteer: Dict[str, Any]) -> None:
+        """Insert a volunteer into the ranked list of each of its slots. Must be called with the lock held."""
+        key = self._rank_key(volunteer["id"])
+        for slot in volunteer["slots"]:
+            bisect.insort(self._ranked.setdefault(slot, []), key)
+
+    def _unrank(self, volunteer: Dict[str, Any]) -> None:
+        """Remove a volunteer from the ranked lists of its slots. Must be called with the lock held."""
+        key = self._rank_key(volunteer["id"])
+        for slot in volunteer["slots"]:
+            ranked = self._ranked.get(slot)
+            if not ranked:
+                continue
+            index = bisect.bisect_left(ranked, key)
+            if index < len(ranked) and ranked[index] == key:
+                del ranked[index]
+            if not ranked:
+                del self._ranked[slot]
+
+    def _add(self, volunteer: Dict[str, Any]) -> None:
+        """Store a volunteer and index it. Must be called with the lock held or during init."""
+        user_id = volunteer["id"]
+        self._volunteers[user_id] = volunteer
+        for area in volunteer["areas"]:
+            self._by_area.setdefault(area, set()).add(user_id)
+        for slot in volunteer["slots"]:
+            self._by_slot.setdefault(slot, set()).add(user_id)
+        self._rank(volunteer)
+
+    def _remove(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Drop a volunteer and its index entries. Must be called with the lock held."""
+        volunteer = self._volunteers.get(user_id)
+        if volunteer is None:
+            return None
+        self._unrank(volunteer)
+        del self._volunteers[user_id]
+        for index, keys in ((self._by_area, volunteer["areas"]), (self._by_slot, volunteer["slots"])):
+            for key in keys:
+                members = index.get(key)
+                if members is not None:
+                    members.discard(user_id)
+                    if not members:
+                        del index[key]
+        return volunteer
+
+    def _save(self) -> None:
+        """Write the registry to its file atomically and drop the journal. Must be called with the lock held."""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"volunteers": list(self._volunteers.values()), "claim_seq": self._claim_seq}, f)
+        os.replace(temp_path, self.path)
+        self._saved_seq = self._claim_seq
+        # Claims up to claim_seq are in the file now; were the removal lost, replaying skips them
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+_registries: Dict[str, VolunteerRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_volunteer_registry(path: Optional[str] = None) -> VolunteerRegistry:
+    """
+    Get the process-wide registry for a file, loading it on first use.
+
+    Args:
+        path: Path of the registry file, PICKUP_VOLUNTEER_FILE or user_data.json if None
+
+    Returns:
+        The shared registry
+    """
+    path = path or os.environ.get("PICKUP_VOLUNTEER_FILE", DEFAULT_REGISTRY_PATH)
+    with _registries_lock:
+        registry = _registries.get(path)
+        if registry is None:
+            registry = VolunteerRegistry(path)
+            _registries[path] = registry
+        return registry
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the volunteers who are messaged directly about new requests.")
+    parser.add_argument("--file", default=None, help="Registry file, defaults to PICKUP_VOLUNTEER_FILE or user_data.json")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="Register a volunteer or update their details")
+    add.add_argument("user_id", type=int, help="Telegram user ID")
+    add.add_argument("first_name")
+    add.add_argument("--username", default="")
+    add.add_argument("--area", action="append", default=[], help="Area the volunteer covers, repeatable")
+    add.add_argument("--slot", action="append", choices=TIME_SLOTS + (ANY_SLOT,),
+                     help="Time slot the volunteer is available in, repeatable; any time if omitted")
+
+    remove = commands.add_parser("remove", help="Unregister a volunteer")
+    remove.add_argument("user_id", type=int)
+
+    find = commands.add_parser("find", help="Show who would be messaged for a request")
+    find.add_argument("location")
+    find.add_argument("pick_up_time", choices=TIME_SLOTS)
+    find.add_argument("--limit", type=int, default=10)
+
+    args = parser.parse_args()
+    registry = get_volunteer_registry(args.file)
+
+    if args.command == "add":
+        print(registry.register(args.user_id, args.first_name, args.username, args.area, args.slot or (ANY_SLOT,)))
+    elif args.command == "remove":
+        print("Removed" if registry.remove(args.user_id) else "Not registered")
+    else:
+        for volunteer in registry.find(args.location, args.pick_up_time, args.limit):
+            print(f"{volunteer['id']}: {volunteer['first_name']} (areas: {', '.join(volunteer['areas'])}, "
+                  f"slots: {', '.join(volunteer['slots'])}, claims: {volunteer['claims']})")
+
+
+if __name__ == "__main__":
+    main()
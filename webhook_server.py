@@ -0,0 +1,178 @@
+import argparse
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from update_dispatcher import get_dispatcher
+
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8443
+DEFAULT_PATH = "/telegram/webhook"
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Telegram never sends more than this per update; larger bodies are rejected unread
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Accepts update POSTs from Telegram and hands them to the server's callback."""
+
+    server: "WebhookServer"
+
+    def do_POST(self) -> None:
+        if self.path != self.server.webhook_path:
+            self._reply(404)
+            return
+
+        secret = self.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(secret.encode(), self.server.secret_token.encode()):
+            self._reply(403)
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._reply(400)
+            return
+
+        try:
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._reply(400)
+            return
+        if not isinstance(update, dict) or "update_id" not in update:
+            self._reply(400)
+            return
+
+        try:
+            self.server.on_update(update)
+        except Exception as e:
+            # Telegram retries non-2xx replies, which would not help here
+            print(f"Failed to handle update {update['update_id']}: {e}")
+        self._reply(200)
+
+    def _reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Update bodies may contain personal data, so requests are not logged
+        pass
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, on_update: Callable[[Dict[str, Any]], Any], secret_token: str,
+                 host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, path: str = DEFAULT_PATH):
+        """
+        Initialize the webhook receiver.
+
+        Args:
+            on_update: Function receiving each verified update, e.g. UpdateDispatcher.dispatch
+            secret_token: Secret Telegram sends in the X-Telegram-Bot-Api-Secret-Token header
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+            path: URL path the webhook is registered with
+        """
+        if not secret_token:
+            raise ValueError("A webhook secret token is required")
+        super().__init__((host, port), _WebhookHandler)
+        self.on_update = on_update
+        self.secret_token = secret_token
+        self.webhook_path = path
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Local URL of the webhook endpoint."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{self.webhook_path}"
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="telegram-webhook")
+        self._thread.daemon = True
+        self._thread.start()
+        print(f"Webhook receiver listening on {self.url}")
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+
+def start_webhook_mode(bot: Any, public_url: str, secret_token: str, host: str = DEFAULT_HOST,
+                       port: int = DEFAULT_PORT, path: str = DEFAULT_PATH) -> WebhookServer:
+    """
+    Switch a bot from getUpdates polling to webhook ingestion.
+
+    Registers the webhook with Telegram, stops the dispatcher's polling and
+    starts a local receiver that routes updates straight to waiting requests.
+    Sync and async bots of a token share its dispatcher, so this switches
+    both of them.
+
+    Args:
+        bot: TelegramPickupBot or AsyncTelegramPickupBot whose dispatcher should receive the updates
+        public_url: HTTPS URL under which Telegram reaches the receiver
+        secret_token: Secret shared with Telegram to authenticate the requests
+        host: Interface to listen on
+        port: Port to listen on
+        path: URL path of the receiver
+
+    Returns:
+        The running webhook server
+    """
+    dispatcher = get_dispatcher(bot.TOKEN, bot.get_bot_updates)
+    server = WebhookServer(dispatcher.dispatch, secret_token, host=host, port=port, path=path)
+    dispatcher.use_webhook()
+    server.start()
+    if not bot.set_bot_webhook(public_url, secret_token):
+        server.stop()
+        raise RuntimeError("Failed to register the webhook with Telegram")
+    return server
+
+
+def replay_updates(url: str, secret_token: str, updates: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+    """
+    POST recorded updates to a webhook receiver, as Telegram would.
+
+    Args:
+        url: URL of the webhook receiver
+        secret_token: Secret token the receiver expects
+        updates: Update objects, e.g. the "result" list of a recorded getUpdates response
+
+    Returns:
+        List of (update ID, HTTP status) pairs
+    """
+    statuses = []
+    with requests.Session() as session:
+        for update in updates:
+            response = session.post(url, json=update, headers={SECRET_HEADER: secret_token}, timeout=10)
+            statuses.append((update.get("update_id"), response.status_code))
+    return statuses
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates to a local webhook receiver.")
+    parser.add_argument("updates_file", help="JSON file with a list of updates or a getUpdates response")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}{DEFAULT_PATH}")
+    parser.add_argument("--secret", required=True, help="Secret token of the receiver")
+    args = parser.parse_args()
+
+    with open(args.updates_file) as f:
+        payload = json.load(f)
+    updates = payload["result"] if isinstance(payload, dict) else payload
+
+    for update_id, status in replay_updates(args.url, args.secret, updates):
+        print(f"Update {update_id}: HTTP {status}")
+
+
+if __name__ == "__main__":
+    main()